@@ -0,0 +1,57 @@
+"""
+Solve rate and tracking of event-triggered vs. every-tick MPC
+
+Every course is driven twice headless, solving every tick and with
+EVENT_TRIGGER, which reuses the last plan while it is valid. Per course
+it reports the solves, the reduction of the solve rate and the tracking
+penalty: the change of the RMS lateral error and of the lap time.
+
+Usage:
+    python benchmarks/event_trigger.py
+    python benchmarks/event_trigger.py -t Straight Eternity --max-age 2
+"""
+import argparse
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def main():
+    sys.path.insert(0, str(ROOT))
+    import mpc
+    from benchmarks.suite import run_course
+    from course_registry import COURSES
+    from trajectory_config import TRAJECTORIES
+
+    parser = argparse.ArgumentParser(description='Benchmark event-triggered MPC')
+    parser.add_argument('--trajectories', '-t', nargs='+', default=list(TRAJECTORIES),
+                        choices=list(TRAJECTORIES), metavar='NAME',
+                        help='Trajectories to run (default: all)')
+    parser.add_argument('--max-age', type=int, default=mpc.EVENT_MAX_AGE,
+                        help=f'Max ticks a plan is reused (default: {mpc.EVENT_MAX_AGE})')
+    parser.add_argument('--max-time', type=float, default=100.0,
+                        help='Max simulated time per run in s (default: 100)')
+    args = parser.parse_args()
+
+    mpc.MAX_TIME = args.max_time
+    mpc.set_params(EVENT_MAX_AGE=args.max_age)
+
+    print(f"{'course':<10}{'ticks':>7}{'solves':>8}{'rate':>7}{'saved':>8}"
+          f"{'RMS CTE [m]':>17}{'time [s]':>17}")
+    for name in args.trajectories:
+        course = COURSES.get(name)
+        mpc.set_params(EVENT_TRIGGER=False)
+        every = run_course(mpc, course).summary(course.cx, course.cy)
+        mpc.set_params(EVENT_TRIGGER=True)
+        event = run_course(mpc, course).summary(course.cx, course.cy)
+
+        saved = 1.0 - event["solves"] / every["solves"]
+        print(f"{name:<10}{event['steps'] - 1:>7}{event['solves']:>8}"
+              f"{event['solve_rate']:>7.0%}{saved:>8.0%}"
+              f"{every['rms_lateral_error']:>8.3f} ->{event['rms_lateral_error']:>6.3f}"
+              f"{every['duration']:>8.1f} ->{event['duration']:>6.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Iterations, solve time and tracking of the global vs. frenet formulation
+
+Every course is driven headless with both MPC models (see
+mpc.FORMULATION). Per course and formulation it reports the QP solves per
+tick, the solve time per tick, the RMS lateral error, the time driven and
+whether the run reached the goal.
+
+Usage:
+    python benchmarks/formulation.py
+    python benchmarks/formulation.py -t Eternity Slalom --horizon 10
+"""
+import argparse
+import pathlib
+import sys
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def main():
+    sys.path.insert(0, str(ROOT))
+    import mpc
+    from benchmarks.suite import run_course
+    from course_registry import COURSES
+    from trajectory_config import TRAJECTORIES
+    from utils.profiler import PhaseProfiler
+
+    parser = argparse.ArgumentParser(description='Benchmark the MPC formulations')
+    parser.add_argument('--trajectories', '-t', nargs='+', default=list(TRAJECTORIES),
+                        choices=list(TRAJECTORIES), metavar='NAME',
+                        help='Trajectories to run (default: all)')
+    parser.add_argument('--horizon', type=int, default=mpc.T,
+                        help=f'Horizon length T (default: {mpc.T})')
+    parser.add_argument('--max-time', type=float, default=100.0,
+                        help='Max simulated time per run in s (default: 100)')
+    args = parser.parse_args()
+
+    mpc.MAX_TIME = args.max_time
+    mpc.set_params(T=args.horizon)
+
+    print(f"T={args.horizon}")
+    print(f"{'course':<10}{'model':<8}{'QPs/tick':>9}{'solve p50':>11}{'p95 [ms]':>10}"
+          f"{'RMS CTE [m]':>13}{'time [s]':>10}{'goal':>6}")
+    for name in args.trajectories:
+        course = COURSES.get(name)
+        for formulation in mpc.FORMULATIONS:
+            mpc.set_params(FORMULATION=formulation)
+            profiler = PhaseProfiler()
+            result = run_course(mpc, course, profiler)
+            summary = result.summary(course.cx, course.cy)
+            records = profiler.records()
+            solve = records["solve"][records["solve"] > 0]  # ticks with a solve
+            print(f"{name:<10}{formulation:<8}{np.mean(records['iterations']):>9.2f}"
+                  f"{np.percentile(solve, 50) * 1e3:>11.2f}"
+                  f"{np.percentile(solve, 95) * 1e3:>10.2f}"
+                  f"{summary['rms_lateral_error']:>13.3f}{summary['duration']:>10.1f}"
+                  f"{'yes' if result.termination == result.END_GOAL else 'no':>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Startup and throughput of headless vs. animated simulation runs
+
+Every measurement runs in a fresh interpreter, so import times are cold
+and the headless run proves it never loads matplotlib.
+
+Usage:
+    python benchmarks/headless.py --trajectory Eternity --max-time 20
+"""
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Runs in the child interpreter, prints one JSON line
+_WORKER = r"""
+import json, sys, time
+start = time.perf_counter()
+import mpc
+import_time = time.perf_counter() - start
+loaded = {name: name in sys.modules for name in ("matplotlib", "cvxpy")}
+
+mode, trajectory, max_time = sys.argv[1], sys.argv[2], float(sys.argv[3])
+if mode == "import":
+    print(json.dumps(dict(import_time=import_time, loaded=loaded)))
+    sys.exit()
+if mode == "animated":
+    import matplotlib
+    matplotlib.use("Agg")  # draw every frame, but without a window
+
+from course_registry import COURSES
+mpc.show_animation = mode == "animated"
+mpc.MAX_TIME = max_time
+course = COURSES.get(trajectory)
+state = mpc.State(x=course.cx[0], y=course.cy[0], yaw=course.cyaw[0], v=0.0)
+start = time.perf_counter()
+result = mpc.do_simulation(course.cx, course.cy, course.cyaw, course.ck,
+                           course.sp, course.dl, state)
+elapsed = time.perf_counter() - start
+loaded = {name: name in sys.modules for name in ("matplotlib", "cvxpy")}
+print(json.dumps(dict(import_time=import_time, loaded=loaded,
+                      steps=len(result) - 1, elapsed=elapsed)))
+"""
+
+
+def run_worker(mode, trajectory, max_time):
+    out = subprocess.run(
+        [sys.executable, "-c", _WORKER, mode, trajectory, str(max_time)],
+        cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark headless vs. animated runs')
+    parser.add_argument('--trajectory', '-t', default='Eternity')
+    parser.add_argument('--max-time', type=float, default=20.0,
+                        help='Simulated time per run in s (default: 20)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Cold imports to average (default: 3)')
+    args = parser.parse_args()
+
+    imports = [run_worker("import", args.trajectory, 0) for _ in range(args.repeat)]
+    import_time = sum(r["import_time"] for r in imports) / len(imports)
+    print(f"import mpc: {import_time * 1000:.0f} ms, loaded: {imports[0]['loaded']}")
+
+    for mode in ("headless", "animated"):
+        r = run_worker(mode, args.trajectory, args.max_time)
+        print(f"{mode:>9}: {r['steps']} steps in {r['elapsed']:.2f} s, "
+              f"{r['steps'] / r['elapsed']:.1f} steps/s, loaded: {r['loaded']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Solve time against tracking error of move-blocking patterns
+
+Every pattern of input blocks (see mpc.MOVE_BLOCKS) drives every course
+headless with the same horizon. Per pattern it reports the inputs of the
+QP, the solve time per tick, the RMS lateral error over all courses and
+how many courses were driven to the goal.
+
+Usage:
+    python benchmarks/move_blocking.py
+    python benchmarks/move_blocking.py --horizon 10 --patterns none 2 1,1,2,3,3
+    python benchmarks/move_blocking.py --horizon 6 --horizon-dt 0.2 0.2 0.4 0.6 0.6 0.6
+"""
+import argparse
+import pathlib
+import sys
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def pattern(value):
+    """Block lengths like "1,1,2,4", or None for "none" """
+    return None if value == "none" else tuple(int(n) for n in value.split(","))
+
+
+def main():
+    sys.path.insert(0, str(ROOT))
+    import mpc
+    from benchmarks.suite import run_course
+    from course_registry import COURSES
+    from trajectory_config import TRAJECTORIES
+    from utils.profiler import PhaseProfiler
+
+    parser = argparse.ArgumentParser(description='Benchmark move-blocking patterns')
+    parser.add_argument('--trajectories', '-t', nargs='+', default=list(TRAJECTORIES),
+                        choices=list(TRAJECTORIES), metavar='NAME',
+                        help='Trajectories to run (default: all)')
+    parser.add_argument('--horizon', type=int, default=mpc.T,
+                        help=f'Horizon length T (default: {mpc.T})')
+    parser.add_argument('--horizon-dt', type=float, nargs='+', default=None,
+                        metavar='STEP', help='Step of every horizon stage in s')
+    parser.add_argument('--patterns', nargs='+', type=pattern,
+                        default=[None, (1, 1, 2), (1, 2), (2,), (1, 1, 4)],
+                        help='Block lengths like 1,1,2 or none (default: none 1,1,2 1,2 2 1,1,4)')
+    parser.add_argument('--max-time', type=float, default=100.0,
+                        help='Max simulated time per run in s (default: 100)')
+    args = parser.parse_args()
+
+    mpc.MAX_TIME = args.max_time
+    mpc.set_params(T=args.horizon, HORIZON_DT=args.horizon_dt)
+    courses = [COURSES.get(name) for name in args.trajectories]
+
+    print(f"T={args.horizon}, {len(courses)} courses")
+    print(f"{'blocks':<14}{'inputs':>7}{'solve p50':>11}{'p95 [ms]':>10}"
+          f"{'RMS CTE [m]':>13}{'goal':>7}")
+    for blocks in args.patterns:
+        mpc.set_params(MOVE_BLOCKS=blocks)
+        profiler = PhaseProfiler()
+        results = [run_course(mpc, course, profiler) for course in courses]
+        errors = np.concatenate([result.recorded_lateral_errors() for result in results])
+        goals = [result.termination == result.END_GOAL for result in results]
+        solve = profiler.records()["solve"]
+        solve = solve[solve > 0]  # ticks with a solve
+        inputs = mpc.NU * len(mpc.move_blocks(args.horizon) or range(args.horizon))
+        label = "none" if blocks is None else ",".join(map(str, blocks))
+        print(f"{label:<14}{inputs:>7}{np.percentile(solve, 50) * 1e3:>11.2f}"
+              f"{np.percentile(solve, 95) * 1e3:>10.2f}"
+              f"{np.sqrt(np.mean(errors ** 2)):>13.3f}{sum(goals):>4}/{len(goals)}")
+
+
+if __name__ == '__main__':
+    main()
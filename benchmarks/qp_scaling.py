@@ -0,0 +1,124 @@
+"""
+Solver iterations and latency of the QP with and without scaling
+
+Every course is driven headless with every QP solver and formulation,
+once as built and once with QP_SCALING (see mpc.qp_scaling). Per solver
+and formulation it reports the solver iterations per QP, the time the
+solver itself reports per QP, the solve time per tick and the RMS lateral
+error over all courses, unscaled -> scaled. Scaling must not change the
+solution: the largest difference of the planned inputs between the
+unscaled and the scaled QP, solved off a few points of every course, is
+reported and flagged with "!" above the tolerance.
+
+Usage:
+    python benchmarks/qp_scaling.py
+    python benchmarks/qp_scaling.py -t Eternity Slalom --solvers OSQP SCS
+"""
+import argparse
+import contextlib
+import io
+import pathlib
+import sys
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def plan_inputs(mpc, course, cyaw, i):
+    """Planned acceleration and steering off course point i, at the current settings"""
+    # off the course and moving, so the plan is not trivial
+    state = mpc.State(x=course.cx[i] + 0.3, y=course.cy[i] - 0.2, yaw=cyaw[i] + 0.05, v=3.0)
+    ind, _ = mpc.calc_nearest_index(state, course.cx, course.cy, cyaw, max(i - 5, 0))
+    with contextlib.redirect_stdout(io.StringIO()):  # "max iter"
+        if mpc.FORMULATION == "frenet":
+            xref, _, kref, vbar, z0 = mpc.calc_frenet_reference(
+                state, course.cx, course.cy, cyaw, course.ck, course.sp, course.dl,
+                ind, None, course.cs)
+            oa, odelta, *_ = mpc.frenet_mpc_control(xref, kref, vbar, z0)
+        else:
+            xref, _, dref = mpc.calc_ref_trajectory(
+                state, course.cx, course.cy, cyaw, course.ck, course.sp, course.dl,
+                ind, course.cs)
+            oa, odelta, *_ = mpc.iterative_linear_mpc_control(
+                xref, [state.x, state.y, state.v, state.yaw], dref, None, None)
+    return None if oa is None else np.concatenate((oa, odelta))
+
+
+def input_difference(courses, mpc, points=4):
+    """Largest difference of the planned inputs, unscaled vs. scaled QP"""
+    difference = 0.0
+    for course in courses:
+        cyaw = mpc.smooth_yaw(course.cyaw)
+        for i in np.linspace(0, len(course.cx) - 1, points, endpoint=False).astype(int):
+            plans = []
+            for scaling in (False, True):
+                mpc.set_params(QP_SCALING=scaling)
+                plans.append(plan_inputs(mpc, course, cyaw, i))
+            if plans[0] is None or plans[1] is None:  # unsolved
+                if plans[0] is not plans[1]:
+                    difference = np.inf
+                continue
+            difference = max(difference, np.max(np.abs(plans[0] - plans[1])))
+    return difference
+
+
+def measure(courses, mpc, run_course, PhaseProfiler):
+    """Iterations per QP, solver time per QP [s], solve time per tick [s] and RMS CTE"""
+    profiler = PhaseProfiler()
+    results = [run_course(mpc, course, profiler) for course in courses]
+    errors = np.concatenate([result.recorded_lateral_errors() for result in results])
+    records = profiler.records()
+    solved = records["iterations"] > 0  # ticks with a solve
+    qps = records["iterations"][solved]
+    return (np.sum(records["qp_iters"]) / np.sum(qps),
+            np.percentile(records["solver"][solved] / qps, 50),
+            np.percentile(records["solve"][solved], 50),
+            np.sqrt(np.mean(errors ** 2)))
+
+
+def main():
+    sys.path.insert(0, str(ROOT))
+    import mpc
+    from benchmarks.suite import installed_solvers, run_course
+    from course_registry import COURSES
+    from trajectory_config import TRAJECTORIES
+    from utils.profiler import PhaseProfiler
+
+    parser = argparse.ArgumentParser(description='Benchmark the QP scaling')
+    parser.add_argument('--trajectories', '-t', nargs='+', default=list(TRAJECTORIES),
+                        choices=list(TRAJECTORIES), metavar='NAME',
+                        help='Trajectories to run (default: all)')
+    parser.add_argument('--solvers', nargs='+', default=None,
+                        help='cvxpy solvers (default: the installed QP solvers)')
+    parser.add_argument('--max-time', type=float, default=60.0,
+                        help='Max simulated time per run in s (default: 60)')
+    parser.add_argument('--tolerance', type=float, default=1e-2,
+                        help='Max input difference of the scaled QP (default: 1e-2)')
+    args = parser.parse_args()
+
+    mpc.MAX_TIME = args.max_time
+    courses = [COURSES.get(name) for name in args.trajectories]
+
+    print(f"{len(courses)} courses, unscaled -> scaled")
+    print(f"{'solver':<10}{'model':<8}{'iters/QP':>16}{'solver/QP [ms]':>18}"
+          f"{'solve p50 [ms]':>18}{'RMS CTE [m]':>18}{'max |du|':>11}")
+    for solver in args.solvers or installed_solvers():
+        mpc.set_params(SOLVER=solver)
+        for formulation in mpc.FORMULATIONS:
+            mpc.set_params(FORMULATION=formulation)
+            difference = input_difference(courses, mpc)
+            rows = []
+            for scaling in (False, True):
+                mpc.set_params(QP_SCALING=scaling)
+                rows.append(measure(courses, mpc, run_course, PhaseProfiler))
+            (it0, qp0, solve0, rms0), (it1, qp1, solve1, rms1) = rows
+            flag = "!" if difference > args.tolerance else ""
+            print(f"{solver:<10}{formulation:<8}{it0:>7.1f} ->{it1:>6.1f}"
+                  f"{qp0 * 1e3:>9.3f} ->{qp1 * 1e3:>6.3f}"
+                  f"{solve0 * 1e3:>9.2f} ->{solve1 * 1e3:>6.2f}"
+                  f"{rms0:>9.3f} ->{rms1:>6.3f}{difference:>10.1e}{flag}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Benchmark suite over trajectories, horizons, time ticks and solvers
+
+Every case (trajectory, T, DT, solver) runs headless in a fresh
+interpreter, so the peak memory is the case's own and no case warms up
+the caches of the next one. Per case it measures:
+
+    spline_time     compiling the course from its waypoints, no cache [s]
+    steps_per_s     simulated control ticks per second of wall time
+    solve           per-solve latency p50/p95/max/mean [s]
+    tick            whole control tick p50/p95/max/mean [s]
+    peak_rss_mb     peak resident memory of the process [MB]
+
+The results are written as JSON. Given a baseline (an earlier results
+file), cases slower or bigger than the baseline by more than the
+threshold are flagged as regressions and the exit code is 1.
+
+Usage:
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --output new.json --baseline baseline.json
+    python benchmarks/suite.py --compare new.json --baseline baseline.json
+    python benchmarks/suite.py -t Eternity Slalom --horizons 5 adaptive --solvers OSQP
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# QP capable cvxpy solvers, the installed ones are benchmarked by default
+QP_SOLVERS = ("CLARABEL", "OSQP", "SCS", "ECOS", "PIQP", "PROXQP", "QOCO",
+              "DAQP", "MOSEK", "GUROBI")
+
+# metric, its key in a case, and whether larger is better
+METRICS = (
+    ("steps/s", ("steps_per_s",), True),
+    ("solve p50", ("solve", "p50"), False),
+    ("solve p95", ("solve", "p95"), False),
+    ("tick p95", ("tick", "p95"), False),
+    ("spline", ("spline_time",), False),
+    ("peak RSS", ("peak_rss_mb",), False),
+)
+
+# Runs in the child interpreter, prints one JSON line
+_WORKER = r"""
+import json, sys, time
+case = json.loads(sys.argv[1])
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import mpc
+from course_registry import compile_course
+from trajectory_config import TRAJECTORIES
+from utils.profiler import PhaseProfiler
+
+try:
+    mpc.MAX_TIME = case["max_time"]
+    if case["T"] == "adaptive":
+        mpc.set_params(ADAPTIVE_HORIZON=True, DT=case["DT"], SOLVER=case["solver"])
+    else:
+        mpc.set_params(T=case["T"], DT=case["DT"], SOLVER=case["solver"])
+
+    waypoints = TRAJECTORIES[case["trajectory"]]()
+    start = time.perf_counter()
+    course = compile_course(case["trajectory"], waypoints, dl=case["dl"])
+    spline_time = time.perf_counter() - start
+
+    state = mpc.State(x=course.cx[0], y=course.cy[0], yaw=course.cyaw[0], v=0.0)
+    profiler = PhaseProfiler()
+    start = time.perf_counter()
+    result = mpc.do_simulation(course.cx, course.cy, course.cyaw, course.ck,
+                               course.sp, course.dl, state, course.cs,
+                               animate=False, profiler=profiler)
+    elapsed = time.perf_counter() - start
+except Exception as e:
+    print(json.dumps(dict(error=f"{type(e).__name__}: {e}")))
+    sys.exit()
+
+peak_rss_mb = None
+if resource is not None:
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+summary = profiler.summary()
+print(json.dumps(dict(points=len(course), steps=len(result) - 1,
+                      elapsed=elapsed, steps_per_s=len(profiler) / elapsed,
+                      spline_time=spline_time, peak_rss_mb=peak_rss_mb,
+                      solve=summary["solve"], tick=summary["total"],
+                      iterations=summary["iterations"]["mean"])))
+"""
+
+
+def horizon(value):
+    """A horizon length T or "adaptive", see mpc.ADAPTIVE_HORIZON"""
+    return value if value == "adaptive" else int(value)
+
+
+def case_key(case):
+    return (case["trajectory"], case["T"], case["DT"], case["solver"])
+
+
+def case_name(case):
+    return f"{case['trajectory']} T={case['T']} DT={case['DT']} {case['solver']}"
+
+
+def run_case(case):
+    """Run one case in a fresh interpreter, the case updated with its results"""
+    out = subprocess.run(
+        [sys.executable, "-c", _WORKER, json.dumps(case)],
+        cwd=ROOT, capture_output=True, text=True)
+    lines = out.stdout.strip().splitlines()
+    try:
+        results = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        stderr = out.stderr.strip().splitlines()
+        results = dict(error=stderr[-1] if stderr else f"exit code {out.returncode}")
+    return dict(case, **results)
+
+
+def best_run(runs):
+    """The run with the most steps per second, failed runs only if all failed"""
+    ok = [run for run in runs if "error" not in run]
+    return max(ok, key=lambda run: run["steps_per_s"]) if ok else runs[-1]
+
+
+def _value(case, key):
+    value = case
+    for part in key:
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions of results against a baseline
+
+    Parameters
+    ----------
+    results, baseline : dict
+        contents of two results files.
+    threshold : float
+        relative change that counts as a regression, e.g. 0.1 for 10 %.
+
+    Returns
+    -------
+    regressions : list of str
+        one line per regressed metric of a case, or a case that failed
+        although it ran in the baseline.
+    """
+    previous = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = previous.get(case_key(case))
+        if old is None or "error" in old:
+            continue
+        if "error" in case:
+            regressions.append(f"{case_name(case)}: failed, {case['error']}")
+            continue
+        for label, key, larger_is_better in METRICS:
+            new_value, old_value = _value(case, key), _value(old, key)
+            if not new_value or not old_value:
+                continue
+            change = new_value / old_value - 1.0
+            if (-change if larger_is_better else change) > threshold:
+                regressions.append(f"{case_name(case)}: {label} {old_value:.4g} -> "
+                                   f"{new_value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def format_case(case):
+    if "error" in case:
+        return f"{case_name(case):<40} error: {case['error']}"
+    rss = f"{case['peak_rss_mb']:.0f} MB" if case["peak_rss_mb"] is not None else "n/a"
+    return (f"{case_name(case):<40} {case['steps_per_s']:7.1f} steps/s  "
+            f"solve p50 {case['solve']['p50'] * 1e3:6.2f} ms  "
+            f"p95 {case['solve']['p95'] * 1e3:6.2f} ms  "
+            f"spline {case['spline_time'] * 1e3:6.1f} ms  {rss}")
+
+
+def installed_solvers():
+    import cvxpy
+    installed = set(cvxpy.installed_solvers())
+    return [solver for solver in QP_SOLVERS if solver in installed]
+
+
+def run_course(mpc, course, profiler=None):
+    """
+    Drive a compiled course headless from standstill, the SimulationResult
+
+    Used by the benchmark scripts comparing settings in one interpreter,
+    whether the run reached the goal is its termination.
+    """
+    state = mpc.State(x=course.cx[0], y=course.cy[0], yaw=course.cyaw[0], v=0.0)
+    with contextlib.redirect_stdout(io.StringIO()):  # "Goal", "max iter"
+        return mpc.do_simulation(course.cx, course.cy, course.cyaw, course.ck,
+                                 course.sp, course.dl, state, course.cs,
+                                 animate=False, profiler=profiler)
+
+
+def main():
+    sys.path.insert(0, str(ROOT))
+    from trajectory_config import TRAJECTORIES
+
+    parser = argparse.ArgumentParser(description='Benchmark suite with regression check')
+    parser.add_argument('--trajectories', '-t', nargs='+', default=list(TRAJECTORIES),
+                        choices=list(TRAJECTORIES), metavar='NAME',
+                        help='Trajectories to run (default: all)')
+    parser.add_argument('--horizons', nargs='+', type=horizon,
+                        default=[5, 10, 20, "adaptive"], metavar='T',
+                        help='Horizon lengths or "adaptive" (default: 5 10 20 adaptive)')
+    parser.add_argument('--dts', nargs='+', type=float, default=[0.1, 0.2],
+                        metavar='DT', help='Time ticks in s (default: 0.1 0.2)')
+    parser.add_argument('--solvers', nargs='+', default=None,
+                        help='cvxpy solvers (default: the installed QP solvers)')
+    parser.add_argument('--max-time', type=float, default=30.0,
+                        help='Simulated time per case in s (default: 30)')
+    parser.add_argument('--dl', type=float, default=1.0,
+                        help='Course resolution in m (default: 1.0)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Runs per case, the fastest is kept (default: 1)')
+    parser.add_argument('--output', '-o', default=None, metavar='FILE',
+                        help='Write the results as JSON')
+    parser.add_argument('--baseline', default=None, metavar='FILE',
+                        help='Flag regressions against this results file')
+    parser.add_argument('--compare', default=None, metavar='FILE',
+                        help='Compare this results file to --baseline instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change counted as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    if args.compare:
+        if not args.baseline:
+            parser.error('--compare needs --baseline')
+        results = json.loads(pathlib.Path(args.compare).read_text())
+    else:
+        solvers = args.solvers or installed_solvers()
+        cases = []
+        for trajectory, T, DT, solver in itertools.product(
+                args.trajectories, args.horizons, args.dts, solvers):
+            case = dict(trajectory=trajectory, T=T, DT=DT, solver=solver,
+                        max_time=args.max_time, dl=args.dl)
+            case = best_run([run_case(case) for _ in range(args.repeat)])
+            print(format_case(case), flush=True)
+            cases.append(case)
+
+        results = dict(
+            created=datetime.datetime.now().isoformat(timespec="seconds"),
+            python=platform.python_version(), platform=platform.platform(),
+            cpu_count=os.cpu_count(), repeat=args.repeat, cases=cases)
+        if args.output:
+            pathlib.Path(args.output).write_text(json.dumps(results, indent=1))
+            print(f"Wrote {len(cases)} cases to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"{len(regressions)} regressions against {args.baseline} "
+              f"(threshold {args.threshold:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Registry of compiled courses
+
+Every named trajectory in `trajectory_config.TRAJECTORIES` is compiled on
+first use: waypoints, spline, yaw smoothing and speed profile. The result
+is kept in memory and persisted in a versioned on-disk cache, so the CLI
+and the GUI do not re-spline the same course on every start. New
+trajectories plug in by adding them to TRAJECTORIES as before.
+"""
+import hashlib
+import os
+import pathlib
+import threading
+
+import numpy as np
+
+from utils import cubic_spline_planner
+from utils.course import calc_speed_profile, smooth_yaw
+from trajectory_config import TRAJECTORIES
+
+# Bump when the compiled course content changes, old cache files are ignored
+CACHE_VERSION = 1
+
+CACHE_DIR = pathlib.Path(os.environ.get(
+    "MPC_COURSE_CACHE",
+    pathlib.Path.home() / ".cache" / "mpc_iv_course" / "courses"))
+
+
+class Course:
+    """
+    compiled course
+
+    cx, cy, cyaw, ck, s and sp are lists like the ones returned by
+    `cubic_spline_planner.calc_spline_course`, cyaw is already smoothed.
+    """
+
+    def __init__(self, name, cx, cy, cyaw, ck, s, sp, dl, adaptive=False,
+                 loop=False):
+        self.name = name
+        self.cx = cx
+        self.cy = cy
+        self.cyaw = cyaw
+        self.ck = ck
+        self.s = s
+        self.sp = sp
+        self.dl = dl
+        self.adaptive = adaptive
+        self.loop = loop
+
+    @property
+    def cs(self):
+        """arc length for `mpc.do_simulation`, only needed for adaptive courses"""
+        return self.s if self.adaptive else None
+
+    def __len__(self):
+        return len(self.cx)
+
+
+def compile_course(name, waypoints, dl=1.0, target_speed=10.0 / 3.6,
+                   adaptive=False, max_error=0.05, loop=False):
+    """
+    Spline the waypoints, smooth the yaw and calc the speed profile
+
+    A `loop` course is splined as a closed path with a smooth seam and
+    keeps the target speed at its end.
+    """
+    ax = [point[0] for point in waypoints]
+    ay = [point[1] for point in waypoints]
+
+    if adaptive:
+        cx, cy, cyaw, ck, s = cubic_spline_planner.calc_adaptive_spline_course(
+            ax, ay, max_error=max_error, closed=loop)
+    else:
+        cx, cy, cyaw, ck, s = cubic_spline_planner.calc_spline_course(
+            ax, ay, ds=dl, closed=loop)
+
+    cyaw = smooth_yaw(cyaw)
+    sp = calc_speed_profile(cx, cy, cyaw, target_speed, loop=loop)
+
+    return Course(name, cx, cy, cyaw, ck, s, sp, dl, adaptive=adaptive,
+                  loop=loop)
+
+
+class CourseRegistry:
+    """
+    Lazily compiled, disk cached courses
+
+    Parameters
+    ----------
+    trajectories : dict
+        maps names to functions returning (x, y) waypoints, by default
+        `trajectory_config.TRAJECTORIES`. It is looked up on every call,
+        so trajectories added later are found as well.
+    cache_dir : pathlib.Path or None
+        directory of the on-disk cache. None disables it.
+    """
+
+    _FIELDS = ("cx", "cy", "cyaw", "ck", "s", "sp")
+
+    def __init__(self, trajectories=None, cache_dir=CACHE_DIR):
+        self.trajectories = TRAJECTORIES if trajectories is None else trajectories
+        self.cache_dir = None if cache_dir is None else pathlib.Path(cache_dir)
+        self._courses = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return list(self.trajectories.keys())
+
+    def get(self, name, dl=1.0, target_speed=10.0 / 3.6, adaptive=False,
+            max_error=0.05, loop=False):
+        """
+        Get a compiled course, compiling it on first use
+
+        The key includes the waypoints themselves, so editing a trajectory
+        (e.g. the GUI's Custom one) compiles it again.
+        """
+        waypoints = self.trajectories[name]()
+        params = (float(dl), float(target_speed), bool(adaptive),
+                  float(max_error), bool(loop))
+        key = self._key(name, waypoints, params)
+
+        with self._lock:
+            course = self._courses.get(key)
+            if course is not None:
+                return course
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        with lock:  # compile each course once, even from several threads
+            course = self._courses.get(key)
+            if course is None:
+                course = self._load(name, key, params)
+            if course is None:
+                course = compile_course(name, waypoints, *params)
+                self._save(key, course)
+            self._courses[key] = course
+
+        return course
+
+    def prewarm(self, names=None, **params):
+        """
+        Compile courses in a background thread
+
+        Returns the started daemon thread. Errors of single courses are
+        ignored, they show up again when the course is requested.
+        """
+        names = self.names() if names is None else list(names)
+
+        def run():
+            for name in names:
+                try:
+                    self.get(name, **params)
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=run, name="course-prewarm",
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def clear(self):
+        """Forget the in-memory courses, the disk cache is kept"""
+        with self._lock:
+            self._courses.clear()
+            self._locks.clear()
+
+    @staticmethod
+    def _key(name, waypoints, params):
+        h = hashlib.sha1()
+        h.update(f"v{CACHE_VERSION}:{name}:{params}".encode())
+        h.update(np.asarray(waypoints, dtype=float).tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"v{CACHE_VERSION}" / f"{key}.npz"
+
+    def _load(self, name, key, params):
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != CACHE_VERSION:
+                    return None
+                fields = [data[field].tolist() for field in self._FIELDS]
+        except Exception:
+            return None  # unreadable cache file, compile again
+        dl, _, adaptive, _, loop = params
+        return Course(name, *fields, dl, adaptive=adaptive, loop=loop)
+
+    def _save(self, key, course):
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+            np.savez(tmp, version=CACHE_VERSION,
+                     **{field: np.asarray(getattr(course, field), dtype=float)
+                        for field in self._FIELDS})
+            os.replace(tmp, path)  # readers never see a partial file
+        except OSError:
+            pass  # the cache is only an optimization
+
+
+# Shared registry used by the CLI and the GUI
+COURSES = CourseRegistry()
@@ -6,18 +6,42 @@ from tkinter import ttk, messagebox, scrolledtext
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.lines import Line2D
 import sys
 import pathlib
 import time
 import importlib
+import queue
 
 # Add the parent directory to the path
 sys.path.append(str(pathlib.Path(__file__).parent.parent))
 
 # Import from the project
-from utils import cubic_spline_planner
 import mpc
 from trajectory_config import TRAJECTORIES
+from course_registry import COURSES
+from gui.worker import SimulationWorker
+from utils.compare import Comparison, comparison_metrics
+from utils.cubic_spline_planner import IncrementalSplineCourse
+from utils.live_view import LiveView
+from utils.lod import plot_lod
+from utils.profiler import PhaseProfiler
+
+POLL_INTERVAL_MS = 50  # how often the running simulation is checked
+PROGRESS_LOG_INTERVAL = 5.0  # [s] simulated time between progress log lines
+COMPARE_REDRAW_INTERVAL = 0.25  # [s] between redraws of the comparison plot
+PREVIEW_DEBOUNCE_MS = 300  # wait for the inputs to settle before a new preview
+EDITOR_SPLINE_DS = 1.0  # [m] sampling of the spline shown in the editor
+
+DEFAULT_PRESETS = """\
+# One preset per line, name: PARAMETER=value, ...
+# Parameters in the units of the parameter tabs,
+# the others keep their values from the tabs.
+Current:
+Long horizon: T=10
+Smooth steering: Rd2=10.0
+"""
+COMPARE_STEP_KEYS = ("t", "x", "y", "v", "d", "e_lat", "solve_time")
 
 class MPCTrajectoryGUI:
     def __init__(self, root):
@@ -28,6 +52,20 @@ class MPCTrajectoryGUI:
         # Trajectory points
         self.waypoints = []
         self.last_point_marked = False
+
+        # Running simulation
+        self.sim_worker = None
+        self.live_view = None
+        self.last_result = None
+
+        # Running preset comparison
+        self.comparison = None
+
+        # What the plot shows: None, "preview" or "editor"
+        self.plot_mode = None
+        self.preview_course = None
+        self.preview_after = None
+        self.editor_background = None
         
         # MPC Parameters - Default values from the original code
         self.mpc_params = {
@@ -57,6 +95,9 @@ class MPCTrajectoryGUI:
         self.speed_var.set("10.0")         # 10.0 / 3.6 m/s (as in the original code)
         self.trajectory_var.set("Circular")
         self.update_trajectory_preview()
+        
+        # Compile the other courses in the background so switching is instant
+        COURSES.prewarm(dl=1.0, target_speed=10.0 / 3.6)
     
     def create_widgets(self):
         # Main frame
@@ -91,7 +132,11 @@ class MPCTrajectoryGUI:
         vehicle_params_tab = ttk.Frame(notebook, padding="10")
         notebook.add(vehicle_params_tab, text="Vehicle Parameters")
         
-        # Tab 4: Simulation Log
+        # Tab 4: Preset Comparison
+        compare_tab = ttk.Frame(notebook, padding="10")
+        notebook.add(compare_tab, text="Compare")
+        
+        # Tab 5: Simulation Log
         log_tab = ttk.Frame(notebook, padding="10")
         notebook.add(log_tab, text="Simulation Log")
         
@@ -103,7 +148,7 @@ class MPCTrajectoryGUI:
         trajectory_combo = ttk.Combobox(trajectory_tab, textvariable=self.trajectory_var, 
                                         values=list(TRAJECTORIES.keys()), state="readonly")
         trajectory_combo.pack(fill=tk.X, pady=(0, 10))
-        trajectory_combo.bind("<<ComboboxSelected>>", lambda e: self.update_trajectory_preview())
+        trajectory_combo.bind("<<ComboboxSelected>>", self.schedule_preview)
         
         # Parameters
         params_frame = ttk.LabelFrame(trajectory_tab, text="Trajectory Generation Parameter", padding="10")
@@ -114,6 +159,7 @@ class MPCTrajectoryGUI:
         dl_frame.pack(fill=tk.X, pady=5)
         ttk.Label(dl_frame, text="Points Distance (dl):").pack(side=tk.LEFT)
         self.dl_var = tk.StringVar()
+        self.dl_var.trace_add("write", self.schedule_preview)
         ttk.Entry(dl_frame, textvariable=self.dl_var, width=10).pack(side=tk.RIGHT)
         
         # Speed parameter
@@ -146,8 +192,15 @@ class MPCTrajectoryGUI:
         sim_frame = ttk.Frame(trajectory_tab)
         sim_frame.pack(fill=tk.X, pady=10)
         
-        tk.Button(sim_frame, text="Run Simulation", command=self.run_simulation, 
-          height=3, font=("Arial", 14, "bold"), bg="#4CAF50", fg="Black").pack(fill=tk.X, pady=15)        
+        self.run_button = tk.Button(sim_frame, text="Run Simulation", command=self.run_simulation, 
+          height=3, font=("Arial", 14, "bold"), bg="#4CAF50", fg="Black")
+        self.run_button.pack(fill=tk.X, pady=(15, 5))
+        self.cancel_button = ttk.Button(sim_frame, text="Cancel Simulation",
+                                        command=self.cancel_simulation, state=tk.DISABLED)
+        self.cancel_button.pack(fill=tk.X)
+        self.profile_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(sim_frame, text="Profile control loop phases (report in the log)",
+                        variable=self.profile_var).pack(anchor=tk.W, pady=(5, 0))
         # ======== MPC PARAMETERS TAB =========
         
         # Create a canvas with scrollbar for MPC parameters
@@ -327,6 +380,32 @@ class MPCTrajectoryGUI:
         ttk.Button(vehicle_button_frame, text="Apply Vehicle Parameters", 
                   command=self.apply_vehicle_params).pack(side=tk.LEFT, padx=5)
         
+        # ======== COMPARE TAB =========
+        
+        ttk.Label(compare_tab, text="Parameter presets, run in parallel on the selected trajectory:").pack(anchor=tk.W, pady=(0, 5))
+        self.presets_text = scrolledtext.ScrolledText(compare_tab, wrap=tk.NONE, width=50, height=10)
+        self.presets_text.pack(fill=tk.X, pady=(0, 5))
+        self.presets_text.insert(tk.END, DEFAULT_PRESETS)
+        
+        compare_buttons_frame = ttk.Frame(compare_tab)
+        compare_buttons_frame.pack(fill=tk.X, pady=5)
+        self.compare_button = ttk.Button(compare_buttons_frame, text="Run Comparison",
+                                         command=self.run_comparison)
+        self.compare_button.pack(side=tk.LEFT, padx=2)
+        self.cancel_compare_button = ttk.Button(compare_buttons_frame, text="Cancel",
+                                                command=self.cancel_comparison, state=tk.DISABLED)
+        self.cancel_compare_button.pack(side=tk.LEFT, padx=2)
+        
+        columns = ("preset", "status", "rms", "solve", "misses", "time")
+        self.compare_table = ttk.Treeview(compare_tab, columns=columns, show="headings", height=8)
+        for column, heading, width in zip(columns,
+                                          ("Preset", "Status", "RMS CTE [m]", "Mean solve [ms]",
+                                           "Deadline misses", "Sim time [s]"),
+                                          (120, 70, 80, 100, 100, 80)):
+            self.compare_table.heading(column, text=heading)
+            self.compare_table.column(column, width=width, anchor=tk.W if column == "preset" else tk.E)
+        self.compare_table.pack(fill=tk.BOTH, expand=True, pady=5)
+        
         # ======== LOG TAB =========
         
         # Create a text widget for logging
@@ -351,6 +430,7 @@ class MPCTrajectoryGUI:
         
         # Connect mouse click event
         self.canvas.mpl_connect('button_press_event', self.on_click)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
     
     def log_message(self, message):
         """Add message to the log tab"""
@@ -359,12 +439,34 @@ class MPCTrajectoryGUI:
         self.log_text.see(tk.END)
         self.log_text.config(state=tk.DISABLED)
     
+    def is_busy(self):
+        """True while a simulation or a comparison is running"""
+        return self.sim_worker is not None or self.comparison is not None
+
+    def use_single_plot(self):
+        """Switch the figure back to the single trajectory plot after a comparison"""
+        if len(self.fig.axes) != 1:
+            self.fig.clf()
+            self.ax = self.fig.add_subplot(111)
+            self.plot_mode = None
+    
     def on_click(self, event):
         """Handle click event on the plot to add points for custom trajectory"""
+        if self.is_busy():
+            return  # the plot shows the running simulation
         if event.inaxes == self.ax and not self.last_point_marked:
             # Only add points if we haven't marked a last point
             self.waypoints.append((event.xdata, event.ydata))
-            self.update_plot_with_custom_points()
+            if self.plot_mode == "editor":
+                self.blit_editor(self.add_editor_point(len(self.waypoints) - 1))
+            else:
+                self.update_plot_with_custom_points()
+
+    def on_draw(self, event):
+        """Save the editor background after full redraws and draw the spline tail"""
+        if self.plot_mode == "editor":
+            self.editor_background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self.ax.draw_artist(self.editor_tail)
     
     def clear_points(self):
         """Clear all custom points"""
@@ -389,7 +491,9 @@ class MPCTrajectoryGUI:
         self.update_trajectory_preview()
     
     def update_plot_with_custom_points(self):
-        """Update the plot to show custom points"""
+        """Draw the custom trajectory editor with all points"""
+        self.use_single_plot()
+        self.plot_mode = None
         self.ax.clear()
         self.ax.grid(True)
         self.ax.set_aspect('equal')
@@ -398,22 +502,13 @@ class MPCTrajectoryGUI:
         self.ax.set_xlim(-100, 100)
         self.ax.set_ylim(-100, 100)
         
-        # Plot waypoints
-        if self.waypoints:
-            x_points = [p[0] for p in self.waypoints]
-            y_points = [p[1] for p in self.waypoints]
-            self.ax.plot(x_points, y_points, 'bo-', label="Custom Waypoints")
-            
-            # Annotate points with their index
-            for i, (x, y) in enumerate(self.waypoints):
-                # If this is the last point and marked as last, highlight it
-                if self.last_point_marked and i == len(self.waypoints) - 1:
-                    self.ax.plot(x, y, 'ro', markersize=10, label="Last Point")
-                    self.ax.annotate(f"{i} (Last)", (x, y), textcoords="offset points", 
-                                   xytext=(0, 10), ha='center', color='red', fontweight='bold')
-                else:
-                    self.ax.annotate(str(i), (x, y), textcoords="offset points", 
-                                   xytext=(0, 10), ha='center')
+        # The points are added one by one like clicks, the part of the spline
+        # that still changes with the next point is drawn as animated tail
+        self.editor_spline = IncrementalSplineCourse(ds=EDITOR_SPLINE_DS)
+        self.editor_frozen = 0
+        self.editor_tail, = self.ax.plot([], [], 'r-', animated=True)
+        for i in range(len(self.waypoints)):
+            self.add_editor_point(i)
         
         title = "Trajectory Editor (Fixed -100 to 100 range)"
         if self.last_point_marked:
@@ -424,50 +519,135 @@ class MPCTrajectoryGUI:
         self.ax.set_title(title)
         self.ax.set_xlabel("X [m]")
         self.ax.set_ylabel("Y [m]")
-        self.ax.legend()
+        self.ax.legend(handles=[Line2D([], [], color='b', marker='o', label="Custom Waypoints"),
+                                Line2D([], [], color='r', label="Spline Preview")])
+        self.plot_mode = "editor"
         self.canvas.draw()
+
+    def add_editor_point(self, i):
+        """
+        Add the artists of waypoint i to the editor
+
+        Returns the new artists: the waypoint with its link to the previous
+        one, its annotation and the spline segments that no longer change.
+        The spline tail is updated in place.
+        """
+        x, y = self.waypoints[i]
+        if i == 0:
+            link, = self.ax.plot([x], [y], 'bo')
+        else:
+            px, py = self.waypoints[i - 1]
+            link, = self.ax.plot([px, x], [py, y], 'b-', marker='o', markevery=[1])
+        artists = [link]
+        
+        # If this is the last point and marked as last, highlight it
+        if self.last_point_marked and i == len(self.waypoints) - 1:
+            artists.append(self.ax.plot(x, y, 'ro', markersize=10)[0])
+            artists.append(self.ax.annotate(f"{i} (Last)", (x, y), textcoords="offset points",
+                                            xytext=(0, 10), ha='center', color='red', fontweight='bold'))
+        else:
+            artists.append(self.ax.annotate(str(i), (x, y), textcoords="offset points",
+                                            xytext=(0, 10), ha='center'))
+        
+        spline = self.editor_spline
+        first = spline.append(x, y)
+        for k in range(self.editor_frozen, first):
+            segment = np.vstack((spline.segments[k], [(spline.x[k + 1], spline.y[k + 1])]))
+            artists.append(self.ax.plot(segment[:, 0], segment[:, 1], 'r-')[0])
+        self.editor_frozen = max(self.editor_frozen, first)
+        tail = spline.points(self.editor_frozen)
+        self.editor_tail.set_data(tail[:, 0], tail[:, 1])
+        return artists
+
+    def blit_editor(self, artists):
+        """Draw new editor artists into the background and redraw the spline tail"""
+        if self.editor_background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.editor_background)
+        for artist in artists:
+            self.ax.draw_artist(artist)
+        self.editor_background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.editor_tail)
+        self.canvas.blit(self.fig.bbox)
+
+    def schedule_preview(self, *args):
+        """Update the preview once the selection and dl stopped changing"""
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(PREVIEW_DEBOUNCE_MS, self.debounced_preview)
+
+    def debounced_preview(self):
+        self.preview_after = None
+        if self.is_busy():
+            return
+        try:
+            if float(self.dl_var.get()) <= 0.0:
+                return
+        except ValueError:
+            return  # still typing
+        self.update_trajectory_preview()
     
     def update_trajectory_preview(self):
         """Update the preview plot with the selected trajectory"""
         selected_trajectory = self.trajectory_var.get()
+        if self.is_busy():
+            self.log_message("Preview is updated after the running simulation")
+            return
+        self.use_single_plot()
         
         try:
-            # Get waypoints function from dictionary
-            waypoints_func = TRAJECTORIES[selected_trajectory]
-            waypoints = waypoints_func()
-            
-            # Extract x and y coordinates
-            ax = [point[0] for point in waypoints]
-            ay = [point[1] for point in waypoints]
-            
             # Get dl parameter
             try:
                 dl = float(self.dl_var.get())
             except ValueError:
                 dl = 1.0
                 self.dl_var.set("1.0")
+            try:
+                target_speed = float(self.speed_var.get()) / 3.6
+            except ValueError:
+                target_speed = 10.0 / 3.6
+            
+            # Get the compiled spline curve from the course registry
+            course = COURSES.get(selected_trajectory, dl=dl, target_speed=target_speed)
+            if self.plot_mode == "preview" and course is self.preview_course:
+                return  # already shown
+            cx, cy = course.cx, course.cy
+            
+            # Get waypoints function from dictionary
+            waypoints = TRAJECTORIES[selected_trajectory]()
+            
+            # Extract x and y coordinates
+            ax = [point[0] for point in waypoints]
+            ay = [point[1] for point in waypoints]
             
-            # Generate spline curve
-            cx, cy, cyaw, ck, _ = cubic_spline_planner.calc_spline_course(ax, ay, ds=dl)
+            # The preview artists are created once and get the new data
+            if self.plot_mode != "preview":
+                self.ax.clear()
+                self.ax.grid(True)
+                self.ax.set_aspect('equal')
+                # long courses only draw the points visible at the zoom
+                self.preview_waypoints_line = plot_lod(self.ax, [], [], 'bo', label="Waypoints")
+                self.preview_spline_line = plot_lod(self.ax, [], [], 'r-', label="Spline Trajectory")
+                self.ax.set_xlabel("X [m]")
+                self.ax.set_ylabel("Y [m]")
+                self.ax.legend()
+                self.plot_mode = "preview"
             
-            # Update plot
-            self.ax.clear()
-            self.ax.grid(True)
-            self.ax.set_aspect('equal')
+            self.preview_waypoints_line.set_data(ax, ay)
+            self.preview_spline_line.set_data(cx, cy)
+            self.preview_course = course
             
             # If we're viewing "custom" trajectory, use fixed limits
             if selected_trajectory == "Custom":
                 self.ax.set_xlim(-100, 100)
                 self.ax.set_ylim(-100, 100)
-            
-            self.ax.plot(ax, ay, 'bo', label="Waypoints")
-            self.ax.plot(cx, cy, 'r-', label="Spline Trajectory")
+            else:
+                self.ax.relim()
+                self.ax.autoscale()
             
             self.ax.set_title(f"Trajectory Preview: {selected_trajectory}")
-            self.ax.set_xlabel("X [m]")
-            self.ax.set_ylabel("Y [m]")
-            self.ax.legend()
-            self.canvas.draw()
+            self.canvas.draw_idle()
             
             self.log_message(f"Updated trajectory preview: {selected_trajectory}")
             
@@ -497,42 +677,56 @@ class MPCTrajectoryGUI:
         
         self.log_message("MPC parameters reset to default values.")
     
+    def push_params(self, params):
+        """Set mpc parameters, in a running simulation at its next tick"""
+        if self.sim_worker is not None:
+            self.sim_worker.set_params(**params)
+        else:
+            mpc.set_params(**params)
+
     def apply_mpc_params(self):
-        """Apply MPC parameters to the mpc module"""
+        """Apply MPC parameters to the mpc module, or to the running simulation"""
         try:
-            # Update the mpc module parameters
-            mpc.T = int(float(self.T_var.get()))
-            mpc.DT = float(self.DT_var.get())
+            params = {}
+            params["T"] = int(float(self.T_var.get()))
+            params["DT"] = float(self.DT_var.get())
             
             # Update Q matrix
             Q1 = float(self.Q1_var.get())
             Q2 = float(self.Q2_var.get())
             Q3 = float(self.Q3_var.get())
             Q4 = float(self.Q4_var.get())
-            mpc.Q = np.diag([Q1, Q2, Q3, Q4])
-            mpc.Qf = mpc.Q  # Important: Update final state cost matrix
+            params["Q"] = np.diag([Q1, Q2, Q3, Q4])
+            params["Qf"] = params["Q"]  # Important: Update final state cost matrix
             
             # Update R matrix
             R1 = float(self.R1_var.get())
             R2 = float(self.R2_var.get())
-            mpc.R = np.diag([R1, R2])
+            params["R"] = np.diag([R1, R2])
             
             # Update Rd matrix
             Rd1 = float(self.Rd1_var.get())
             Rd2 = float(self.Rd2_var.get())
-            mpc.Rd = np.diag([Rd1, Rd2])
+            params["Rd"] = np.diag([Rd1, Rd2])
             
             # Update other parameters
-            mpc.MAX_ITER = int(float(self.MAX_ITER_var.get()))
+            params["MAX_ITER"] = int(float(self.MAX_ITER_var.get()))
+            params["TARGET_SPEED"] = float(self.speed_var.get()) / 3.6
+
+            self.push_params(params)
             
             # Log updates
-            self.log_message("Applied MPC parameters:")
-            self.log_message(f"T={mpc.T}, DT={mpc.DT}")
+            if self.sim_worker is not None:
+                self.log_message("Applying MPC parameters to the running simulation:")
+            else:
+                self.log_message("Applied MPC parameters:")
+            self.log_message(f"T={params['T']}, DT={params['DT']}")
             self.log_message(f"Q=[{Q1}, {Q2}, {Q3}, {Q4}]")
-            self.log_message(f"Qf=[{mpc.Qf[0,0]}, {mpc.Qf[1,1]}, {mpc.Qf[2,2]}, {mpc.Qf[3,3]}]")
+            self.log_message(f"Qf=[{Q1}, {Q2}, {Q3}, {Q4}]")
             self.log_message(f"R=[{R1}, {R2}]")
             self.log_message(f"Rd=[{Rd1}, {Rd2}]")
-            self.log_message(f"MAX_ITER={mpc.MAX_ITER}")
+            self.log_message(f"MAX_ITER={params['MAX_ITER']}")
+            self.log_message(f"Target speed={self.speed_var.get()} km/h")
             
             messagebox.showinfo("Success", "MPC parameters applied successfully.")
             
@@ -540,26 +734,32 @@ class MPCTrajectoryGUI:
             messagebox.showerror("Invalid Input", f"Please enter valid numbers: {str(e)}")
     
     def apply_vehicle_params(self):
-        """Apply vehicle parameters to the mpc module"""
+        """Apply vehicle parameters to the mpc module, or to the running simulation"""
         try:
+            params = {}
             # Convert degrees to radians for steering angles
-            mpc.MAX_STEER = np.deg2rad(float(self.MAX_STEER_var.get()))
-            mpc.MAX_DSTEER = np.deg2rad(float(self.MAX_DSTEER_var.get()))
+            params["MAX_STEER"] = np.deg2rad(float(self.MAX_STEER_var.get()))
+            params["MAX_DSTEER"] = np.deg2rad(float(self.MAX_DSTEER_var.get()))
             
             # Convert km/h to m/s for speed
-            mpc.MAX_SPEED = float(self.MAX_SPEED_var.get()) / 3.6
+            params["MAX_SPEED"] = float(self.MAX_SPEED_var.get()) / 3.6
             
             # Other parameters
-            mpc.MAX_ACCEL = float(self.MAX_ACCEL_var.get())
-            mpc.WB = float(self.WB_var.get())
+            params["MAX_ACCEL"] = float(self.MAX_ACCEL_var.get())
+            params["WB"] = float(self.WB_var.get())
+
+            self.push_params(params)
             
             # Log updates
-            self.log_message("Applied vehicle parameters:")
-            self.log_message(f"MAX_STEER={np.rad2deg(mpc.MAX_STEER)}° ({mpc.MAX_STEER:.4f} rad)")
-            self.log_message(f"MAX_DSTEER={np.rad2deg(mpc.MAX_DSTEER)}°/s ({mpc.MAX_DSTEER:.4f} rad/s)")
-            self.log_message(f"MAX_SPEED={self.MAX_SPEED_var.get()} km/h ({mpc.MAX_SPEED:.4f} m/s)")
-            self.log_message(f"MAX_ACCEL={mpc.MAX_ACCEL} m/s²")
-            self.log_message(f"WB={mpc.WB} m")
+            if self.sim_worker is not None:
+                self.log_message("Applying vehicle parameters to the running simulation:")
+            else:
+                self.log_message("Applied vehicle parameters:")
+            self.log_message(f"MAX_STEER={self.MAX_STEER_var.get()}° ({params['MAX_STEER']:.4f} rad)")
+            self.log_message(f"MAX_DSTEER={self.MAX_DSTEER_var.get()}°/s ({params['MAX_DSTEER']:.4f} rad/s)")
+            self.log_message(f"MAX_SPEED={self.MAX_SPEED_var.get()} km/h ({params['MAX_SPEED']:.4f} m/s)")
+            self.log_message(f"MAX_ACCEL={params['MAX_ACCEL']} m/s²")
+            self.log_message(f"WB={params['WB']} m")
             
             messagebox.showinfo("Success", "Vehicle parameters applied successfully.")
             
@@ -583,30 +783,9 @@ class MPCTrajectoryGUI:
                 messagebox.showerror("Invalid Input", f"Please enter valid numbers: {str(e)}")
                 return
             
-            # Get waypoints function from dictionary
-            waypoints_func = TRAJECTORIES[selected_trajectory]
-            waypoints = waypoints_func()
-            
-            # Extract x and y coordinates
-            ax = [point[0] for point in waypoints]
-            ay = [point[1] for point in waypoints]
-            
-            # Generate spline curve - directly use the cubic spline planner
-            # This matches the approach in the original code
-            cx, cy, cyaw, ck, _ = cubic_spline_planner.calc_spline_course(ax, ay, ds=dl)
-            
-            # Special handling for switch_back trajectory
-            if selected_trajectory.lower() == "switchback":
-                # Apply yaw modification for the second part - like in original code
-                midpoint = len(ax) // 2
-                for i in range(midpoint, len(cyaw)):
-                    cyaw[i] = cyaw[i] - math.pi
-            
-            # Smooth the yaw angles
-            cyaw = mpc.smooth_yaw(cyaw)
-            
-            # Calculate speed profile
-            sp = mpc.calc_speed_profile(cx, cy, cyaw, target_speed)
+            # Get the compiled course (spline, smoothed yaw and speed profile)
+            course = COURSES.get(selected_trajectory, dl=dl, target_speed=target_speed)
+            cx, cy, cyaw, ck, sp = course.cx, course.cy, course.cyaw, course.ck, course.sp
             
             # Set initial state exactly as in original code
             initial_state = mpc.State(x=cx[0], y=cy[0], yaw=cyaw[0], v=0.0)
@@ -621,34 +800,314 @@ class MPCTrajectoryGUI:
             self.log_message(f"  R=[{mpc.R[0,0]}, {mpc.R[1,1]}]")
             self.log_message(f"  Rd=[{mpc.Rd[0,0]}, {mpc.Rd[1,1]}]")
             
-            # Show message
-            messagebox.showinfo("Simulation", 
-                            "Simulation will start in a new window.\n"
-                            "Press ESC to stop the simulation.")
-            
-            # Always show animation for GUI
-            original_show_animation = mpc.show_animation
-            mpc.show_animation = True
-            
-            # Run simulation in a separate window
-            plt.figure(figsize=(10, 8))
-            start_time = time.time()
-            t, x, y, yaw, v, d, a = mpc.do_simulation(
-                cx, cy, cyaw, ck, sp, dl, initial_state)
-            
-            elapsed_time = time.time() - start_time
-            
-            # Log simulation results
-            self.log_message(f"Simulation completed in {elapsed_time:.2f} seconds")
-            self.log_message(f"Simulation time: {t[-1]:.2f} seconds")
-            self.log_message(f"Average speed: {sum(v)/len(v)*3.6:.2f} km/h")
-            self.log_message(f"Maximum steering angle: {max(abs(angle) for angle in d):.4f} rad")
-            self.log_message("=== Simulation Ended ===\n")
-            
-            # Restore original setting
-            mpc.show_animation = original_show_animation
+            # Run the simulation in a background thread, the steps are
+            # drawn into the embedded plot as they arrive
+            self.use_single_plot()
+            self.plot_mode = None
+            self.live_view = LiveView(cx, cy, mpc.vehicle_geometry(),
+                                      fps=mpc.ANIMATION_FPS, ax=self.ax)
+            self.sim_x, self.sim_y = [], []
+            self.next_progress_time = PROGRESS_LOG_INTERVAL
+            self.sim_course = course
+            profiler = PhaseProfiler() if self.profile_var.get() else None
+            self.sim_worker = SimulationWorker(course, initial_state, profiler=profiler)
+            self.sim_worker.start()
+            self.run_button.config(state=tk.DISABLED)
+            self.compare_button.config(state=tk.DISABLED)
+            self.cancel_button.config(state=tk.NORMAL)
+            self.root.after(POLL_INTERVAL_MS, self.poll_simulation)
             
         except Exception as e:
             error_msg = f"Simulation failed: {str(e)}"
             self.log_message(f"ERROR: {error_msg}")
-            messagebox.showerror("Error", error_msg)
\ No newline at end of file
+            messagebox.showerror("Error", error_msg)
+
+    def cancel_simulation(self):
+        """Stop the running simulation after its current step"""
+        if self.sim_worker is not None:
+            self.sim_worker.cancel()
+            self.log_message("Cancelling simulation...")
+
+    def poll_simulation(self):
+        """Drain the steps of the running simulation and update the plot and log"""
+        worker = self.sim_worker
+        if worker is None:
+            return
+
+        last_step = None
+        try:
+            while True:
+                message = worker.queue.get_nowait()
+                kind = message[0]
+                if kind == "step":
+                    step = message[1]
+                    self.sim_x.append(float(step["x"]))
+                    self.sim_y.append(float(step["y"]))
+                    last_step = step
+                    if step["t"] >= self.next_progress_time:
+                        self.next_progress_time += PROGRESS_LOG_INTERVAL
+                        self.log_message(f"  t={float(step['t']):.1f} s, "
+                                         f"speed={float(step['v']) * 3.6:.1f} km/h, "
+                                         f"lateral error={float(step['e_lat']):.2f} m")
+                elif kind == "params":
+                    self.log_message(f"  t={message[2]:.1f} s: applied {', '.join(message[1])}")
+                elif kind == "done":
+                    self.finish_simulation(message[1], message[2])
+                    return
+                elif kind == "error":
+                    self.finish_simulation(None, 0.0, error=message[1])
+                    return
+        except queue.Empty:
+            pass
+
+        if last_step is not None:
+            self.live_view.show(last_step, self.sim_x, self.sim_y)
+        self.root.after(POLL_INTERVAL_MS, self.poll_simulation)
+
+    def finish_simulation(self, result, elapsed_time, error=None):
+        """Log the results of a finished simulation and enable the controls"""
+        cancelled = self.sim_worker.cancelled
+        profiler = self.sim_worker.profiler
+        self.sim_worker = None
+        self.run_button.config(state=tk.NORMAL)
+        self.compare_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+        if error is not None:
+            self.live_view.close()
+            self.log_message(f"ERROR: Simulation failed: {error}")
+            messagebox.showerror("Error", f"Simulation failed: {error}")
+            return
+
+        self.last_result = result
+        self.live_view.update(result, force=True)
+        self.live_view.close()
+        cx, cy = self.sim_course.cx, self.sim_course.cy
+        summary = result.summary(cx, cy)
+        
+        # Log simulation results
+        if cancelled:
+            self.log_message("Simulation cancelled")
+        self.log_message(f"Simulation completed in {elapsed_time:.2f} seconds")
+        self.log_message(f"Simulation time: {summary['duration']:.2f} seconds")
+        self.log_message(f"Average speed: {summary['mean_speed']*3.6:.2f} km/h")
+        self.log_message(f"Maximum steering angle: {summary['max_abs_steer']:.4f} rad")
+        self.log_message(f"RMS lateral error: {summary['rms_lateral_error']:.3f} m")
+        if profiler is not None:
+            self.log_message("Control loop phases:")
+            self.log_message(profiler.report())
+        self.log_message("=== Simulation Ended ===\n")
+
+    def current_param_values(self):
+        """Values of the MPC and vehicle parameter tabs, in their units"""
+        return {name: float(getattr(self, f"{name}_var").get()) for name in self.mpc_params}
+
+    def parse_presets(self, text):
+        """
+        Parse the presets text into (name, values) pairs
+
+        values are the current parameter tab values with the overrides of
+        the preset line applied. Raises ValueError on malformed lines.
+        """
+        base = self.current_param_values()
+        presets = []
+        for line in text.splitlines():
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            name, _, overrides = line.partition(":")
+            values = dict(base)
+            for item in filter(None, (item.strip() for item in overrides.split(","))):
+                key, sep, value = item.partition("=")
+                key = key.strip()
+                if not sep or key not in values:
+                    raise ValueError(f"'{item}' in preset '{name.strip()}', expected PARAMETER=value "
+                                     f"with PARAMETER one of {', '.join(values)}")
+                values[key] = float(value)
+            presets.append((name.strip() or f"Preset {len(presets) + 1}", values))
+        if not presets:
+            raise ValueError("No presets given")
+        return presets
+
+    @staticmethod
+    def to_mpc_params(values, target_speed):
+        """mpc.set_params parameters from parameter tab values"""
+        Q = np.diag([values["Q1"], values["Q2"], values["Q3"], values["Q4"]])
+        return {
+            "T": int(values["T"]),
+            "DT": values["DT"],
+            "Q": Q,
+            "Qf": Q,
+            "R": np.diag([values["R1"], values["R2"]]),
+            "Rd": np.diag([values["Rd1"], values["Rd2"]]),
+            "MAX_ITER": int(values["MAX_ITER"]),
+            "MAX_STEER": np.deg2rad(values["MAX_STEER"]),
+            "MAX_DSTEER": np.deg2rad(values["MAX_DSTEER"]),
+            "MAX_SPEED": values["MAX_SPEED"] / 3.6,
+            "MAX_ACCEL": values["MAX_ACCEL"],
+            "WB": values["WB"],
+            "TARGET_SPEED": target_speed,
+        }
+
+    def run_comparison(self):
+        """Run the presets in parallel worker processes on the selected trajectory"""
+        if self.is_busy():
+            return
+        selected_trajectory = self.trajectory_var.get()
+        try:
+            presets = self.parse_presets(self.presets_text.get("1.0", tk.END))
+            dl = float(self.dl_var.get())
+            target_speed = float(self.speed_var.get()) / 3.6
+        except ValueError as e:
+            messagebox.showerror("Invalid Input", str(e))
+            return
+
+        try:
+            course = COURSES.get(selected_trajectory, dl=dl, target_speed=target_speed)
+        except Exception as e:
+            self.log_message(f"ERROR: Failed to generate trajectory: {str(e)}")
+            messagebox.showerror("Error", f"Failed to generate trajectory: {str(e)}")
+            return
+
+        self.compare_names = [name for name, _ in presets]
+        self.compare_dt = [values["DT"] for _, values in presets]
+        self.compare_data = [{key: [] for key in COMPARE_STEP_KEYS} for _ in presets]
+        self.compare_status = ["queued"] * len(presets)
+        self.setup_comparison_plot(course, selected_trajectory)
+        self.compare_table.delete(*self.compare_table.get_children())
+        for i, name in enumerate(self.compare_names):
+            self.compare_table.insert("", tk.END, iid=str(i), values=(name, "queued", "", "", "", ""))
+
+        self.comparison = Comparison(
+            course, [self.to_mpc_params(values, target_speed) for _, values in presets])
+        self.comparison.start()
+        self.last_compare_draw = time.time()
+        self.compare_start_time = time.time()
+
+        self.log_message("\n=== Starting Comparison ===")
+        self.log_message(f"Trajectory: {selected_trajectory}")
+        self.log_message(f"{len(presets)} presets, {self.comparison.workers} at a time: "
+                         + ", ".join(self.compare_names))
+        self.run_button.config(state=tk.DISABLED)
+        self.compare_button.config(state=tk.DISABLED)
+        self.cancel_compare_button.config(state=tk.NORMAL)
+        self.root.after(POLL_INTERVAL_MS, self.poll_comparison)
+
+    def cancel_comparison(self):
+        """Stop the running presets after their current step, skip the queued ones"""
+        if self.comparison is not None:
+            self.comparison.cancel()
+            self.log_message("Cancelling comparison...")
+
+    def setup_comparison_plot(self, course, trajectory_name):
+        """Path, speed and steering axes with one line per preset"""
+        self.plot_mode = None
+        self.fig.clf()
+        self.ax = self.fig.add_subplot(1, 2, 1)
+        speed_ax = self.fig.add_subplot(2, 2, 2)
+        steer_ax = self.fig.add_subplot(2, 2, 4, sharex=speed_ax)
+
+        self.ax.plot(course.cx, course.cy, "k--", linewidth=1, label="course")
+        self.ax.set_aspect("equal", adjustable="datalim")
+        self.ax.set_title(f"Comparison: {trajectory_name}")
+        self.ax.set_xlabel("X [m]")
+        self.ax.set_ylabel("Y [m]")
+        speed_ax.set_ylabel("Speed [km/h]")
+        steer_ax.set_ylabel("Steering [deg]")
+        steer_ax.set_xlabel("Time [s]")
+
+        colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        self.compare_axes = (self.ax, speed_ax, steer_ax)
+        self.compare_lines = []
+        for i, name in enumerate(self.compare_names):
+            color = colors[i % len(colors)]
+            self.compare_lines.append(tuple(ax.plot([], [], "-", color=color, label=name)[0]
+                                            for ax in self.compare_axes))
+        for ax in self.compare_axes:
+            ax.grid(True)
+        self.ax.legend(loc="best", fontsize="small")
+        self.fig.tight_layout()
+        self.canvas.draw()
+
+    def poll_comparison(self):
+        """Drain the streamed steps, update the plot and the metrics table"""
+        comparison = self.comparison
+        if comparison is None:
+            return
+
+        changed = set()
+        for message in comparison.poll():
+            kind, index = message[0], message[1]
+            name = self.compare_names[index]
+            if kind == "step":
+                data = self.compare_data[index]
+                for key, value in zip(COMPARE_STEP_KEYS, message[2:]):
+                    data[key].append(value)
+                self.compare_status[index] = "running"
+            elif kind == "done":
+                self.compare_status[index] = "cancelled" if comparison.cancelled else "done"
+                self.log_message(f"  {name}: finished in {message[2]:.2f} seconds")
+            elif kind == "error":
+                self.compare_status[index] = "failed"
+                self.log_message(f"  {name}: ERROR: {message[2]}")
+            changed.add(index)
+
+        for index in changed:
+            self.update_comparison_row(index)
+
+        if not comparison.is_alive():
+            self.finish_comparison()
+            return
+
+        if changed and time.time() - self.last_compare_draw >= COMPARE_REDRAW_INTERVAL:
+            self.redraw_comparison()
+        self.root.after(POLL_INTERVAL_MS, self.poll_comparison)
+
+    def update_comparison_row(self, index):
+        """Update the lines and the table row of one preset"""
+        data = self.compare_data[index]
+        path_line, speed_line, steer_line = self.compare_lines[index]
+        path_line.set_data(data["x"], data["y"])
+        speed_line.set_data(data["t"], np.asarray(data["v"]) * 3.6)
+        steer_line.set_data(data["t"], np.rad2deg(data["d"]))
+
+        values = (self.compare_names[index], self.compare_status[index], "", "", "", "")
+        if data["t"]:
+            metrics = comparison_metrics(data["e_lat"], data["solve_time"], self.compare_dt[index])
+            values = values[:2] + (f"{metrics['rms_lateral_error']:.3f}",
+                                   f"{metrics['mean_solve_time'] * 1000:.1f}",
+                                   str(metrics["deadline_misses"]),
+                                   f"{data['t'][-1]:.1f}")
+        self.compare_table.item(str(index), values=values)
+
+    def redraw_comparison(self):
+        for ax in self.compare_axes:
+            ax.relim()
+            ax.autoscale_view()
+        self.canvas.draw_idle()
+        self.last_compare_draw = time.time()
+
+    def finish_comparison(self):
+        """Log the metrics of all presets and enable the controls"""
+        self.comparison = None
+        self.run_button.config(state=tk.NORMAL)
+        self.compare_button.config(state=tk.NORMAL)
+        self.cancel_compare_button.config(state=tk.DISABLED)
+
+        for index, status in enumerate(self.compare_status):
+            if status == "queued":
+                self.compare_status[index] = "skipped"
+                self.update_comparison_row(index)
+        self.redraw_comparison()
+
+        self.log_message(f"Comparison completed in {time.time() - self.compare_start_time:.2f} seconds")
+        for index, name in enumerate(self.compare_names):
+            data = self.compare_data[index]
+            if not data["t"]:
+                self.log_message(f"  {name}: {self.compare_status[index]}")
+                continue
+            metrics = comparison_metrics(data["e_lat"], data["solve_time"], self.compare_dt[index])
+            self.log_message(f"  {name}: RMS lateral error {metrics['rms_lateral_error']:.3f} m, "
+                             f"mean solve time {metrics['mean_solve_time'] * 1000:.1f} ms, "
+                             f"{metrics['deadline_misses']} deadline misses ({self.compare_status[index]})")
+        self.log_message("=== Comparison Ended ===\n")
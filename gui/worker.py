@@ -0,0 +1,93 @@
+"""
+Background simulation runs for the GUI
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+import mpc
+
+
+class SimulationWorker:
+    """
+    Runs mpc.do_simulation in a background thread
+
+    Every recorded step is posted to `queue` as ("step", step), with step a
+    copy of `SimulationResult.latest()`. The run ends with
+    ("done", result, elapsed_time) or ("error", message). The worker never
+    touches Tk or matplotlib, the GUI drains the queue in its own thread.
+
+    Parameters pushed with `set_params` while the run is going are applied
+    between two ticks with `mpc.set_params`.
+
+    Parameters
+    ----------
+    course : course_registry.Course
+        compiled course to drive.
+    initial_state : mpc.State
+        initial vehicle state.
+    profiler : utils.profiler.PhaseProfiler, optional
+        times the phases of every tick, read it after the run.
+    """
+
+    def __init__(self, course, initial_state, profiler=None):
+        self.course = course
+        self.initial_state = initial_state
+        self.profiler = profiler
+        self.queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._params_lock = threading.Lock()
+        self._pending_params = {}
+        self._thread = threading.Thread(target=self._run,
+                                        name="mpc-simulation", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        """Stop the run after the current step"""
+        self._cancel.set()
+
+    def set_params(self, **params):
+        """
+        Apply mpc parameters (see mpc.TUNABLE_PARAMS) at the next tick
+
+        Bad values raise ValueError here, not in the running simulation.
+        """
+        mpc.check_params(**params)
+        with self._params_lock:
+            self._pending_params.update(params)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _on_step(self, result):
+        # copies, the result buffers keep changing in this thread
+        step = {field: np.array(value) for field, value in result.latest().items()}
+        self.queue.put(("step", step))
+
+        with self._params_lock:
+            params, self._pending_params = self._pending_params, {}
+        if params:
+            mpc.set_params(**params)
+            self.queue.put(("params", sorted(params), float(step["t"])))
+        return self._cancel.is_set()
+
+    def _run(self):
+        c = self.course
+        start_time = time.time()
+        try:
+            result = mpc.do_simulation(
+                c.cx, c.cy, c.cyaw, c.ck, c.sp, c.dl, self.initial_state,
+                c.cs, loop=c.loop, on_step=self._on_step, animate=False,
+                profiler=self.profiler)
+        except Exception as e:
+            self.queue.put(("error", str(e)))
+            return
+        self.queue.put(("done", result, time.time() - start_time))
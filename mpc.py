@@ -4,14 +4,14 @@ with support for custom user-defined trajectories
 
 Modified from original by Atsushi Sakai (@Atsushi_twi)
 """
-import matplotlib.pyplot as plt
 import time
-import cvxpy
+from time import perf_counter
 import math
 import numpy as np
 import sys
 import pathlib
 import argparse
+import contextlib
 
 # Add the parent directory to the path
 sys.path.append(str(pathlib.Path(__file__).parent.parent.parent))
@@ -19,12 +19,18 @@ sys.path.append(str(pathlib.Path(__file__).parent.parent.parent))
 # Import from the project
 from utils.angle import angle_mod
 from utils import cubic_spline_planner
+from utils.course import calc_speed_profile, smooth_yaw
+from utils.simulation_result import SimulationResult
+from utils.vehicle_draw import draw_vehicles
 from trajectory_config import TRAJECTORIES, DEFAULT_TRAJECTORY
+from course_registry import COURSES
 
-from utils import cubic_spline_planner
+# matplotlib and cvxpy are imported where they are used, so headless runs
+# never load matplotlib and start without waiting for cvxpy
 
 NX = 4  # x = x, y, v, yaw
 NU = 2  # a = [accel, steer]
+NZ = 3  # z = lateral error, heading error, v of the frenet formulation
 T = 5  # horizon length
 
 # mpc parameters
@@ -35,6 +41,7 @@ Qf = Q  # state final matrix
 GOAL_DIS = 1.5  # goal distance
 STOP_SPEED = 0.5 / 3.6  # stop speed
 MAX_TIME = 500.0  # max simulation time
+HISTORY_LEN = 10000  # steps of history kept in loop runs
 
 # iterative paramter
 MAX_ITER = 3  # Max iteration
@@ -43,7 +50,40 @@ DU_TH = 0.1  # iteration finish param
 TARGET_SPEED = 10.0 / 3.6  # [m/s] target speed
 N_IND_SEARCH = 10  # Search index number
 
-DT = 0.2  # [s] time tick
+DT = 0.2  # [s] time tick, the control period
+PLANT_DT = None  # [s] plant integration and logging step, None for DT
+HORIZON_DT = None  # [s] step of every horizon stage, None for DT, see horizon_steps
+MOVE_BLOCKS = None  # stages per input block, None for an input per stage, see move_blocks
+INPUT_HOLD = "zoh"  # inputs between two ticks, "zoh" or "linear", see held_input
+
+# event-triggered MPC, see plan_still_valid
+EVENT_TRIGGER = False  # reuse the last plan while it is valid instead of solving
+EVENT_STATE_TH = np.array([0.1, 0.1, 0.1, np.deg2rad(2.0)])  # predicted vs. actual x, y, v, yaw
+EVENT_REF_TH = np.array([1.5, 1.5, 0.2, np.deg2rad(5.0)])  # reference drift x, y, v, yaw
+EVENT_MAX_AGE = 3  # max ticks a plan is reused
+
+# adaptive horizon, see choose_horizon
+ADAPTIVE_HORIZON = False  # choose the horizon every tick from the speed and the curvature ahead, not T
+HORIZON_BUCKETS = (3, 4, 5, 6)  # horizon lengths to choose from
+HORIZON_SPEED = 50.0 / 3.6  # [m/s] speed that needs the longest horizon
+HORIZON_CURVATURE = 0.2  # [1/m] curvature ahead that needs the longest horizon
+
+SOLVER = "CLARABEL"  # cvxpy solver of the QP
+FORMULATION = "global"  # MPC model, "global" or "frenet", see frenet_mpc_control
+FORMULATIONS = ("global", "frenet")
+QP_SCALING = False  # solve in states and inputs scaled by the vehicle limits, see qp_scaling
+_problems = {}  # cached LinearMPCProblem per horizon T, move blocks and state size, see get_problem
+_profiler = None  # PhaseProfiler of the running do_simulation, see _phase
+_NO_PHASE = contextlib.nullcontext()
+
+# parameters that may change between the ticks of a running simulation
+TUNABLE_PARAMS = ("T", "DT", "Q", "Qf", "R", "Rd", "MAX_ITER", "MAX_STEER",
+                  "MAX_DSTEER", "MAX_SPEED", "MIN_SPEED", "MAX_ACCEL", "WB",
+                  "TARGET_SPEED", "EVENT_TRIGGER", "EVENT_STATE_TH",
+                  "EVENT_REF_TH", "EVENT_MAX_AGE", "PLANT_DT", "INPUT_HOLD",
+                  "ADAPTIVE_HORIZON", "HORIZON_BUCKETS", "HORIZON_SPEED",
+                  "HORIZON_CURVATURE", "HORIZON_DT", "MOVE_BLOCKS",
+                  "FORMULATION", "QP_SCALING", "SOLVER")
 
 # Vehicle parameters
 LENGTH = 4.5  # [m]
@@ -61,6 +101,7 @@ MIN_SPEED = -20.0 / 3.6  # minimum speed [m/s]
 MAX_ACCEL = 1.0  # maximum accel [m/ss]
 
 show_animation = True
+ANIMATION_FPS = 30.0  # max frames per second of the live view
 
 
 class State:
@@ -80,88 +121,172 @@ def pi_2_pi(angle):
     return angle_mod(angle)
 
 
-def get_linear_model_matrix(v, phi, delta):
+def set_params(**params):
+    """
+    Set module parameters by name, see TUNABLE_PARAMS
+
+    Safe between the ticks of a running simulation, e.g. from its on_step
+    hook: weights and limits are new parameter values of the cached
+    problem, only a T not seen before builds a new one. A new TARGET_SPEED scales the
+    speed profile of the running course. A new SOLVER drops the cached
+    problems, they are compiled for the solver.
+    """
+    check_params(**params)
+    if params.get("SOLVER", SOLVER) != SOLVER:
+        _problems.clear()
+    globals().update(params)
+
+
+def check_params(**params):
+    """
+    Raise ValueError for parameters set_params would not accept
+
+    Lets a caller reject a bad value before it is applied between the ticks
+    of a running simulation.
+    """
+    unknown = set(params) - set(TUNABLE_PARAMS)
+    if unknown:
+        raise ValueError(f"unknown parameters: {', '.join(sorted(unknown))}")
+    blocks = params.get("MOVE_BLOCKS")
+    if blocks is not None and (len(blocks) == 0 or min(int(n) for n in blocks) < 1):
+        raise ValueError(f"MOVE_BLOCKS {blocks} needs positive lengths")
+
+
+def _phase(name):
+    """Time a phase of the tick with the running profiler, if any"""
+    if _profiler is None:
+        return _NO_PHASE
+    return _profiler.phase(name)
+
+
+def horizon_steps(T):
+    """
+    Step [s] of every stage of a horizon of T stages
+
+    HORIZON_DT lists the steps from the first stage on, e.g. short ones
+    near-term and long ones far-term. The last one repeats for longer
+    horizons, shorter ones use its beginning. None gives T steps of DT.
+    The input of the first stage is applied for one control period DT, so
+    the first step should be DT.
+    """
+    if HORIZON_DT is None:
+        return np.full(T, DT)
+    steps = np.asarray(HORIZON_DT, dtype=float)[:T]
+    if len(steps) == 0 or np.any(steps <= 0):
+        raise ValueError(f"HORIZON_DT {HORIZON_DT} needs positive steps")
+    return np.concatenate((steps, np.full(T - len(steps), steps[-1])))
+
+
+def move_blocks(T):
+    """
+    Stages per input block of a horizon of T stages, None without blocking
+
+    MOVE_BLOCKS lists the block lengths from the first stage on, e.g.
+    (1, 1, 2, 4): the input is held over the stages of a block. The last
+    length repeats for longer horizons, the last block is cut at T.
+    """
+    if MOVE_BLOCKS is None:
+        return None
+    lengths = [int(n) for n in MOVE_BLOCKS]
+    blocks = []
+    while sum(blocks) < T:
+        n = lengths[min(len(blocks), len(lengths) - 1)]
+        blocks.append(min(n, T - sum(blocks)))
+    return None if len(blocks) == T else tuple(blocks)
+
+
+def get_linear_model_matrix(v, phi, delta, dt=None):
+    """Model linearized at v, phi and delta, discretized over dt, by default DT"""
+    if dt is None:
+        dt = DT
 
     A = np.zeros((NX, NX))
     A[0, 0] = 1.0
     A[1, 1] = 1.0
     A[2, 2] = 1.0
     A[3, 3] = 1.0
-    A[0, 2] = DT * math.cos(phi)
-    A[0, 3] = - DT * v * math.sin(phi)
-    A[1, 2] = DT * math.sin(phi)
-    A[1, 3] = DT * v * math.cos(phi)
-    A[3, 2] = DT * math.tan(delta) / WB
+    A[0, 2] = dt * math.cos(phi)
+    A[0, 3] = - dt * v * math.sin(phi)
+    A[1, 2] = dt * math.sin(phi)
+    A[1, 3] = dt * v * math.cos(phi)
+    A[3, 2] = dt * math.tan(delta) / WB
 
     B = np.zeros((NX, NU))
-    B[2, 0] = DT
-    B[3, 1] = DT * v / (WB * math.cos(delta) ** 2)
+    B[2, 0] = dt
+    B[3, 1] = dt * v / (WB * math.cos(delta) ** 2)
 
     C = np.zeros(NX)
-    C[0] = DT * v * math.sin(phi) * phi
-    C[1] = - DT * v * math.cos(phi) * phi
-    C[3] = - DT * v * delta / (WB * math.cos(delta) ** 2)
+    C[0] = dt * v * math.sin(phi) * phi
+    C[1] = - dt * v * math.cos(phi) * phi
+    C[3] = - dt * v * delta / (WB * math.cos(delta) ** 2)
 
     return A, B, C
 
 
+def get_frenet_model_matrix(v, k, dt=None):
+    """
+    Path coordinate model at speed v on curvature k, discretized over dt
+
+    The state is the lateral error e_y (left is positive), the heading
+    error e_psi and the speed v:
+
+        de_y/dt = v sin(e_psi)
+        de_psi/dt = v tan(delta) / WB - k v cos(e_psi) / (1 - k e_y)
+
+    linearized on the path (e_y = e_psi = 0) with the steering
+    delta_k = atan(WB k) that follows its curvature.
+    """
+    if dt is None:
+        dt = DT
+    delta = math.atan(WB * k)
+    gain = dt * v / (WB * math.cos(delta) ** 2)
+
+    A = np.eye(NZ)
+    A[0, 1] = dt * v
+    A[1, 0] = - dt * k * k * v
+
+    B = np.zeros((NZ, NU))
+    B[1, 1] = gain
+    B[2, 0] = dt
+
+    C = np.zeros(NZ)
+    C[1] = - gain * delta
+
+    return A, B, C
+
+
+def vehicle_geometry():
+    """Vehicle dimensions for drawing, see utils.vehicle_draw"""
+    return dict(LENGTH=LENGTH, WIDTH=WIDTH, BACKTOWHEEL=BACKTOWHEEL,
+                WHEEL_LEN=WHEEL_LEN, WHEEL_WIDTH=WHEEL_WIDTH, TREAD=TREAD,
+                WB=WB)
+
+
 def plot_car(x, y, yaw, steer=0.0, cabcolor="-r", truckcolor="-k"):  # pragma: no cover
+    import matplotlib.pyplot as plt
 
-    outline = np.array([[-BACKTOWHEEL, (LENGTH - BACKTOWHEEL), (LENGTH - BACKTOWHEEL), -BACKTOWHEEL, -BACKTOWHEEL],
-                        [WIDTH / 2, WIDTH / 2, - WIDTH / 2, -WIDTH / 2, WIDTH / 2]])
-
-    fr_wheel = np.array([[WHEEL_LEN, -WHEEL_LEN, -WHEEL_LEN, WHEEL_LEN, WHEEL_LEN],
-                         [-WHEEL_WIDTH - TREAD, -WHEEL_WIDTH - TREAD, WHEEL_WIDTH - TREAD, WHEEL_WIDTH - TREAD, -WHEEL_WIDTH - TREAD]])
-
-    rr_wheel = np.copy(fr_wheel)
-
-    fl_wheel = np.copy(fr_wheel)
-    fl_wheel[1, :] *= -1
-    rl_wheel = np.copy(rr_wheel)
-    rl_wheel[1, :] *= -1
-
-    Rot1 = np.array([[math.cos(yaw), math.sin(yaw)],
-                     [-math.sin(yaw), math.cos(yaw)]])
-    Rot2 = np.array([[math.cos(steer), math.sin(steer)],
-                     [-math.sin(steer), math.cos(steer)]])
-
-    fr_wheel = (fr_wheel.T.dot(Rot2)).T
-    fl_wheel = (fl_wheel.T.dot(Rot2)).T
-    fr_wheel[0, :] += WB
-    fl_wheel[0, :] += WB
-
-    fr_wheel = (fr_wheel.T.dot(Rot1)).T
-    fl_wheel = (fl_wheel.T.dot(Rot1)).T
-
-    outline = (outline.T.dot(Rot1)).T
-    rr_wheel = (rr_wheel.T.dot(Rot1)).T
-    rl_wheel = (rl_wheel.T.dot(Rot1)).T
-
-    outline[0, :] += x
-    outline[1, :] += y
-    fr_wheel[0, :] += x
-    fr_wheel[1, :] += y
-    rr_wheel[0, :] += x
-    rr_wheel[1, :] += y
-    fl_wheel[0, :] += x
-    fl_wheel[1, :] += y
-    rl_wheel[0, :] += x
-    rl_wheel[1, :] += y
-
-    plt.plot(np.array(outline[0, :]).flatten(),
-             np.array(outline[1, :]).flatten(), truckcolor)
-    plt.plot(np.array(fr_wheel[0, :]).flatten(),
-             np.array(fr_wheel[1, :]).flatten(), truckcolor)
-    plt.plot(np.array(rr_wheel[0, :]).flatten(),
-             np.array(rr_wheel[1, :]).flatten(), truckcolor)
-    plt.plot(np.array(fl_wheel[0, :]).flatten(),
-             np.array(fl_wheel[1, :]).flatten(), truckcolor)
-    plt.plot(np.array(rl_wheel[0, :]).flatten(),
-             np.array(rl_wheel[1, :]).flatten(), truckcolor)
+    # one collection for the body and the wheels, truckcolor is like "-k"
+    draw_vehicles(plt.gca(), x, y, yaw, steer, vehicle_geometry(),
+                  colors=truckcolor.strip("-:."))
     plt.plot(x, y, "*")
 
 
-def update_state(state, a, delta):
+def plot_footprint(result, every=10, ax=None):  # pragma: no cover
+    """Draw the vehicle at every `every`-th step of a result in one collection"""
+    import matplotlib.pyplot as plt
+
+    ax = plt.gca() if ax is None else ax
+    steps = slice(None, None, every)
+    return draw_vehicles(ax, result.x[steps], result.y[steps],
+                         result.yaw[steps], result.d[steps],
+                         vehicle_geometry(), colors="gray", alpha=0.5,
+                         linewidths=0.5)
+
+
+def update_state(state, a, delta, dt=None):
+    """Integrate the kinematic bicycle over dt, by default DT"""
+    if dt is None:
+        dt = DT
 
     # input check
     if delta >= MAX_STEER:
@@ -169,10 +294,10 @@ def update_state(state, a, delta):
     elif delta <= -MAX_STEER:
         delta = -MAX_STEER
 
-    state.x = state.x + state.v * math.cos(state.yaw) * DT
-    state.y = state.y + state.v * math.sin(state.yaw) * DT
-    state.yaw = state.yaw + state.v / WB * math.tan(delta) * DT
-    state.v = state.v + a * DT
+    state.x = state.x + state.v * math.cos(state.yaw) * dt
+    state.y = state.y + state.v * math.sin(state.yaw) * dt
+    state.yaw = state.yaw + state.v / WB * math.tan(delta) * dt
+    state.v = state.v + a * dt
 
     if state.v > MAX_SPEED:
         state.v = MAX_SPEED
@@ -182,41 +307,110 @@ def update_state(state, a, delta):
     return state
 
 
+def plant_steps():
+    """
+    Plant step [s] and plant steps per control tick
+
+    PLANT_DT must divide DT, None runs the plant at DT.
+    """
+    if PLANT_DT is None:
+        return DT, 1
+    steps = DT / PLANT_DT if PLANT_DT > 0 else 0.0
+    if steps < 1 or abs(steps - round(steps)) > 1e-6:
+        raise ValueError(f"PLANT_DT {PLANT_DT} does not divide DT {DT}")
+    return PLANT_DT, int(round(steps))
+
+
+def held_input(oa, od, k, fraction):
+    """
+    Input of a plant step between two control ticks
+
+    oa, od: planned acceleration and steering
+    k: index of the planned input of the control tick
+    fraction: of the control period elapsed at the plant step, in [0, 1)
+
+    With INPUT_HOLD "zoh" the input of the tick is held, with "linear" it
+    is interpolated towards the next planned input.
+    """
+    if INPUT_HOLD == "linear" and k + 1 < len(oa):
+        return (od[k] + fraction * (od[k + 1] - od[k]),
+                oa[k] + fraction * (oa[k + 1] - oa[k]))
+    return od[k], oa[k]
+
+
 def get_nparray_from_matrix(x):
     return np.array(x).flatten()
 
 
-def calc_nearest_index(state, cx, cy, cyaw, pind):
+def calc_nearest_index(state, cx, cy, cyaw, pind, loop=False):
+    """
+    Nearest course index in the search window ahead of pind
 
-    dx = [state.x - icx for icx in cx[pind:(pind + N_IND_SEARCH)]]
-    dy = [state.y - icy for icy in cy[pind:(pind + N_IND_SEARCH)]]
+    On a `loop` course the index keeps counting over laps and the course
+    is indexed modulo its length.
+    """
+    ncourse = len(cx)
+    if loop:
+        inds = [i % ncourse for i in range(pind, pind + N_IND_SEARCH)]
+    else:
+        inds = range(pind, min(pind + N_IND_SEARCH, ncourse))
 
-    d = [idx ** 2 + idy ** 2 for (idx, idy) in zip(dx, dy)]
+    d = [(state.x - cx[i]) ** 2 + (state.y - cy[i]) ** 2 for i in inds]
 
     mind = min(d)
 
-    ind = d.index(mind) + pind
+    k = d.index(mind)
+    ind = k + pind
 
     mind = math.sqrt(mind)
 
-    dxl = cx[ind] - state.x
-    dyl = cy[ind] - state.y
+    dxl = cx[inds[k]] - state.x
+    dyl = cy[inds[k]] - state.y
 
-    angle = pi_2_pi(cyaw[ind] - math.atan2(dyl, dxl))
+    angle = pi_2_pi(cyaw[inds[k]] - math.atan2(dyl, dxl))
     if angle < 0:
         mind *= -1
 
     return ind, mind
 
 
+def calc_lateral_error(state, cx, cy, cyaw, ind):
+    """Signed distance of the vehicle across the course heading at ind, left is positive"""
+    ind %= len(cx)
+    dx, dy = state.x - cx[ind], state.y - cy[ind]
+    return -dx * math.sin(cyaw[ind]) + dy * math.cos(cyaw[ind])
+
+
+def calc_lap_yaw(cyaw):
+    """Yaw change over one lap of a closed course, a multiple of 2 pi"""
+    yaw_end = cyaw[-1] + pi_2_pi(cyaw[0] - cyaw[-1])
+    return round((yaw_end - cyaw[0]) / (2.0 * math.pi)) * 2.0 * math.pi
+
+
+def interp_loop(s, cs, length, values, seam_offset=0.0):
+    """
+    Interpolate course values at arc length s in [0, length) of a loop
+
+    The segment after the last point wraps to the first one, whose value is
+    shifted by seam_offset (e.g. the lap yaw).
+    """
+    i = np.searchsorted(cs, s, side="right") - 1
+    j = (i + 1) % len(cs)
+    s_next = np.where(j == 0, length, cs[j])
+    v_next = values[j] + np.where(j == 0, seam_offset, 0.0)
+    w = (s - cs[i]) / (s_next - cs[i])
+    return (1.0 - w) * values[i] + w * v_next
+
+
 def predict_motion(x0, oa, od, xref):
     xbar = xref * 0.0
     for i, _ in enumerate(x0):
         xbar[i, 0] = x0[i]
 
+    horizon = xref.shape[1] - 1
     state = State(x=x0[0], y=x0[1], yaw=x0[3], v=x0[2])
-    for (ai, di, i) in zip(oa, od, range(1, T + 1)):
-        state = update_state(state, ai, di)
+    for (ai, di, i, dt) in zip(oa, od, range(1, horizon + 1), horizon_steps(horizon)):
+        state = update_state(state, ai, di, dt)
         xbar[0, i] = state.x
         xbar[1, i] = state.y
         xbar[2, i] = state.v
@@ -228,17 +422,28 @@ def predict_motion(x0, oa, od, xref):
 def iterative_linear_mpc_control(xref, x0, dref, oa, od):
     """
     MPC control with updating operational point iteratively
+
+    The horizon is the one of the reference xref.
     """
     ox, oy, oyaw, ov = None, None, None, None
+    horizon = xref.shape[1] - 1
 
     if oa is None or od is None:
-        oa = [0.0] * T
-        od = [0.0] * T
+        oa = [0.0] * horizon
+        od = [0.0] * horizon
+    elif len(oa) != horizon:  # another horizon, hold the last input of the plan
+        oa = list(oa[:horizon]) + [oa[-1]] * (horizon - len(oa))
+        od = list(od[:horizon]) + [od[-1]] * (horizon - len(od))
 
     for i in range(MAX_ITER):
-        xbar = predict_motion(x0, oa, od, xref)
+        with _phase("predict"):
+            xbar = predict_motion(x0, oa, od, xref)
         poa, pod = oa[:], od[:]
         oa, od, ox, oy, oyaw, ov = linear_mpc_control(xref, xbar, x0, dref)
+        if _profiler is not None:
+            _profiler.add("iterations", 1)
+        if oa is None:  # no solution
+            break
         du = sum(abs(oa - poa)) + sum(abs(od - pod))  # calc u change value
         if du <= DU_TH:
             break
@@ -248,6 +453,251 @@ def iterative_linear_mpc_control(xref, x0, dref, oa, od):
     return oa, od, ox, oy, oyaw, ov
 
 
+def plan_still_valid(plan, age, x0, xref):
+    """
+    Whether the plan of an earlier solve still holds `age` ticks later
+
+    plan: (steps, ox, oy, ov, oyaw, xref) of the solve, steps are the
+        horizon_steps of its stages
+    x0: current state [x, y, v, yaw]
+    xref: current reference trajectory
+
+    The plan holds while its input for the tick exists, the state it
+    predicted for the tick is within EVENT_STATE_TH of the actual one and
+    the rest of its reference is within EVENT_REF_TH of the current
+    reference, for at most EVENT_MAX_AGE ticks. The stages passed so far
+    must have been control periods, a plan on a grid of other steps (see
+    HORIZON_DT) is not reused.
+    """
+    steps, ox, oy, ov, oyaw, pxref = plan
+    if age > EVENT_MAX_AGE or age >= len(steps) or np.any(steps[:age] != DT) \
+            or pxref.shape != xref.shape:
+        return False
+
+    error = np.abs(np.asarray(x0) - (ox[age], oy[age], ov[age], oyaw[age]))
+    error[3] = abs(pi_2_pi(error[3]))
+    if np.any(error > EVENT_STATE_TH):
+        return False
+
+    drift = xref[:, :xref.shape[1] - age] - pxref[:, age:]
+    drift[3] = pi_2_pi(drift[3])
+    return not np.any(np.abs(drift).max(axis=1) > EVENT_REF_TH)
+
+
+def qp_scaling(nx, x0):
+    """
+    Offset and scale of the QP states and scale of its inputs, see QP_SCALING
+
+    The scaled QP solves for (x - offset) / sx and u / su: positions
+    relative to the vehicle at x0, speeds in the speed limit, angles in pi
+    and the inputs in their limits. The errors of the frenet formulation
+    (nx NZ) are already relative to the vehicle.
+    """
+    speed = max(MAX_SPEED, -MIN_SPEED)
+    su = np.array([MAX_ACCEL, MAX_STEER])
+    if nx == NZ:
+        return np.zeros(NZ), np.array([1.0, math.pi, speed]), su
+    return (np.array([x0[0], x0[1], 0.0, 0.0]),
+            np.array([1.0, 1.0, speed, math.pi]), su)
+
+
+def _scale_qp(models, xref, x0, offset, sx, su):
+    """Stage models, reference and initial state in the scaled QP variables"""
+    models = [(A * sx / sx[:, None], B * su / sx[:, None], (C + A @ offset - offset) / sx)
+              for A, B, C in models]
+    return (models, (xref - offset[:, None]) / sx[:, None],
+            (np.asarray(x0, dtype=float) - offset) / sx)
+
+
+def _sqrt_psd(M):
+    """Symmetric square root of a positive semidefinite matrix"""
+    w, V = np.linalg.eigh((M + M.T) / 2.0)
+    return (V * np.sqrt(np.clip(w, 0.0, None))) @ V.T
+
+
+class LinearMPCProblem:
+    """
+    Parametrized linear MPC problem for a horizon T
+
+    The problem is built once, with cvxpy parameters for the linearized
+    model, the initial state, the reference, the cost weights and the
+    limits. A solve only updates parameter values and reuses the compiled
+    problem, so weights and limits can change between ticks for free.
+    Only a new horizon T (or new move blocks) needs a new problem.
+
+    With move blocks (see move_blocks) there is one input per block, held
+    over its stages: the stage inputs are the block inputs times a constant
+    0/1 expansion matrix. The steering rate limit and the input difference
+    cost only apply between blocks.
+
+    The state has nx components with the speed third: x, y, v, yaw of the
+    global formulation, e_y, e_psi, v of the frenet one (see FORMULATION).
+    With QP_SCALING the parameters hold the values of the scaled QP and the
+    solution is scaled back, see qp_scaling.
+
+    To keep the problem DPP compliant the weights enter as square roots,
+    x'Qx = |Q^(1/2) x|^2, and the reference as Q^(1/2) xref computed with
+    numpy.
+    """
+
+    def __init__(self, T, blocks=None, nx=NX):
+        import cvxpy  # deferred to the first solve
+
+        self.T = T
+        self.blocks = blocks
+        self.nx = nx
+        n_blocks = T if blocks is None else len(blocks)
+        self.x = cvxpy.Variable((nx, T + 1))
+        self.u = cvxpy.Variable((NU, n_blocks))
+        x, u = self.x, self.u
+        # stage inputs, the block inputs repeated over their stages
+        self.expand = None if blocks is None else np.repeat(np.eye(n_blocks), blocks, axis=1)
+        U = u if blocks is None else u @ self.expand
+        # last stage of every block but the last, the input may change after it
+        self.block_ends = np.cumsum(blocks or [1] * T)[:-1] - 1
+
+        self.A = [cvxpy.Parameter((nx, nx)) for _ in range(T)]
+        self.B = [cvxpy.Parameter((nx, NU)) for _ in range(T)]
+        self.C = [cvxpy.Parameter(nx) for _ in range(T)]
+        self.x0 = cvxpy.Parameter(nx)
+
+        self.sqrt_Q = cvxpy.Parameter((nx, nx))
+        self.sqrt_Qf = cvxpy.Parameter((nx, nx))
+        self.sqrt_R = cvxpy.Parameter((NU, NU))
+        self.sqrt_Rd = cvxpy.Parameter((NU, NU))
+        self.q_xref = None  # sqrt_Q @ xref[:, 1:T], only with stage costs
+        self.qf_xref = cvxpy.Parameter(nx)  # sqrt_Qf @ xref[:, T]
+
+        self.max_speed = cvxpy.Parameter()
+        self.min_speed = cvxpy.Parameter()
+        self.max_accel = cvxpy.Parameter(nonneg=True)
+        self.max_steer = cvxpy.Parameter(nonneg=True)
+        self.max_dsteer = None  # per step, of every step of the horizon
+
+        cost = cvxpy.sum_squares(self.sqrt_R @ U)
+        cost += cvxpy.sum_squares(self.sqrt_Qf @ x[:, T] - self.qf_xref)
+        constraints = [x[:, t + 1] == self.A[t] @ x[:, t] + self.B[t] @ U[:, t] + self.C[t]
+                       for t in range(T)]
+        if T > 1:
+            self.q_xref = cvxpy.Parameter((nx, T - 1))
+            cost += cvxpy.sum_squares(self.sqrt_Q @ x[:, 1:T] - self.q_xref)
+        if n_blocks > 1:
+            du = u[:, 1:] - u[:, :-1]
+            cost += cvxpy.sum_squares(self.sqrt_Rd @ du)
+            self.max_dsteer = cvxpy.Parameter(n_blocks - 1, nonneg=True)
+            constraints += [cvxpy.abs(du[1, :]) <= self.max_dsteer]
+
+        constraints += [x[:, 0] == self.x0]
+        # the initial speed is given, it may exceed a lowered limit
+        constraints += [x[2, 1:] <= self.max_speed]
+        constraints += [x[2, 1:] >= self.min_speed]
+        constraints += [cvxpy.abs(u[0, :]) <= self.max_accel]
+        constraints += [cvxpy.abs(u[1, :]) <= self.max_steer]
+
+        self.problem = cvxpy.Problem(cvxpy.Minimize(cost), constraints)
+        self._weights = None
+
+    def compile(self):
+        """Canonicalize the problem for SOLVER now instead of at the first solve"""
+        self.problem.get_problem_data(solver=SOLVER)
+
+    def set_weights(self, Q, Qf, R, Rd, scale=None):
+        """
+        Update the cost weights, the square roots only if they changed
+
+        scale: (sx, su) of the scaled QP, see qp_scaling. The roots then act
+        on the scaled states and inputs.
+        """
+        weights = tuple(np.array(W, dtype=float) for W in (Q, Qf, R, Rd))
+        if scale is not None:
+            weights += tuple(np.array(s, dtype=float) for s in scale)
+        if self._weights is not None and len(weights) == len(self._weights) and all(
+                np.array_equal(a, b) for a, b in zip(weights, self._weights)):
+            return
+        self._weights = weights
+        roots = [_sqrt_psd(W) for W in weights[:4]]
+        if scale is not None:
+            sx, su = weights[4:]
+            roots = [roots[0] * sx, roots[1] * sx, roots[2] * su, roots[3] * su]
+        for param, M in zip((self.sqrt_Q, self.sqrt_Qf, self.sqrt_R, self.sqrt_Rd),
+                            roots):
+            param.value = M
+
+    def solve(self, xref, xbar, x0, dref):
+        """Solve the global formulation linearized at xbar, see get_linear_model_matrix"""
+        steps = horizon_steps(self.T)
+        with _phase("linearize"):
+            models = [get_linear_model_matrix(xbar[2, t], xbar[3, t], dref[0, t], steps[t])
+                      for t in range(self.T)]
+
+        x, u = self.solve_models(models, xref, x0, (Q, Qf, R, Rd))
+        if x is None:
+            return None, None, None, None, None, None
+        return (u[0, :].copy(), u[1, :].copy(), x[0, :].copy(),
+                x[1, :].copy(), x[3, :].copy(), x[2, :].copy())
+
+    def solve_models(self, models, xref, x0, weights):
+        """
+        Solve for given stage models
+
+        models: (A, B, C) of every stage
+        xref: reference states, the speed in row 2
+        x0: initial state
+        weights: Q, Qf, R, Rd
+
+        Returns the states and the stage inputs, None, None if unsolved.
+        """
+        import cvxpy
+
+        T = self.T
+        steps = horizon_steps(T)
+        scaling = qp_scaling(self.nx, x0) if QP_SCALING else None
+        with _phase("build"):
+            if scaling is None:
+                self.set_weights(*weights)
+                limits = (MAX_SPEED, MIN_SPEED, MAX_ACCEL, MAX_STEER, MAX_DSTEER)
+            else:
+                offset, sx, su = scaling
+                models, xref, x0 = _scale_qp(models, xref, x0, offset, sx, su)
+                self.set_weights(*weights, scale=(sx, su))
+                limits = (MAX_SPEED / sx[2], MIN_SPEED / sx[2], MAX_ACCEL / su[0],
+                          MAX_STEER / su[1], MAX_DSTEER / su[1])
+            (self.max_speed.value, self.min_speed.value, self.max_accel.value,
+             self.max_steer.value, max_dsteer) = limits
+            if self.max_dsteer is not None:
+                self.max_dsteer.value = max_dsteer * steps[self.block_ends]
+
+            for t, (A, B, C) in enumerate(models):
+                self.A[t].value = A
+                self.B[t].value = B
+                self.C[t].value = C
+
+            self.x0.value = np.asarray(x0, dtype=float)
+            if self.q_xref is not None:
+                self.q_xref.value = self.sqrt_Q.value @ xref[:, 1:T]
+            self.qf_xref.value = self.sqrt_Qf.value @ xref[:, T]
+
+        with _phase("solve"):
+            self.problem.solve(solver=SOLVER, verbose=False)
+        stats = self.problem.solver_stats
+        if _profiler is not None and stats.solve_time is not None:
+            _profiler.add("solver", stats.solve_time)
+        if _profiler is not None and stats.num_iters is not None:
+            _profiler.add("qp_iters", stats.num_iters)
+
+        if self.problem.status in (cvxpy.OPTIMAL, cvxpy.OPTIMAL_INACCURATE):
+            x, u = self.x.value, self.u.value
+            if self.expand is not None:
+                u = u @ self.expand
+            if scaling is not None:
+                x = x * sx[:, None] + offset[:, None]
+                u = u * su[:, None]
+            return x, u
+
+        print("Error: Cannot solve mpc..")
+        return None, None
+
+
 def linear_mpc_control(xref, xbar, x0, dref):
     """
     linear mpc control
@@ -256,93 +706,271 @@ def linear_mpc_control(xref, xbar, x0, dref):
     xbar: operational point
     x0: initial state
     dref: reference steer angle
+
+    Solves the cached LinearMPCProblem of the horizon of xref and its
+    move blocks. Not thread-safe, run one simulation per process.
     """
+    horizon = xref.shape[1] - 1
+    return get_problem(horizon, move_blocks(horizon)).solve(xref, xbar, x0, dref)
 
-    x = cvxpy.Variable((NX, T + 1))
-    u = cvxpy.Variable((NU, T))
 
-    cost = 0.0
-    constraints = []
+def frenet_weights():
+    """Q, Qf, R, Rd of the frenet formulation from the global ones"""
+    Q_, Qf_ = np.asarray(Q, dtype=float), np.asarray(Qf, dtype=float)
+    return (np.diag([max(Q_[0, 0], Q_[1, 1]), Q_[3, 3], Q_[2, 2]]),
+            np.diag([max(Qf_[0, 0], Qf_[1, 1]), Qf_[3, 3], Qf_[2, 2]]), R, Rd)
 
-    for t in range(T):
-        cost += cvxpy.quad_form(u[:, t], R)
 
-        if t != 0:
-            cost += cvxpy.quad_form(xref[:, t] - x[:, t], Q)
+def frenet_mpc_control(xref, kref, vbar, z0):
+    """
+    MPC control in path coordinates, FORMULATION "frenet"
+
+    xref: reference points on the course, see calc_frenet_reference
+    kref: course curvature at the reference points
+    vbar: speed of every stage the model is linearized at
+    z0: initial lateral error, heading error and speed
+
+    The errors are driven to zero and the speed to the speed profile. The
+    model (see get_frenet_model_matrix) depends on the reference only, not
+    on the predicted motion, so a tick takes one solve instead of up to
+    MAX_ITER. The position weight of Q weights the lateral error, the
+    yaw weight the heading error. Returns the plan like
+    iterative_linear_mpc_control, the predicted errors mapped back to
+    x, y, v, yaw.
+    """
+    horizon = xref.shape[1] - 1
+    steps = horizon_steps(horizon)
+    with _phase("linearize"):
+        models = [get_frenet_model_matrix(vbar[t], kref[t], steps[t])
+                  for t in range(horizon)]
+
+    zref = np.zeros((NZ, horizon + 1))
+    zref[2, :] = xref[2, :]
+    z, u = get_problem(horizon, move_blocks(horizon), NZ).solve_models(
+        models, zref, z0, frenet_weights())
+    if _profiler is not None:
+        _profiler.add("iterations", 1)
+    if z is None:
+        return None, None, None, None, None, None
+
+    yaw = xref[3, :]
+    return (u[0, :].copy(), u[1, :].copy(), xref[0, :] - z[0, :] * np.sin(yaw),
+            xref[1, :] + z[0, :] * np.cos(yaw), yaw + z[1, :], z[2, :].copy())
+
+
+def get_problem(T, blocks=None, nx=NX):
+    """Cached LinearMPCProblem of a horizon, built and compiled on first use"""
+    problem = _problems.get((T, blocks, nx))
+    if problem is None:
+        with _phase("build"):
+            problem = LinearMPCProblem(T, blocks, nx)
+            problem.compile()
+        _problems[T, blocks, nx] = problem
+    return problem
+
+
+def choose_horizon(v, ck, ind, dl, cs=None, loop=False):
+    """
+    Horizon length T of a tick, see ADAPTIVE_HORIZON
 
-        A, B, C = get_linear_model_matrix(
-            xbar[2, t], xbar[3, t], dref[0, t])
-        constraints += [x[:, t + 1] == A @ x[:, t] + B @ u[:, t] + C]
+    v: current speed
+    ck: course curvature array
+    ind: course index of the target point
+    dl: course tick [m]
+    cs: course arc length array, needed for non-uniformly sampled courses
 
-        if t < (T - 1):
-            cost += cvxpy.quad_form(u[:, t + 1] - u[:, t], Rd)
-            constraints += [cvxpy.abs(u[1, t + 1] - u[1, t]) <=
-                            MAX_DSTEER * DT]
+    The speed asks for the share |v| / HORIZON_SPEED of the longest
+    horizon, the curvature ahead for the share max|ck| / HORIZON_CURVATURE.
+    The curvature ahead is the one within the lookahead of the longest
+    horizon, at least at TARGET_SPEED. The larger share is rounded up to
+    the next of HORIZON_BUCKETS.
+    """
+    buckets = sorted(HORIZON_BUCKETS)
+    lookahead = max(abs(v), TARGET_SPEED) * np.sum(horizon_steps(buckets[-1]))
+    n = len(ck)
+    i0 = ind % n if loop else min(ind, n - 1)
+    if cs is None:
+        count = int(lookahead / dl) + 1
+    else:
+        s = cs[i0] + lookahead
+        count = int(np.searchsorted(cs, s, side="right")) - i0
+        if loop and s > cs[-1]:
+            count += int(np.searchsorted(cs, s - cs[-1], side="right"))
+    indices = i0 + np.arange(max(count, 1))
+    indices = indices % n if loop else indices[indices < n]
+    curvature = np.max(np.abs(ck[indices]))
 
-    cost += cvxpy.quad_form(xref[:, T] - x[:, T], Qf)
+    share = max(min(abs(v) / HORIZON_SPEED, 1.0),
+                min(curvature / HORIZON_CURVATURE, 1.0))
+    needed = buckets[0] + share * (buckets[-1] - buckets[0])
+    return next(horizon for horizon in buckets if horizon >= needed - 1e-9)
 
-    constraints += [x[:, 0] == x0]
-    constraints += [x[2, :] <= MAX_SPEED]
-    constraints += [x[2, :] >= MIN_SPEED]
-    constraints += [cvxpy.abs(u[0, :]) <= MAX_ACCEL]
-    constraints += [cvxpy.abs(u[1, :]) <= MAX_STEER]
 
-    prob = cvxpy.Problem(cvxpy.Minimize(cost), constraints)
-    prob.solve(solver=cvxpy.CLARABEL, verbose=False)
+def reachable_travel(t, v_cap):
+    """
+    Distance [m] covered in t [s] from standstill, accelerating at MAX_ACCEL up to v_cap
 
-    if prob.status == cvxpy.OPTIMAL or prob.status == cvxpy.OPTIMAL_INACCURATE:
-        ox = get_nparray_from_matrix(x.value[0, :])
-        oy = get_nparray_from_matrix(x.value[1, :])
-        ov = get_nparray_from_matrix(x.value[2, :])
-        oyaw = get_nparray_from_matrix(x.value[3, :])
-        oa = get_nparray_from_matrix(u.value[0, :])
-        odelta = get_nparray_from_matrix(u.value[1, :])
+    The reference points are at least this far apart, so they do not all
+    collapse onto a vehicle at standstill: a plan that has to stay on them
+    would never build up speed.
+    """
+    t = np.asarray(t, dtype=float)
+    t_ramp = v_cap / MAX_ACCEL
+    return np.where(t < t_ramp, 0.5 * MAX_ACCEL * t ** 2, v_cap * (t - 0.5 * t_ramp))
 
-    else:
-        print("Error: Cannot solve mpc..")
-        oa, odelta, ox, oy, oyaw, ov = None, None, None, None, None, None
 
-    return oa, odelta, ox, oy, oyaw, ov
+def calc_ref_trajectory(state, cx, cy, cyaw, ck, sp, dl, pind, cs=None,
+                        loop=False, horizon=None):
+    """
+    Reference trajectory over the horizon
+
+    When the course arc length `cs` is given, reference points are
+    interpolated by travelled distance, so courses with non-uniform spacing
+    (see `create_adaptive_trajectory`) work. Otherwise the course is assumed
+    to be sampled every `dl` meters.
 
+    On a closed `loop` course the returned index keeps counting over laps
+    and the reference wraps around the seam, with the yaw unwrapped.
 
-def calc_ref_trajectory(state, cx, cy, cyaw, ck, sp, dl, pind):
-    xref = np.zeros((NX, T + 1))
-    dref = np.zeros((1, T + 1))
+    Point i lies the distance the current speed covers in DT plus the
+    steps of the first i stages ahead, see horizon_steps, but at least the
+    distance reachable from standstill (see reachable_travel). The horizon
+    has `horizon` stages, by default T.
+    """
+    if horizon is None:
+        horizon = T
+    xref = np.zeros((NX, horizon + 1))
+    dref = np.zeros((1, horizon + 1))
     ncourse = len(cx)
 
-    ind, _ = calc_nearest_index(state, cx, cy, cyaw, pind)
+    ind, _ = calc_nearest_index(state, cx, cy, cyaw, pind, loop)
 
     if pind >= ind:
         ind = pind
 
-    xref[0, 0] = cx[ind]
-    xref[1, 0] = cy[ind]
-    xref[2, 0] = sp[ind]
-    xref[3, 0] = cyaw[ind]
+    lap_yaw = calc_lap_yaw(cyaw) if loop else 0.0
+    lap, i0 = divmod(ind, ncourse)
+
+    xref[0, 0] = cx[i0]
+    xref[1, 0] = cy[i0]
+    xref[2, 0] = sp[i0]
+    xref[3, 0] = cyaw[i0] + lap * lap_yaw
     dref[0, 0] = 0.0  # steer operational point should be 0
 
+    if cs is not None:
+        # project the vehicle on the course to start from its arc length
+        s0 = cs[i0] + (state.x - cx[i0]) * math.cos(cyaw[i0]) \
+            + (state.y - cy[i0]) * math.sin(cyaw[i0])
+        if HORIZON_DT is None:
+            travel = abs(state.v) * DT * np.arange(1, horizon + 2)
+        else:
+            travel = abs(state.v) * np.cumsum(np.append(DT, horizon_steps(horizon)))
+        travel = np.maximum(travel, reachable_travel(
+            np.cumsum(np.append(DT, horizon_steps(horizon))), abs(sp[i0])))
+
+        if loop:
+            length = cs[-1] + math.hypot(cx[0] - cx[-1], cy[0] - cy[-1])
+            laps, s_ref = np.divmod(s0 + travel, length)
+            xref[0, :] = interp_loop(s_ref, cs, length, cx)
+            xref[1, :] = interp_loop(s_ref, cs, length, cy)
+            xref[2, :] = interp_loop(s_ref, cs, length, sp)
+            xref[3, :] = interp_loop(s_ref, cs, length, cyaw, lap_yaw) \
+                + (lap + laps) * lap_yaw
+        else:
+            s_ref = np.clip(s0 + travel, cs[0], cs[-1])
+            xref[0, :] = np.interp(s_ref, cs, cx)
+            xref[1, :] = np.interp(s_ref, cs, cy)
+            xref[2, :] = np.interp(s_ref, cs, sp)
+            xref[3, :] = np.interp(s_ref, cs, cyaw)
+
+        return xref, ind, dref
+
     travel = 0.0
+    steps = np.append(DT, horizon_steps(horizon))
+    reachable = reachable_travel(np.cumsum(steps), abs(sp[i0]))
 
-    for i in range(T + 1):
-        travel += abs(state.v) * DT
-        dind = int(round(travel / dl))
+    for i in range(horizon + 1):
+        travel += abs(state.v) * steps[i]
+        dind = int(round(max(travel, reachable[i]) / dl))
 
-        if (ind + dind) < ncourse:
-            xref[0, i] = cx[ind + dind]
-            xref[1, i] = cy[ind + dind]
-            xref[2, i] = sp[ind + dind]
-            xref[3, i] = cyaw[ind + dind]
-            dref[0, i] = 0.0
+        if loop:
+            lap, k = divmod(ind + dind, ncourse)
         else:
-            xref[0, i] = cx[ncourse - 1]
-            xref[1, i] = cy[ncourse - 1]
-            xref[2, i] = sp[ncourse - 1]
-            xref[3, i] = cyaw[ncourse - 1]
-            dref[0, i] = 0.0
+            lap, k = 0, min(ind + dind, ncourse - 1)
+
+        xref[0, i] = cx[k]
+        xref[1, i] = cy[k]
+        xref[2, i] = sp[k]
+        xref[3, i] = cyaw[k] + lap * lap_yaw
+        dref[0, i] = 0.0
 
     return xref, ind, dref
 
 
+def calc_frenet_reference(state, cx, cy, cyaw, ck, sp, dl, pind, oa,
+                          cs=None, loop=False, horizon=None):
+    """
+    Reference of the frenet formulation over the horizon
+
+    oa: accelerations of the last plan, None at the start
+    horizon: stages of the horizon, by default T
+
+    The stages follow the course from the projection of the vehicle by the
+    distance it covers with the last plan, one tick later: the speed of
+    stage i is the current one plus its accelerations up to the stage.
+    Without `cs` the course is assumed to be sampled every `dl` meters.
+
+    Returns xref (x, y, speed profile and yaw of the stage points), the
+    nearest index like calc_ref_trajectory, the curvature kref and the
+    speeds vbar of the stages, and the initial state z0 = (lateral error,
+    heading error, v) at the projection.
+    """
+    if horizon is None:
+        horizon = T
+    ncourse = len(cx)
+    ind, _ = calc_nearest_index(state, cx, cy, cyaw, pind, loop)
+    if pind >= ind:
+        ind = pind
+    lap, i0 = divmod(ind, ncourse)
+    if cs is None:
+        cs = dl * np.arange(ncourse)
+
+    steps = horizon_steps(horizon)
+    accel = np.zeros(horizon)
+    if oa is not None:
+        shifted = np.asarray(oa, dtype=float)[1:horizon + 1]
+        accel[:len(shifted)] = shifted
+        accel[len(shifted):] = oa[-1]
+    vbar = np.clip(state.v + np.append(0.0, np.cumsum(accel * steps)),
+                   MIN_SPEED, MAX_SPEED)
+
+    s0 = cs[i0] + (state.x - cx[i0]) * math.cos(cyaw[i0]) \
+        + (state.y - cy[i0]) * math.sin(cyaw[i0])
+    s = s0 + np.append(0.0, np.cumsum(np.abs(vbar[:horizon]) * steps))
+
+    xref = np.zeros((NX, horizon + 1))
+    if loop:
+        lap_yaw = calc_lap_yaw(cyaw)
+        length = cs[-1] + math.hypot(cx[0] - cx[-1], cy[0] - cy[-1])
+        laps, s = np.divmod(s, length)
+        values = [interp_loop(s, cs, length, c) for c in (cx, cy, sp, ck)]
+        values.insert(3, interp_loop(s, cs, length, cyaw, lap_yaw)
+                      + (lap + laps) * lap_yaw)
+    else:
+        s = np.clip(s, cs[0], cs[-1])
+        values = [np.interp(s, cs, c) for c in (cx, cy, sp, cyaw, ck)]
+        # no position error along the course, brake for the goal in time
+        stop = np.sqrt(2.0 * MAX_ACCEL * (cs[-1] - s))
+        values[2] = np.clip(values[2], -stop, stop)
+    xref[0, :], xref[1, :], xref[2, :], xref[3, :], kref = values
+
+    dx, dy = state.x - xref[0, 0], state.y - xref[1, 0]
+    z0 = [-dx * math.sin(xref[3, 0]) + dy * math.cos(xref[3, 0]),
+          pi_2_pi(state.yaw - xref[3, 0]), state.v]
+
+    return xref, ind, kref, vbar, z0
+
+
 def check_goal(state, goal, tind, nind):
 
     # check goal
@@ -363,7 +991,9 @@ def check_goal(state, goal, tind, nind):
     return False
 
 
-def do_simulation(cx, cy, cyaw, ck, sp, dl, initial_state):
+def do_simulation(cx, cy, cyaw, ck, sp, dl, initial_state, cs=None,
+                  loop=False, on_step=None, animate=None, profiler=None,
+                  memory=None):
     """
     Simulation
 
@@ -373,125 +1003,177 @@ def do_simulation(cx, cy, cyaw, ck, sp, dl, initial_state):
     ck: course curvature list
     sp: speed profile
     dl: course tick [m]
-
+    cs: course arc length list, needed for non-uniformly sampled courses
+    loop: drive laps of a closed course until MAX_TIME instead of stopping
+        at the goal. Only the last HISTORY_LEN steps are kept then.
+    on_step: called as on_step(result) after every recorded step, e.g. to
+        stream the steps to a ResultStore run. If it returns True, the
+        simulation stops.
+    animate: draw the live view, by default show_animation. Runs in a
+        background thread must not animate, matplotlib is not thread-safe.
+    profiler: a utils.profiler.PhaseProfiler that records the time of every
+        phase of every tick. Without one the phases are not timed.
+    memory: a utils.memory.MemoryTracer that traces the allocations of the
+        run and snapshots them every few steps.
+
+    The controller runs every DT, the plant every PLANT_DT with the inputs
+    of the last plan held or interpolated in between (see held_input).
+    Every plant step is recorded, those between two ticks have no solve
+    time (NaN).
+
+    With ADAPTIVE_HORIZON the horizon is chosen every tick (see
+    choose_horizon) instead of T, which is left as it is. The problems of
+    all HORIZON_BUCKETS are compiled up front, so switching costs nothing.
+
+    With EVENT_TRIGGER the last plan is reused while it is valid (see
+    plan_still_valid) instead of solving every tick. Steps without a solve
+    have no solve time (NaN).
+
+    FORMULATION selects the MPC model of the run: "global" linearizes the
+    bicycle in x, y, v, yaw (see iterative_linear_mpc_control), "frenet"
+    in path coordinates (see frenet_mpc_control). The xref of a frenet
+    step holds its stage points on the course.
+
+    Returns a SimulationResult. Like the steering and acceleration, the MPC
+    prediction (ox, oy) and xref of a step are the ones that led to its
+    state. It still unpacks as t, x, y, yaw, v, d, a. Its termination tells whether
+    the run reached the goal, ran out of MAX_TIME or was stopped.
     """
-
-    goal = [cx[-1], cy[-1]]
-
-    state = initial_state
-
-    # initial yaw compensation
-    if state.yaw - cyaw[0] >= math.pi:
-        state.yaw -= math.pi * 2.0
-    elif state.yaw - cyaw[0] <= -math.pi:
-        state.yaw += math.pi * 2.0
-
-    time = 0.0
-    x = [state.x]
-    y = [state.y]
-    yaw = [state.yaw]
-    v = [state.v]
-    t = [0.0]
-    d = [0.0]
-    a = [0.0]
-    target_ind, _ = calc_nearest_index(state, cx, cy, cyaw, 0)
-
-    odelta, oa = None, None
-
-    cyaw = smooth_yaw(cyaw)
-
-    while MAX_TIME >= time:
-        xref, target_ind, dref = calc_ref_trajectory(
-            state, cx, cy, cyaw, ck, sp, dl, target_ind)
-
-        x0 = [state.x, state.y, state.v, state.yaw]  # current state
-
-        oa, odelta, ox, oy, oyaw, ov = iterative_linear_mpc_control(
-            xref, x0, dref, oa, odelta)
-
-        di, ai = 0.0, 0.0
-        if odelta is not None:
-            di, ai = odelta[0], oa[0]
-            state = update_state(state, ai, di)
-
-        time = time + DT
-
-        x.append(state.x)
-        y.append(state.y)
-        yaw.append(state.yaw)
-        v.append(state.v)
-        t.append(time)
-        d.append(di)
-        a.append(ai)
-
-        if check_goal(state, goal, target_ind, len(cx)):
-            print("Goal")
-            break
-
-        if show_animation:  # pragma: no cover
-            plt.cla()
-            # for stopping simulation with the esc key.
-            plt.gcf().canvas.mpl_connect('key_release_event',
-                    lambda event: [exit(0) if event.key == 'escape' else None])
-            if ox is not None:
-                plt.plot(ox, oy, "xr", label="MPC")
-            plt.plot(cx, cy, "-r", label="course")
-            plt.plot(x, y, "ob", label="trajectory")
-            plt.plot(xref[0, :], xref[1, :], "xk", label="xref")
-            plt.plot(cx[target_ind], cy[target_ind], "xg", label="target")
-            plot_car(state.x, state.y, state.yaw, steer=di)
-            plt.axis("equal")
-            plt.grid(True)
-            plt.title("Time[s]:" + str(round(time, 2))
-                      + ", speed[km/h]:" + str(round(state.v * 3.6, 2)))
-            plt.pause(0.0001)
-
-    return t, x, y, yaw, v, d, a
-
-
-def calc_speed_profile(cx, cy, cyaw, target_speed):
-
-    speed_profile = [target_speed] * len(cx)
-    direction = 1.0  # forward
-
-    # Set stop point
-    for i in range(len(cx) - 1):
-        dx = cx[i + 1] - cx[i]
-        dy = cy[i + 1] - cy[i]
-
-        move_direction = math.atan2(dy, dx)
-
-        if dx != 0.0 and dy != 0.0:
-            dangle = abs(pi_2_pi(move_direction - cyaw[i]))
-            if dangle >= math.pi / 4.0:
-                direction = -1.0
+    global _profiler
+    if FORMULATION not in FORMULATIONS:
+        raise ValueError(f"FORMULATION {FORMULATION!r} is not one of {FORMULATIONS}")
+    if ADAPTIVE_HORIZON:
+        for horizon in HORIZON_BUCKETS:
+            get_problem(horizon, move_blocks(horizon),
+                        NZ if FORMULATION == "frenet" else NX)
+
+    _profiler = profiler
+    if memory is not None:
+        memory.start()
+    try:
+        cx, cy, cyaw, ck, sp = (np.array(c, dtype=float) for c in (cx, cy, cyaw, ck, sp))
+        if cs is not None:
+            cs = np.asarray(cs, dtype=float)
+
+        goal = [cx[-1], cy[-1]]
+
+        state = initial_state
+
+        # initial yaw compensation
+        if state.yaw - cyaw[0] >= math.pi:
+            state.yaw -= math.pi * 2.0
+        elif state.yaw - cyaw[0] <= -math.pi:
+            state.yaw += math.pi * 2.0
+
+        time = 0.0
+        stored = max(HORIZON_BUCKETS) if ADAPTIVE_HORIZON else T  # horizon stored per step
+        # a bounded ring buffer for endless loop runs
+        if loop:
+            result = SimulationResult(HISTORY_LEN, stored, NX, ring=True)
+        else:
+            result = SimulationResult(int(MAX_TIME / plant_steps()[0]) + 2, stored, NX)
+        result.append(time, state.x, state.y, state.yaw, state.v, 0.0, 0.0)
+        if on_step is not None and on_step(result):
+            result.termination = SimulationResult.END_STOPPED
+            return result
+        target_ind, _ = calc_nearest_index(state, cx, cy, cyaw, 0)
+
+        odelta, oa = None, None
+        plan, age = None, 0  # last solved plan and the ticks since, EVENT_TRIGGER
+
+        cyaw = smooth_yaw(cyaw)
+
+        if animate is None:
+            animate = show_animation
+        view = None
+        if animate:  # pragma: no cover
+            from utils.live_view import LiveView
+            view = LiveView(cx, cy, vehicle_geometry(), fps=ANIMATION_FPS)
+
+        target_speed = TARGET_SPEED
+        while MAX_TIME >= time:
+            if TARGET_SPEED != target_speed and target_speed > 0:
+                sp = sp * (TARGET_SPEED / target_speed)  # changed by set_params
+            target_speed = TARGET_SPEED
+
+            plant_dt, substeps = plant_steps()
+            tick_start = perf_counter()
+            horizon = T
+            if ADAPTIVE_HORIZON:
+                horizon = choose_horizon(state.v, ck, target_ind, dl, cs, loop)
+            frenet = FORMULATION == "frenet"
+            with _phase("ref"):
+                if frenet:
+                    xref, target_ind, kref, vbar, z0 = calc_frenet_reference(
+                        state, cx, cy, cyaw, ck, sp, dl, target_ind, oa, cs, loop, horizon)
+                else:
+                    xref, target_ind, dref = calc_ref_trajectory(
+                        state, cx, cy, cyaw, ck, sp, dl, target_ind, cs, loop, horizon)
+
+            x0 = [state.x, state.y, state.v, state.yaw]  # current state
+
+            if EVENT_TRIGGER and plan is not None \
+                    and plan_still_valid(plan, age + 1, x0, xref):
+                age += 1
+                solve_time = np.nan
             else:
-                direction = 1.0
-
-        if direction != 1.0:
-            speed_profile[i] = - target_speed
+                solve_start = perf_counter()
+                if frenet:
+                    oa, odelta, ox, oy, oyaw, ov = frenet_mpc_control(xref, kref, vbar, z0)
+                else:
+                    oa, odelta, ox, oy, oyaw, ov = iterative_linear_mpc_control(
+                        xref, x0, dref, oa, odelta)
+                solve_time = perf_counter() - solve_start
+                plan = None if odelta is None else (
+                    horizon_steps(horizon), ox, oy, ov, oyaw, xref)
+                age = 0
+            if _profiler is not None:
+                _profiler.end_step(perf_counter() - tick_start)
+
+            status = SimulationResult.STATUS_FAILED
+            if odelta is not None:
+                status = SimulationResult.STATUS_OK
+
+            for j in range(substeps):
+                di, ai = 0.0, 0.0
+                if odelta is not None:
+                    # the share of the stage, which may be longer than DT
+                    fraction = min(j / substeps * DT / plan[0][age], 1.0)
+                    di, ai = held_input(oa, odelta, age, fraction)
+                    state = update_state(state, ai, di, plant_dt)
+
+                time = time + plant_dt
+
+                nearest_ind, _ = calc_nearest_index(state, cx, cy, cyaw, target_ind, loop)
+                e_lat = calc_lateral_error(state, cx, cy, cyaw, nearest_ind)
+                result.append(time, state.x, state.y, state.yaw, state.v, di, ai,
+                              ox[age:] if age else ox, oy[age:] if age else oy,
+                              xref, e_lat, solve_time if j == 0 else np.nan,
+                              status, target_ind % len(cx))
+                if memory is not None:
+                    memory.step()
+                if on_step is not None and on_step(result):
+                    result.termination = SimulationResult.END_STOPPED
+                elif not loop and check_goal(state, goal, target_ind, len(cx)):
+                    print("Goal")
+                    result.termination = SimulationResult.END_GOAL
+                elif view is not None and view.update(result):
+                    result.termination = SimulationResult.END_STOPPED  # the esc key
+                if result.termination is not None:
+                    break
+            if result.termination is not None:
+                break
         else:
-            speed_profile[i] = target_speed
-
-    speed_profile[-1] = 0.0
-
-    return speed_profile
+            result.termination = SimulationResult.END_MAX_TIME
 
+        if view is not None:
+            view.update(result, force=True)
 
-def smooth_yaw(yaw):
-
-    for i in range(len(yaw) - 1):
-        dyaw = yaw[i + 1] - yaw[i]
-
-        while dyaw >= math.pi / 2.0:
-            yaw[i + 1] -= math.pi * 2.0
-            dyaw = yaw[i + 1] - yaw[i]
-
-        while dyaw <= -math.pi / 2.0:
-            yaw[i + 1] += math.pi * 2.0
-            dyaw = yaw[i + 1] - yaw[i]
-
-    return yaw
+        return result
+    finally:
+        _profiler = None
+        if memory is not None:
+            memory.stop()
 
 
 def get_straight_course(dl):
@@ -572,7 +1254,39 @@ def create_custom_trajectory(waypoints, dl=1.0):
     
     return cx, cy, cyaw, ck
 
+def create_adaptive_trajectory(waypoints, max_error=0.05, ds_min=0.1, ds_max=5.0):
+    """
+    Create a trajectory with curvature adaptive spacing from waypoints.
+
+    Straight parts get few points and tight turns many, so long courses are
+    much smaller than with a fixed `dl`. Pass the returned arc length to
+    `do_simulation` as `cs`.
+
+    Parameters
+    ----------
+    waypoints : list of tuples
+        List of (x, y) coordinates defining the waypoints of the trajectory
+    max_error : float, optional
+        Maximum lateral error of the sampled course [m], by default 0.05
+    ds_min : float, optional
+        Minimum distance between points [m], by default 0.1
+    ds_max : float, optional
+        Maximum distance between points [m], by default 5.0
+
+    Returns
+    -------
+    tuple
+        (cx, cy, cyaw, ck, cs) - course x, y, yaw, curvature and arc length lists
+    """
+    ax = [point[0] for point in waypoints]
+    ay = [point[1] for point in waypoints]
+
+    return cubic_spline_planner.calc_adaptive_spline_course(
+        ax, ay, max_error=max_error, ds_min=ds_min, ds_max=ds_max)
+
 def main():
+    global MAX_TIME, ANIMATION_FPS, show_animation
+
     parser = argparse.ArgumentParser(description='Run MPC with custom trajectory')
     parser.add_argument('--trajectory', '-t', 
                         choices=list(TRAJECTORIES.keys()),
@@ -582,45 +1296,140 @@ def main():
                     help=f'Target speed in km/h (default: {TARGET_SPEED*3.6})')
     parser.add_argument('--dl', type=float, default=1.0,
                         help='Distance between interpolated points (default: 1.0)')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Sample the course adaptively to its curvature instead of every dl')
+    parser.add_argument('--max-error', type=float, default=0.05,
+                        help='Max lateral error of the adaptive course in m (default: 0.05)')
+    parser.add_argument('--loop', action='store_true',
+                        help='Drive laps of a closed course until --max-time (soak run)')
+    parser.add_argument('--max-time', type=float, default=MAX_TIME,
+                        help=f'Max simulation time in s (default: {MAX_TIME})')
     parser.add_argument('--no-animation', action='store_true',
                         help='Disable animation for faster computation')
+    parser.add_argument('--fps', type=float, default=ANIMATION_FPS,
+                        help=f'Max frame rate of the animation (default: {ANIMATION_FPS})')
+    parser.add_argument('--headless', action='store_true',
+                        help='No animation and no plots, matplotlib is never imported')
+    parser.add_argument('--record', default=None, metavar='FILE',
+                        help='Save the run to an npz file, e.g. for python -m utils.render')
+    parser.add_argument('--store', default=None, metavar='DIR',
+                        help='Append the run to the columnar result store in DIR')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of every control tick and print p50/p95/max')
+    parser.add_argument('--dt', type=float, default=DT,
+                        help=f'Control period in s (default: {DT})')
+    parser.add_argument('--plant-dt', type=float, default=None,
+                        help='Plant integration step in s, must divide --dt (default: --dt)')
+    parser.add_argument('--input-hold', choices=('zoh', 'linear'), default=INPUT_HOLD,
+                        help='Inputs between two control ticks: held or interpolated along the plan')
+    parser.add_argument('--horizon-dt', type=float, nargs='+', default=None, metavar='STEP',
+                        help='Step of every horizon stage in s, e.g. 0.2 0.2 0.4 0.6 0.6 (sets T)')
+    parser.add_argument('--move-blocks', type=int, nargs='+', default=None, metavar='N',
+                        help='Stages per input block, e.g. 1 1 2 4 (the last repeats)')
+    parser.add_argument('--adaptive-horizon', action='store_true',
+                        help='Choose the horizon every tick from the speed and the curvature ahead instead of T')
+    parser.add_argument('--event-trigger', action='store_true',
+                        help='Reuse the last plan while it is valid, solve only when it is not')
+    parser.add_argument('--formulation', choices=FORMULATIONS, default=FORMULATION,
+                        help='MPC model: global x, y, v, yaw or frenet path coordinates')
+    parser.add_argument('--qp-scaling', action='store_true',
+                        help='Scale the QP states and inputs by the vehicle limits, positions relative to the vehicle')
+    parser.add_argument('--trace-memory', type=int, default=None, metavar='N',
+                        help='Trace allocations, snapshot every N steps and print the growth')
     
     args = parser.parse_args()
     
     # Set animation flag
-    # import PathTracking.model_predictive_speed_and_steer_control.model_predictive_speed_and_steer_control as mpc_module
-    # mpc_module.show_animation = not args.no_animation
-    show_animation = not args.no_animation
+    show_animation = not (args.no_animation or args.headless)
+    MAX_TIME = args.max_time
+    try:
+        set_params(TARGET_SPEED=args.speed / 3.6, EVENT_TRIGGER=args.event_trigger,
+                   DT=args.dt, PLANT_DT=args.plant_dt, INPUT_HOLD=args.input_hold,
+                   ADAPTIVE_HORIZON=args.adaptive_horizon, HORIZON_DT=args.horizon_dt,
+                   MOVE_BLOCKS=args.move_blocks, FORMULATION=args.formulation,
+                   QP_SCALING=args.qp_scaling)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.horizon_dt:
+        set_params(T=len(args.horizon_dt))
+    ANIMATION_FPS = args.fps
     
     print(f"Generating trajectory: {args.trajectory}")
     print(f"Target speed: {args.speed} m/s")
     
-    # Get waypoints for the selected trajectory
-    waypoints = TRAJECTORIES[args.trajectory]()
-    
-    # Create a trajectory from waypoints
+    # Get the compiled course (spline, smoothed yaw and speed profile),
+    # from the course cache if it was compiled before
     dl = args.dl
-    cx, cy, cyaw, ck = create_custom_trajectory(waypoints, dl)
-    
-    # Calculate speed profile
-    sp = calc_speed_profile(cx, cy, cyaw, args.speed / 3.6)  # Convert km/h to m/s
+    course = COURSES.get(args.trajectory, dl=dl,
+                         target_speed=args.speed / 3.6,  # Convert km/h to m/s
+                         adaptive=args.adaptive, max_error=args.max_error,
+                         loop=args.loop)
+    cx, cy, cyaw, ck, sp, cs = course.cx, course.cy, course.cyaw, course.ck, course.sp, course.cs
+    if args.adaptive:
+        print(f"Adaptive course: {len(cx)} points")
     
     # Set initial state to the beginning of the trajectory
     initial_state = State(x=cx[0], y=cy[0], yaw=cyaw[0], v=0.0)
     
     # Run simulation
+    run = None
+    if args.store:
+        from utils.result_store import ResultStore
+        run = ResultStore(args.store).run(
+            trajectory=args.trajectory, speed=args.speed, dl=dl,
+            adaptive=args.adaptive, loop=args.loop, T=T, DT=DT,
+            MAX_ITER=MAX_ITER)
+
+    profiler = None
+    if args.profile:
+        from utils.profiler import PhaseProfiler
+        profiler = PhaseProfiler()
+
+    memory = None
+    if args.trace_memory:
+        from utils.memory import MemoryTracer
+        memory = MemoryTracer(every=args.trace_memory)
+
     start_time = time.time()
-    t, x, y, yaw, v, d, a = do_simulation(
-        cx, cy, cyaw, ck, sp, dl, initial_state)
+    result = do_simulation(
+        cx, cy, cyaw, ck, sp, dl, initial_state, cs, loop=args.loop,
+        on_step=run, profiler=profiler, memory=memory)
+    if run is not None:
+        run.close()
+        print(f"Stored run {run.run_id} in {args.store}")
+    if args.record:
+        result.save(args.record, cx, cy, geometry=vehicle_geometry(),
+                    trajectory=args.trajectory)
+        print(f"Recorded run to {args.record}")
+    t, x, y, v = result.t, result.x, result.y, result.v
     
     elapsed_time = time.time() - start_time
     print(f"Simulation completed in {elapsed_time:.4f} seconds")
-    
+    summary = result.summary(cx, cy)
+    print(f"Average speed: {summary['mean_speed'] * 3.6:.2f} km/h, "
+          f"RMS lateral error: {summary['rms_lateral_error']:.3f} m")
+    if EVENT_TRIGGER or PLANT_DT is not None:
+        print(f"Solved {summary['solves']} times in {summary['steps'] - 1} steps "
+              f"({summary['solve_rate']:.0%})")
+    if profiler is not None:
+        print("Control loop phases:")
+        print(profiler.report())
+    if memory is not None:
+        print("Memory:")
+        print(memory.report())
+
+    if args.headless:
+        return
+
+    import matplotlib.pyplot as plt
+    from utils.lod import plot_lod
     plt.figure(figsize=(12, 9))
     
-    plt.subplot(2, 1, 1)
-    plt.plot(cx, cy, "-r", label="reference path")
-    plt.plot(x, y, "-g", label="tracking path")
+    # long courses and runs are drawn with the points visible at the zoom
+    ax = plt.subplot(2, 1, 1)
+    plot_lod(ax, cx, cy, "-r", label="reference path")
+    plot_lod(ax, x, y, "-g", label="tracking path")
+    plot_footprint(result)
     plt.grid(True)
     plt.axis("equal")
     plt.xlabel("x[m]")
@@ -628,8 +1437,8 @@ def main():
     plt.legend()
     plt.title(f"Trajectory: {args.trajectory}")
     
-    plt.subplot(2, 1, 2)
-    plt.plot(t, [speed * 3.6 for speed in v], "-r", label="speed")
+    ax = plt.subplot(2, 1, 2)
+    plot_lod(ax, t, v * 3.6, "-r", kind="series", label="speed")
     plt.grid(True)
     plt.xlabel("Time [s]")
     plt.ylabel("Speed [km/h]")
@@ -1,6 +1,7 @@
 """
 Run the MPC trajectory GUI application
 """
+import multiprocessing
 import tkinter as tk
 import sys
 import pathlib
@@ -45,4 +46,5 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # comparison workers of a frozen app
     main()
\ No newline at end of file
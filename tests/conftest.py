@@ -0,0 +1,17 @@
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def mpc():
+    """The mpc module, its tunable parameters restored after the test"""
+    import mpc
+
+    params = {name: getattr(mpc, name) for name in mpc.TUNABLE_PARAMS}
+    yield mpc
+    mpc.set_params(**params)
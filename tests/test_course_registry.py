@@ -0,0 +1,84 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import course_registry
+from course_registry import CourseRegistry
+
+WAYPOINTS = [(0.0, 0.0), (10.0, 4.0), (20.0, -3.0), (30.0, 0.0)]
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """Names of the courses compiled, not loaded from a cache"""
+    names = []
+    compile_course = course_registry.compile_course
+
+    def counting(name, *args, **kwargs):
+        names.append(name)
+        return compile_course(name, *args, **kwargs)
+
+    monkeypatch.setattr(course_registry, "compile_course", counting)
+    return names
+
+
+def test_cache_hit_returns_identical_arrays(tmp_path, compiles):
+    trajectories = {"S": lambda: WAYPOINTS}
+    compiled = CourseRegistry(trajectories, tmp_path).get("S", dl=0.5)
+    loaded = CourseRegistry(trajectories, tmp_path).get("S", dl=0.5)
+
+    assert compiles == ["S"]
+    for field in CourseRegistry._FIELDS:
+        np.testing.assert_array_equal(getattr(loaded, field), getattr(compiled, field))
+    assert (loaded.dl, loaded.adaptive, loaded.loop) == (0.5, False, False)
+
+
+def test_changed_key_compiles_again(tmp_path, compiles):
+    waypoints = list(WAYPOINTS)
+    trajectories = {"S": lambda: waypoints}
+    first = CourseRegistry(trajectories, tmp_path).get("S")
+
+    CourseRegistry(trajectories, tmp_path).get("S", target_speed=5.0)
+    waypoints[-1] = (30.0, 1.0)
+    course = CourseRegistry(trajectories, tmp_path).get("S")
+
+    assert compiles == ["S", "S", "S"]
+    assert course.cy[-1] > first.cy[-1]
+
+
+def test_new_cache_version_ignores_old_files(tmp_path, compiles, monkeypatch):
+    trajectories = {"S": lambda: WAYPOINTS}
+    CourseRegistry(trajectories, tmp_path).get("S")
+    monkeypatch.setattr(course_registry, "CACHE_VERSION", course_registry.CACHE_VERSION + 1)
+    CourseRegistry(trajectories, tmp_path).get("S")
+
+    assert compiles == ["S", "S"]
+    assert len(list(tmp_path.glob("v*/*.npz"))) == 2
+
+
+def test_concurrent_gets_compile_once(tmp_path, compiles, monkeypatch):
+    compile_course = course_registry.compile_course
+
+    def slow(*args, **kwargs):
+        time.sleep(0.2)  # both threads are waiting for the course by now
+        return compile_course(*args, **kwargs)
+
+    monkeypatch.setattr(course_registry, "compile_course", slow)
+    registry = CourseRegistry({"S": lambda: WAYPOINTS}, tmp_path)
+    start = threading.Barrier(2)
+    courses = []
+
+    def get():
+        start.wait()
+        courses.append(registry.get("S"))
+
+    threads = [threading.Thread(target=get) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert compiles == ["S"]
+    assert courses[0] is courses[1]
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from scipy.interpolate import CubicSpline
+
+from utils.cubic_spline_planner import CubicSpline1D, CubicSpline2D, IncrementalSplineCourse, calc_spline_course
+
+
+def test_banded_natural_spline_matches_scipy():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.uniform(0.5, 2.0, 200))
+    y = rng.normal(0.0, 3.0, 200)
+    spline = CubicSpline1D(x, y)
+    reference = CubicSpline(x, y, bc_type="natural")
+
+    xi = np.linspace(x[0], x[-1], 1001)
+    positions = [spline.calc_position(v) for v in xi]
+    np.testing.assert_allclose(positions, reference(xi), atol=1e-9)
+    np.testing.assert_allclose([spline.calc_first_derivative(v) for v in xi],
+                               reference(xi, 1), atol=1e-9)
+
+
+def test_periodic_spline_matches_scipy():
+    rng = np.random.default_rng(1)
+    x = np.cumsum(rng.uniform(0.5, 2.0, 100))
+    y = rng.normal(0.0, 3.0, 100)
+    y[-1] = y[0]
+    spline = CubicSpline1D(x, y, periodic=True)
+    reference = CubicSpline(x, y, bc_type="periodic")
+
+    xi = np.linspace(x[0], x[-1], 1001)
+    np.testing.assert_allclose([spline.calc_position(v) for v in xi],
+                               reference(xi), atol=1e-9)
+    np.testing.assert_allclose([spline.calc_second_derivative(v) for v in xi],
+                               reference(xi, 2), atol=1e-9)
+
+
+def test_closed_course_is_smooth_at_the_seam():
+    angle = np.linspace(0.0, 2.0 * np.pi, 13)
+    x, y = 10.0 * np.cos(angle), 6.0 * np.sin(angle)
+    x[-1], y[-1] = x[0], y[0]
+    course = CubicSpline2D(x, y, closed=True)
+    start, end = 0.0, course.s[-1]
+
+    np.testing.assert_allclose(course.calc_position(end), course.calc_position(start), atol=1e-9)
+    turn = course.calc_yaw(end) - course.calc_yaw(start)
+    assert np.angle(np.exp(1j * turn)) == pytest.approx(0.0, abs=1e-9)
+    assert course.calc_curvature(end) == pytest.approx(course.calc_curvature(start), abs=1e-9)
+
+
+def test_unsorted_x_is_rejected():
+    with pytest.raises(ValueError):
+        CubicSpline1D([0.0, 2.0, 1.0], [0.0, 1.0, 2.0])
+
+
+def random_waypoints(n, seed):
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0.0, 0.6, n))
+    step = rng.uniform(3.0, 8.0, n)
+    return np.cumsum(step * np.cos(heading)), np.cumsum(step * np.sin(heading))
+
+
+@pytest.mark.parametrize("window, refit, tolerance", [(10, 4, 0.02), (30, 30, 0.01)])
+def test_incremental_course_matches_the_full_spline(window, refit, tolerance):
+    x, y = random_waypoints(30, seed=2)
+    course = IncrementalSplineCourse(ds=1.0, window=window, refit=refit)
+    for point in zip(x, y):
+        course.append(*point)
+    points = course.points()
+
+    rx, ry, *_ = calc_spline_course(x, y, ds=0.01)
+    dense = np.column_stack((rx, ry))
+    distance = np.min(np.hypot(*np.moveaxis(points[:, None] - dense[None], 2, 0)), axis=1)
+    assert np.max(distance) <= tolerance
+    np.testing.assert_allclose(points[[0, -1]], [(x[0], y[0]), (x[-1], y[-1])], atol=1e-9)
+    # every segment restarts its samples at its waypoint, at most one extra each
+    assert 0 <= len(points) - len(calc_spline_course(x, y, ds=1.0)[0]) <= len(x)
+
+
+def test_incremental_append_keeps_the_earlier_segments():
+    x, y = random_waypoints(20, seed=3)
+    course = IncrementalSplineCourse(ds=1.0, window=10, refit=4)
+    for point in zip(x[:-1], y[:-1]):
+        course.append(*point)
+    before = [segment.copy() for segment in course.segments]
+
+    first = course.append(x[-1], y[-1])
+    assert first == len(x) - 1 - 4
+    for kept, segment in zip(before[:first], course.segments[:first]):
+        np.testing.assert_array_equal(segment, kept)
+    assert course.append(x[-1], y[-1]) == len(course.segments)  # repeated point
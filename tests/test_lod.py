@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from matplotlib.transforms import Affine2D, Bbox
+
+from utils.lod import SPOKE_SPACING, lod_indices
+
+WIDTH, HEIGHT = 200, 100  # [px]
+
+
+def view(x, y):
+    """Transform of the full extent of x, y onto a WIDTH x HEIGHT pixel view"""
+    x0, x1, y0, y1 = np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y)
+    transform = Affine2D().translate(-x0, -y0).scale(WIDTH / (x1 - x0), HEIGHT / (y1 - y0))
+    return transform, Bbox.from_bounds(0.0, 0.0, WIDTH, HEIGHT)
+
+
+def pixels(transform, x, y):
+    return transform.transform(np.column_stack((x, y)))
+
+
+def test_path_keeps_the_ends_and_extrema_within_two_points_per_pixel():
+    t = np.linspace(0.0, 4.0 * np.pi, 100000)
+    x, y = 30.0 * np.cos(t) + t, 10.0 * np.sin(3.0 * t)
+    transform, bbox = view(x, y)
+    indices, gaps = lod_indices(x, y, transform, bbox)
+
+    px = np.floor(pixels(transform, x, y))
+    crossed = np.count_nonzero(np.any(px[1:] != px[:-1], axis=1))
+    assert len(indices) <= 2 * (crossed + 1)
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    kept = px[indices]
+    np.testing.assert_array_equal(kept.min(axis=0), px.min(axis=0))
+    np.testing.assert_array_equal(kept.max(axis=0), px.max(axis=0))
+    assert not gaps.any()  # all in view
+
+
+def test_series_keeps_the_extrema_of_every_column():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0.0, 100.0, 100000)
+    y = np.cumsum(rng.normal(0.0, 1.0, len(x)))
+    transform, bbox = view(x, y)
+    indices, _ = lod_indices(x, y, transform, bbox, kind="series")
+
+    assert len(indices) <= 4 * (WIDTH + 1)
+    assert {0, len(x) - 1, int(np.argmin(y)), int(np.argmax(y))} <= set(indices)
+    column = np.floor(pixels(transform, x, y)[:, 0])
+    for c in np.unique(column)[::17]:
+        inside = np.flatnonzero(column == c)
+        assert {inside[np.argmin(y[inside])], inside[np.argmax(y[inside])]} <= set(indices)
+
+
+def test_spokes_are_thinned_along_their_bases():
+    n = 20000
+    t = np.linspace(0.0, 2.0 * np.pi, n)
+    base = np.column_stack((100.0 * np.cos(t), 50.0 * np.sin(t)))
+    tip = base * 1.1
+    x = np.column_stack((base[:, 0], tip[:, 0], np.full(n, np.nan))).ravel()
+    y = np.column_stack((base[:, 1], tip[:, 1], np.full(n, np.nan))).ravel()
+    transform, bbox = view(x, y)
+    indices, gaps = lod_indices(x, y, transform, bbox, kind="spokes")
+
+    bases, tips = indices[0::2], indices[1::2]
+    np.testing.assert_array_equal(tips, bases + 1)
+    np.testing.assert_array_equal(gaps, np.arange(len(indices)) % 2 == 1)
+    assert bases[0] == 0
+
+    pb = pixels(transform, x[0::3], y[0::3])
+    along = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(pb, axis=0).T))))
+    slot = np.floor(along[bases // 3] / SPOKE_SPACING)
+    assert np.all(np.diff(slot) > 0)  # one spoke per SPOKE_SPACING pixels
+    assert len(bases) == len(np.unique(np.floor(along / SPOKE_SPACING)))
+
+
+@pytest.mark.parametrize("kind", ["path", "series"])
+def test_points_outside_the_view_are_dropped(kind):
+    x = np.linspace(0.0, 10.0, 10001)
+    y = np.sin(x)
+    transform, _ = view(x, y)
+    bbox = Bbox.from_bounds(0.0, 0.0, WIDTH / 2, HEIGHT)  # left half zoomed in
+    indices, gaps = lod_indices(x, y, transform, bbox, kind=kind)
+
+    assert indices[0] == 0
+    assert x[indices[-1]] <= 5.0 + 2 * 10.0 / WIDTH
+    assert not gaps[:-1].any()
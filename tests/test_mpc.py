@@ -0,0 +1,257 @@
+import numpy as np
+import pytest
+
+
+def test_horizon_steps_default_to_dt(mpc):
+    mpc.set_params(DT=0.1, HORIZON_DT=None)
+    np.testing.assert_array_equal(mpc.horizon_steps(4), [0.1] * 4)
+
+
+def test_horizon_steps_repeat_the_last_step(mpc):
+    mpc.set_params(HORIZON_DT=(0.2, 0.4, 0.6))
+    np.testing.assert_allclose(mpc.horizon_steps(5), [0.2, 0.4, 0.6, 0.6, 0.6])
+    np.testing.assert_allclose(mpc.horizon_steps(2), [0.2, 0.4])
+
+
+def test_horizon_steps_need_positive_steps(mpc):
+    mpc.set_params(HORIZON_DT=(0.2, 0.0))
+    with pytest.raises(ValueError):
+        mpc.horizon_steps(3)
+
+
+def test_model_is_discretized_over_the_stage_step(mpc):
+    A, B, C = mpc.get_linear_model_matrix(5.0, 0.3, 0.1, dt=0.4)
+    A2, B2, C2 = mpc.get_linear_model_matrix(5.0, 0.3, 0.1, dt=0.2)
+    np.testing.assert_allclose(A - np.eye(mpc.NX), 2.0 * (A2 - np.eye(mpc.NX)))
+    np.testing.assert_allclose(B, 2.0 * B2)
+    np.testing.assert_allclose(C, 2.0 * C2)
+
+
+def straight_reference(mpc, T, v=5.0):
+    """xref, xbar, x0, dref of a straight course along x driven at v"""
+    xref = np.zeros((mpc.NX, T + 1))
+    xref[0] = v * mpc.DT * np.arange(T + 1)
+    xref[2] = v
+    x0 = [0.0, 0.5, 3.0, 0.05]
+    return xref, xref.copy(), x0, np.zeros((1, T + 1))
+
+
+@pytest.mark.parametrize("pattern, T, blocks", [
+    ((1, 1, 2, 4), 10, (1, 1, 2, 4, 2)),
+    ((2,), 5, (2, 2, 1)),
+    ((1, 2), 3, (1, 2)),
+    ((1,), 4, None),
+    (None, 4, None),
+])
+def test_move_blocks_expand_to_the_horizon(mpc, pattern, T, blocks):
+    mpc.set_params(MOVE_BLOCKS=pattern)
+    assert mpc.move_blocks(T) == blocks
+
+
+@pytest.mark.parametrize("pattern", [(0, 2), (1, -1), ()])
+def test_bad_move_blocks_are_rejected_before_they_are_set(mpc, pattern):
+    with pytest.raises(ValueError):
+        mpc.set_params(T=8, MOVE_BLOCKS=pattern)
+    assert mpc.MOVE_BLOCKS is None
+
+
+def test_reference_at_standstill_does_not_collapse(mpc):
+    """The reference spreads out far enough to start even a long, blocked plan"""
+    cx = np.arange(0.0, 50.0, 0.1)
+    cy, cyaw, ck = np.zeros_like(cx), np.zeros_like(cx), np.zeros_like(cx)
+    sp = np.full_like(cx, 3.0)
+    state = mpc.State(x=0.0, y=0.0, yaw=0.0, v=0.0)
+    mpc.set_params(T=10)
+    xref, _, dref = mpc.calc_ref_trajectory(state, cx, cy, cyaw, ck, sp, 0.1, 0)
+
+    assert np.all(np.diff(xref[0]) > 0)
+    t = mpc.DT * np.arange(1, 12)
+    np.testing.assert_allclose(xref[0], mpc.reachable_travel(t, 3.0), atol=0.05)
+    mpc.set_params(MOVE_BLOCKS=(1, 4))
+    oa, *_ = mpc.linear_mpc_control(xref, xref.copy(), [0.0, 0.0, 0.0, 0.0], dref)
+    assert oa[0] > 0.5
+
+
+def test_blocked_plan_holds_the_inputs(mpc):
+    mpc.set_params(MOVE_BLOCKS=(1, 2))
+    T = 5
+    oa, odelta, *_ = mpc.linear_mpc_control(*straight_reference(mpc, T))
+
+    assert len(oa) == len(odelta) == T
+    for first, last in ((1, 3), (3, 5)):  # blocks (1, 2, 2)
+        np.testing.assert_allclose(oa[first:last], oa[first])
+        np.testing.assert_allclose(odelta[first:last], odelta[first])
+
+
+def frenet_step(mpc, z, u, k, dt):
+    """One Euler step of the nonlinear path coordinate model"""
+    e_y, e_psi, v = z
+    a, delta = u
+    return z + dt * np.array([
+        v * np.sin(e_psi),
+        v * np.tan(delta) / mpc.WB - k * v * np.cos(e_psi) / (1.0 - k * e_y),
+        a])
+
+
+@pytest.mark.parametrize("v, k", [(5.0, 0.0), (8.0, 0.05), (3.0, -0.15)])
+def test_frenet_model_matches_finite_differences(mpc, v, k):
+    dt, eps = 0.2, 1e-6
+    z0 = np.array([0.0, 0.0, v])
+    u0 = np.array([0.0, np.arctan(mpc.WB * k)])  # follows the path
+    A, B, C = mpc.get_frenet_model_matrix(v, k, dt)
+
+    jac_z = np.column_stack([(frenet_step(mpc, z0 + e, u0, k, dt)
+                              - frenet_step(mpc, z0 - e, u0, k, dt)) / (2 * eps)
+                             for e in np.eye(mpc.NZ) * eps])
+    jac_u = np.column_stack([(frenet_step(mpc, z0, u0 + e, k, dt)
+                              - frenet_step(mpc, z0, u0 - e, k, dt)) / (2 * eps)
+                             for e in np.eye(mpc.NU) * eps])
+    np.testing.assert_allclose(A, jac_z, atol=1e-6)
+    np.testing.assert_allclose(B, jac_u, atol=1e-6)
+    np.testing.assert_allclose(A @ z0 + B @ u0 + C, frenet_step(mpc, z0, u0, k, dt), atol=1e-9)
+
+
+def test_scaled_models_predict_the_scaled_states(mpc):
+    rng = np.random.default_rng(0)
+    x0 = np.array([120.0, -40.0, 4.0, 0.3])
+    offset, sx, su = mpc.qp_scaling(mpc.NX, x0)
+    models = [mpc.get_linear_model_matrix(4.0, 0.3, 0.05, 0.2)]
+    xref = rng.normal(size=(mpc.NX, 2))
+    (As, Bs, Cs), = mpc._scale_qp(models, xref, x0, offset, sx, su)[0]
+
+    (A, B, C), = models
+    x, u = rng.normal(size=mpc.NX), rng.normal(size=mpc.NU)
+    np.testing.assert_allclose(As @ ((x - offset) / sx) + Bs @ (u / su) + Cs,
+                               (A @ x + B @ u + C - offset) / sx, atol=1e-12)
+
+
+@pytest.mark.parametrize("formulation", ["global", "frenet"])
+def test_scaled_qp_returns_the_unscaled_solution(mpc, formulation):
+    T = 5
+    xref, xbar, x0, dref = straight_reference(mpc, T)
+    xref[0] += 100.0  # far from the origin, like late on a course
+    xbar[0] += 100.0
+    x0[0] += 100.0
+
+    plans = []
+    for scaling in (False, True):
+        mpc.set_params(QP_SCALING=scaling)
+        if formulation == "frenet":
+            z0 = [x0[1], x0[3], x0[2]]
+            plan = mpc.frenet_mpc_control(xref, np.zeros(T + 1), xref[2], z0)
+        else:
+            plan = mpc.linear_mpc_control(xref, xbar, x0, dref)
+        plans.append(np.concatenate(plan))
+
+    np.testing.assert_allclose(plans[1], plans[0], atol=1e-5)
+
+
+def test_new_solver_drops_the_compiled_problems(mpc):
+    problem = mpc.get_problem(5)
+    mpc.set_params(SOLVER=mpc.SOLVER)
+    assert mpc.get_problem(5) is problem
+
+    mpc.set_params(SOLVER="SCS" if mpc.SOLVER != "SCS" else "OSQP")
+    assert mpc.get_problem(5) is not problem
+
+
+def straight_plan(mpc, T, v=5.0):
+    """Plan of a solve on a straight course at v and the reference `age` ticks later"""
+    xref = np.zeros((mpc.NX, T + 1))
+    xref[0] = v * mpc.DT * np.arange(T + 1)
+    xref[2] = v
+    plan = (mpc.horizon_steps(T), xref[0].copy(), xref[1].copy(), xref[2].copy(),
+            xref[3].copy(), xref)
+
+    def later(age):
+        return xref + np.array([[v * mpc.DT * age], [0.0], [0.0], [0.0]])
+    return plan, later
+
+
+def test_plan_is_reused_within_the_tolerances(mpc):
+    plan, later = straight_plan(mpc, 5)
+    x0 = [plan[1][2] + 0.05, 0.05, 5.0, 0.01]
+    xref = later(2) + np.array([[1.0], [0.0], [0.1], [0.0]])
+    assert mpc.plan_still_valid(plan, 2, x0, xref)
+
+
+def test_plan_is_rejected_when_too_old(mpc):
+    mpc.set_params(EVENT_MAX_AGE=2)
+    plan, later = straight_plan(mpc, 5)
+    x0 = [plan[1][3], 0.0, 5.0, 0.0]
+    assert not mpc.plan_still_valid(plan, 3, x0, later(3))
+
+
+@pytest.mark.parametrize("axis, offset", [(0, 0.2), (1, -0.2), (2, 0.2), (3, np.deg2rad(3.0))])
+def test_plan_is_rejected_when_the_state_deviates(mpc, axis, offset):
+    plan, later = straight_plan(mpc, 5)
+    x0 = np.array([plan[1][1], 0.0, 5.0, 0.0])
+    x0[axis] += offset
+    assert not mpc.plan_still_valid(plan, 1, x0, later(1))
+
+
+def test_plan_is_rejected_when_the_reference_changes(mpc):
+    plan, later = straight_plan(mpc, 5)
+    x0 = [plan[1][1], 0.0, 5.0, 0.0]
+    xref = later(1)
+    xref[1, -2] += 2.0  # the course moved within the horizon
+    assert not mpc.plan_still_valid(plan, 1, x0, xref)
+    assert not mpc.plan_still_valid(plan, 1, x0, later(1)[:, :-1])  # other horizon
+
+
+@pytest.mark.parametrize("plant_dt, expected", [(None, (0.2, 1)), (0.05, (0.05, 4)), (0.2, (0.2, 1))])
+def test_plant_steps_divide_the_control_period(mpc, plant_dt, expected):
+    mpc.set_params(DT=0.2, PLANT_DT=plant_dt)
+    step, n = mpc.plant_steps()
+    assert step == pytest.approx(expected[0])
+    assert n == expected[1]
+
+
+@pytest.mark.parametrize("plant_dt", [0.03, 0.3, 0.0, -0.1])
+def test_plant_steps_reject_steps_that_do_not_divide_dt(mpc, plant_dt):
+    mpc.set_params(DT=0.2, PLANT_DT=plant_dt)
+    with pytest.raises(ValueError, match="does not divide"):
+        mpc.plant_steps()
+
+
+@pytest.mark.parametrize("hold, fraction, expected", [
+    ("zoh", 0.0, (0.1, 1.0)), ("zoh", 0.5, (0.1, 1.0)), ("zoh", 1.0, (0.1, 1.0)),
+    ("linear", 0.0, (0.1, 1.0)), ("linear", 0.5, (0.2, 0.0)), ("linear", 1.0, (0.3, -1.0)),
+])
+def test_held_input_between_ticks(mpc, hold, fraction, expected):
+    mpc.set_params(INPUT_HOLD=hold)
+    oa, od = [1.0, -1.0], [0.1, 0.3]
+    assert mpc.held_input(oa, od, 0, fraction) == pytest.approx(expected)
+    assert mpc.held_input(oa, od, 1, fraction) == pytest.approx((0.3, -1.0))  # last input is held
+
+
+@pytest.fixture
+def horizon_params(mpc):
+    """Buckets 3..6, a lookahead of 6 m on a 1 m course tick"""
+    mpc.set_params(DT=0.2, HORIZON_DT=None, HORIZON_BUCKETS=(3, 4, 5, 6),
+                   HORIZON_SPEED=10.0, HORIZON_CURVATURE=0.2, TARGET_SPEED=5.0)
+    return mpc
+
+
+@pytest.mark.parametrize("v, horizon", [(0.0, 3), (3.0, 4), (5.0, 5), (-5.0, 5), (10.0, 6), (20.0, 6)])
+def test_horizon_bucket_by_speed(horizon_params, v, horizon):
+    ck = np.zeros(100)
+    assert horizon_params.choose_horizon(v, ck, 10, 1.0) == horizon
+
+
+@pytest.mark.parametrize("k, ahead, horizon", [(0.05, 3, 4), (-0.1, 5, 5), (0.3, 6, 6), (0.3, 8, 3)])
+def test_horizon_bucket_by_curvature_ahead(horizon_params, k, ahead, horizon):
+    ck = np.zeros(100)
+    ck[10 + ahead] = k
+    assert horizon_params.choose_horizon(0.0, ck, 10, 1.0) == horizon
+
+
+@pytest.mark.parametrize("non_uniform", [False, True])
+def test_horizon_looks_across_the_seam_of_a_loop(horizon_params, non_uniform):
+    ck = np.zeros(100)
+    ck[2] = 0.2
+    cs = np.arange(100.0) if non_uniform else None
+
+    assert horizon_params.choose_horizon(0.0, ck, 97, 1.0, cs, loop=True) == 6
+    assert horizon_params.choose_horizon(0.0, ck, 197, 1.0, cs, loop=True) == 6  # next lap
+    assert horizon_params.choose_horizon(0.0, ck, 97, 1.0, cs) == 3
@@ -0,0 +1,23 @@
+import numpy as np
+from PIL import Image
+
+from utils.render import _write_gif
+
+
+def test_gif_is_written_frame_by_frame(tmp_path):
+    colors = [(1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 1, 0)]
+    for k, color in enumerate(colors):
+        frame = np.ones((40, 60, 4))
+        frame[:, :, :3] = color
+        Image.fromarray((frame * 255).astype(np.uint8)).save(tmp_path / f"frame_{k:06d}.png")
+
+    _write_gif(sorted(tmp_path.glob("frame_*.png")), tmp_path / "run.gif", fps=5)
+
+    with Image.open(tmp_path / "run.gif") as gif:
+        assert gif.n_frames == len(colors)
+        assert gif.info["loop"] == 0
+        assert gif.info["duration"] == 200
+        for k, color in enumerate(colors):
+            gif.seek(k)
+            pixel = np.asarray(gif.convert("RGB"))[20, 30]
+            np.testing.assert_array_equal(pixel, np.array(color) * 255)
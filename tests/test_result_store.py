@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from utils.result_store import ResultStore
+from utils.simulation_result import SimulationResult
+
+
+def store_run(store, n, flush_every=1024, **meta):
+    with store.run(**meta) as run:
+        run.flush_every = flush_every
+        for i in range(n):
+            run.append(t=0.1 * i, x=float(i), e_lat=0.01 * i, status=i % 2)
+    return run.run_id
+
+
+def test_round_trip_through_the_memory_map(tmp_path):
+    store = ResultStore(tmp_path / "store")
+    first = store_run(store, 10, flush_every=3, trajectory="Straight")
+    second = store_run(store, 5, trajectory="Eternity")
+
+    reader = ResultStore(tmp_path / "store")
+    assert [r["run"] for r in reader.runs()] == [first, second]
+    assert isinstance(reader.column("x"), np.memmap)
+    np.testing.assert_array_equal(reader.run_column(first, "x"), np.arange(10))
+    np.testing.assert_array_equal(reader.run_column(second, "step"), np.arange(5))
+    np.testing.assert_array_equal(reader.select("status", trajectory="Straight"),
+                                  np.arange(10) % 2)
+    assert np.all(np.isnan(reader.select("v")))  # not appended
+    assert len(reader.select("x", trajectory="Slalom")) == 0
+
+
+def test_unfinished_run_is_cut_off(tmp_path):
+    store = ResultStore(tmp_path)
+    store_run(store, 4)
+    run = store.run()
+    run.append(x=99.0)
+    run.flush()  # crashed before close
+
+    store_run(store, 2)
+    assert len(store.column("x")) == 6
+    np.testing.assert_array_equal(store.select("x"), [0, 1, 2, 3, 0, 1])
+
+
+def test_run_writer_is_the_on_step_callback(tmp_path):
+    store = ResultStore(tmp_path)
+    result = SimulationResult(4, horizon=2)
+    with store.run() as run:
+        for i in range(3):
+            result.append(0.1 * i, i, 0.0, 0.0, 1.0, 0.0, 0.0,
+                          xref=np.full((4, 3), 7.0))
+            assert run(result) is False
+
+    np.testing.assert_array_equal(store.select("x"), [0, 1, 2])
+    np.testing.assert_array_equal(store.select("x_ref"), [7.0, 7.0, 7.0])
+
+
+def test_other_store_version_is_rejected(tmp_path):
+    ResultStore(tmp_path)
+    (tmp_path / "schema.json").write_text('{"version": 0}')
+    with pytest.raises(ValueError):
+        ResultStore(tmp_path)
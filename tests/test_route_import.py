@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pytest
+
+from utils.route_import import StreamingSimplifier, iter_csv_chunks, iter_geojson_chunks, rdp
+
+
+def distance_to_polyline(points, line):
+    """Distance of every point to the polyline through line"""
+    p0, d = line[:-1], np.diff(line, axis=0)
+    rel = points[:, None, :] - p0
+    w = np.clip(np.sum(rel * d, axis=2) / np.maximum(np.sum(d * d, axis=1), 1e-12), 0.0, 1.0)
+    return np.min(np.hypot(*np.moveaxis(rel - w[..., None] * d, 2, 0)), axis=1)
+
+
+def random_route(n, seed=0):
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0.0, 0.05, n))
+    return np.cumsum(np.column_stack((np.cos(heading), np.sin(heading))), axis=0)
+
+
+def test_rdp_keeps_the_ends_and_the_tolerance():
+    points = random_route(2000)
+    keep = rdp(points, 0.5)
+
+    assert keep[0] and keep[-1]
+    assert keep.sum() < len(points) // 10
+    assert np.max(distance_to_polyline(points, points[keep])) <= 0.5
+
+
+def test_streaming_stays_within_the_tolerance_of_every_raw_point():
+    points = random_route(5000, seed=1)
+    simplifier = StreamingSimplifier(tolerance=0.5, min_spacing=0.0)
+    for chunk in np.array_split(points, 7):
+        simplifier.push(chunk)
+    waypoints = np.array(simplifier.finish())
+
+    assert simplifier.n_points == len(points)
+    np.testing.assert_array_equal(waypoints[0], points[0])
+    np.testing.assert_array_equal(waypoints[-1], points[-1])
+    assert np.max(distance_to_polyline(points, waypoints)) <= 0.5
+
+
+def test_streaming_with_a_small_pending_buffer():
+    points = random_route(3000, seed=2)
+    simplifier = StreamingSimplifier(tolerance=0.2, min_spacing=0.0, max_pending=300)
+    for chunk in np.array_split(points, 30):
+        simplifier.push(chunk)
+    waypoints = np.array(simplifier.finish())
+
+    assert np.max(distance_to_polyline(points, waypoints)) <= 0.2
+
+
+def test_single_chunk_matches_rdp():
+    points = random_route(2000, seed=3)
+    simplifier = StreamingSimplifier(tolerance=0.3, min_spacing=0.0)
+    simplifier.push(points)
+
+    np.testing.assert_array_equal(simplifier.finish(), points[rdp(points, 0.3)])
+
+
+def test_flushing_the_pending_buffer_stays_close_to_rdp():
+    points = random_route(3000, seed=4)
+    simplifier = StreamingSimplifier(tolerance=0.3, min_spacing=0.0, max_pending=200)
+    for chunk in np.array_split(points, 60):
+        simplifier.push(chunk)
+    waypoints = np.array(simplifier.finish())
+
+    single_pass = rdp(points, 0.3).sum()
+    assert single_pass <= len(waypoints) <= 1.5 * single_pass
+    np.testing.assert_array_equal(waypoints[[0, -1]], points[[0, -1]])
+    assert np.max(distance_to_polyline(points, waypoints)) <= 0.3
+
+
+@pytest.mark.parametrize("header", [None, "x,y,speed"])
+def test_csv_chunks_detect_the_header(tmp_path, header):
+    points = random_route(25, seed=5)
+    path = tmp_path / "route.csv"
+    lines = [f"{x!r},{y!r},1.0" for x, y in points.tolist()]
+    path.write_text("\n".join(([header] if header else []) + lines) + "\n")
+
+    chunks = list(iter_csv_chunks(path, chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    np.testing.assert_array_equal(np.vstack(chunks), points)
+    if header:
+        by_name = np.vstack(list(iter_csv_chunks(path, x_col="y", y_col="x")))
+        np.testing.assert_array_equal(by_name, points[:, ::-1])
+    else:
+        with pytest.raises(ValueError):
+            next(iter_csv_chunks(path, x_col="x"))
+
+
+def test_geojson_positions_split_across_blocks(tmp_path):
+    points = random_route(40, seed=6)
+    features = [
+        {"type": "Feature", "properties": {"name": "coordinates"},
+         "geometry": {"type": "LineString", "coordinates": part.tolist()}}
+        for part in (points[:25], points[25:])
+    ]
+    path = tmp_path / "route.geojson"
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+
+    for block_size in (7, 16, 1 << 22):  # splits keys and numbers at every offset
+        chunks = list(iter_geojson_chunks(path, chunk_size=10, block_size=block_size))
+        assert all(len(chunk) >= 10 for chunk in chunks[:-1])
+        np.testing.assert_array_equal(np.vstack(chunks), points)
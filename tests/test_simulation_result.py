@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from utils.simulation_result import SimulationResult
+
+
+def record(result, steps, horizon=3):
+    for i in range(steps):
+        ox = np.arange(horizon + 1) + i
+        result.append(0.1 * i, i, 2.0 * i, 0.0, 1.0, 0.01 * i, 0.5, ox=ox, oy=-ox,
+                      e_lat=0.2, solve_time=1e-3, target=i)
+
+
+def test_ring_keeps_the_last_steps_in_order():
+    result = SimulationResult(5, horizon=3, ring=True)
+    record(result, 12)
+
+    assert len(result) == 5
+    assert result.n_steps == 12
+    np.testing.assert_array_equal(result.x, np.arange(7, 12))
+    np.testing.assert_array_equal(result.ox[:, 0], np.arange(7, 12))
+    assert result.step(0)["x"] == 7
+    assert result.step(-1)["x"] == 11
+    assert result.latest()["target"] == 11
+    with pytest.raises(IndexError):
+        result.step(5)
+
+
+def test_growing_keeps_the_fill_values():
+    result = SimulationResult(2, horizon=3)
+    record(result, 3)
+
+    assert result.capacity == 4
+    np.testing.assert_array_equal(result.target, [0, 1, 2])
+    assert result._data["target"][3] == -1  # unrecorded
+    assert np.all(np.isnan(result._data["ox"][3]))
+
+
+def test_save_load_round_trip(tmp_path):
+    result = SimulationResult(4, horizon=3)
+    record(result, 6)
+    result.termination = SimulationResult.END_GOAL
+    path = tmp_path / "run.npz"
+    result.save(path, cx=[0.0, 1.0], cy=[0.0, 0.0], trajectory="Straight")
+
+    loaded = SimulationResult.load(path)
+    assert len(loaded) == 6
+    assert loaded.horizon == 3
+    for field in SimulationResult.STEP_FIELDS + SimulationResult.HORIZON_FIELDS:
+        np.testing.assert_array_equal(loaded[field], result[field])
+    np.testing.assert_array_equal(loaded.course[0], [0.0, 1.0])
+    assert loaded.meta == {"trajectory": "Straight"}
+    assert loaded.termination == SimulationResult.END_GOAL
+
+
+def test_unpacks_like_the_state_tuple():
+    result = SimulationResult(4, horizon=3)
+    record(result, 2)
+    t, x, y, yaw, v, d, a = result
+    np.testing.assert_array_equal(y, [0.0, 2.0])
+
+
+def test_summary_uses_the_recorded_lateral_errors():
+    result = SimulationResult(4, horizon=3)
+    result.append(0.0, 0.0, 5.0, 0.0, 0.0, 0.0, 0.0)  # initial state, no error
+    result.append(0.1, 1.0, 5.0, 0.0, 1.0, 0.0, 0.0, e_lat=0.3)
+    result.append(0.2, 2.0, 5.0, 0.0, 1.0, 0.0, 0.0, e_lat=-0.4)
+
+    summary = result.summary()
+    assert summary["rms_lateral_error"] == pytest.approx(np.sqrt(0.125))
+    assert summary["max_lateral_error"] == pytest.approx(0.4)
+
+
+def test_lateral_errors_without_recorded_ones_stay_within_the_element_budget():
+    result = SimulationResult(4, horizon=3)
+    for x in (0.5, 1.5, 2.5):
+        result.append(0.0, x, 1.0, 0.0, 0.0, 0.0, 0.0)
+    cx = np.linspace(0.0, 3.0, 31)
+    cy = np.zeros_like(cx)
+
+    np.testing.assert_allclose(result.lateral_errors(cx, cy, max_elements=10), 1.0)
+    assert result.summary(cx, cy)["rms_lateral_error"] == pytest.approx(1.0)
+
+
+def test_longer_horizons_widen_the_arrays():
+    result = SimulationResult(4, horizon=3, ring=True)
+    record(result, 2)
+    record(result, 4, horizon=6)
+    record(result, 1, horizon=2)
+
+    assert result.horizon == 6
+    assert result.ox.shape == (4, 7)
+    assert result.xref.shape == (4, 4, 7)
+    np.testing.assert_array_equal(result.ox[0], np.arange(7) + 1)
+    np.testing.assert_array_equal(result.ox[-1, :3], np.arange(3))
+    assert np.all(np.isnan(result.ox[-1, 3:]))
@@ -0,0 +1,70 @@
+import math
+
+import matplotlib
+import numpy as np
+import pytest
+
+from utils.vehicle_draw import car_outlines, draw_vehicles, vehicle_template
+
+matplotlib.use("Agg")
+
+GEOMETRY = dict(LENGTH=4.5, WIDTH=2.0, BACKTOWHEEL=1.0, WHEEL_LEN=0.3,
+                WHEEL_WIDTH=0.2, TREAD=0.7, WB=2.5)
+POSES = [(0.0, 0.0, 0.0, 0.0), (3.0, -2.0, 0.7, 0.3), (-1.5, 4.0, -2.9, -0.6), (10.0, 1.0, math.pi, 0.78)]
+
+
+def plot_car_outlines(x, y, yaw, steer, LENGTH, WIDTH, BACKTOWHEEL, WHEEL_LEN, WHEEL_WIDTH, TREAD, WB):
+    """Outlines of the original plot_car, body, fr, rr, fl, rl wheel as (2, 5) arrays"""
+    outline = np.array([[-BACKTOWHEEL, (LENGTH - BACKTOWHEEL), (LENGTH - BACKTOWHEEL), -BACKTOWHEEL, -BACKTOWHEEL],
+                        [WIDTH / 2, WIDTH / 2, - WIDTH / 2, -WIDTH / 2, WIDTH / 2]])
+    fr_wheel = np.array([[WHEEL_LEN, -WHEEL_LEN, -WHEEL_LEN, WHEEL_LEN, WHEEL_LEN],
+                         [-WHEEL_WIDTH - TREAD, -WHEEL_WIDTH - TREAD, WHEEL_WIDTH - TREAD, WHEEL_WIDTH - TREAD, -WHEEL_WIDTH - TREAD]])
+    rr_wheel = np.copy(fr_wheel)
+    fl_wheel = np.copy(fr_wheel)
+    fl_wheel[1, :] *= -1
+    rl_wheel = np.copy(rr_wheel)
+    rl_wheel[1, :] *= -1
+
+    Rot1 = np.array([[math.cos(yaw), math.sin(yaw)],
+                     [-math.sin(yaw), math.cos(yaw)]])
+    Rot2 = np.array([[math.cos(steer), math.sin(steer)],
+                     [-math.sin(steer), math.cos(steer)]])
+
+    fr_wheel = (fr_wheel.T.dot(Rot2)).T
+    fl_wheel = (fl_wheel.T.dot(Rot2)).T
+    fr_wheel[0, :] += WB
+    fl_wheel[0, :] += WB
+    parts = [(part.T.dot(Rot1)).T for part in (outline, fr_wheel, rr_wheel, fl_wheel, rl_wheel)]
+    return [part + [[x], [y]] for part in parts]
+
+
+@pytest.mark.parametrize("pose", POSES)
+def test_outlines_match_plot_car(pose):
+    expected = plot_car_outlines(*pose, **GEOMETRY)
+    for outline, reference in zip(car_outlines(*pose, GEOMETRY), expected, strict=True):
+        np.testing.assert_allclose(outline, reference, atol=1e-12)
+
+
+def test_vectorized_poses_match_one_by_one():
+    x, y, yaw, steer = np.array(POSES).T
+    outlines = vehicle_template(GEOMETRY).transform(x, y, yaw, steer)
+
+    assert outlines.shape == (len(POSES), 5, 5, 2)
+    for outline, pose in zip(outlines, POSES):
+        np.testing.assert_allclose(outline, np.transpose(plot_car_outlines(*pose, **GEOMETRY), (0, 2, 1)),
+                                   atol=1e-12)
+
+
+def test_draw_vehicles_is_one_collection_of_the_outlines():
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    x, y, yaw, steer = np.array(POSES).T
+    collection = draw_vehicles(ax, x, y, yaw, steer, GEOMETRY)
+
+    assert list(ax.collections) == [collection]
+    segments = np.array(collection.get_segments())
+    expected = np.concatenate([np.transpose(plot_car_outlines(*pose, **GEOMETRY), (0, 2, 1))
+                               for pose in POSES])
+    np.testing.assert_allclose(segments, expected, atol=1e-12)
+    plt.close(fig)
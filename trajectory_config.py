@@ -94,5 +94,10 @@ TRAJECTORIES = {
     # Students can add more here
 }
 
+def register_trajectory(name, waypoints):
+    """Add a list of (x, y) waypoints as a trajectory, e.g. an imported route"""
+    waypoints = list(waypoints)
+    TRAJECTORIES[name] = lambda: waypoints
+
 # The default trajectory to use
 DEFAULT_TRAJECTORY = "Eternity"
\ No newline at end of file
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as Rot
 
 
 def rot_mat_2d(angle):
@@ -20,6 +19,9 @@ def rot_mat_2d(angle):
 
 
     """
+    # scipy.spatial is slow to import and only needed here
+    from scipy.spatial.transform import Rotation as Rot
+
     return Rot.from_euler('z', angle).as_matrix()[0:2, 0:2]
 
 
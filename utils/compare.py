@@ -0,0 +1,146 @@
+"""
+Concurrent comparison runs of parameter presets
+
+Every preset (a dict of `mpc.set_params` parameters) drives the same
+compiled course in its own worker process, at most one per CPU so the
+solve times are not inflated by the other runs. The steps stream back
+through a queue while the runs are going:
+
+    ("step", index, t, x, y, v, d, e_lat, solve_time)
+    ("done", index, elapsed_time)
+    ("error", index, message)
+
+Usage:
+    comparison = Comparison(course, [{"T": 5}, {"T": 10}])
+    comparison.start()
+    while comparison.is_alive():
+        for message in comparison.poll():
+            ...
+"""
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+
+def _run_preset(index, params, course, messages, cancel):
+    """Simulate one preset, runs in a worker process"""
+    import mpc
+
+    def on_step(result):
+        step = result.latest()
+        messages.put(("step", index, float(step["t"]), float(step["x"]),
+                      float(step["y"]), float(step["v"]), float(step["d"]),
+                      float(step["e_lat"]), float(step["solve_time"])))
+        return cancel.is_set()
+
+    start_time = time.time()
+    try:
+        mpc.set_params(**params)
+        initial_state = mpc.State(x=course.cx[0], y=course.cy[0],
+                                  yaw=course.cyaw[0], v=0.0)
+        mpc.do_simulation(course.cx, course.cy, course.cyaw, course.ck,
+                          course.sp, course.dl, initial_state, course.cs,
+                          loop=course.loop, on_step=on_step, animate=False)
+    except Exception as e:
+        messages.put(("error", index, str(e)))
+        return
+    messages.put(("done", index, time.time() - start_time))
+
+
+def comparison_metrics(e_lat, solve_time, dt):
+    """
+    Metrics of a (possibly unfinished) run
+
+    Parameters
+    ----------
+    e_lat, solve_time : array_like
+        per-step lateral error [m] and solve time [s], NaN for steps
+        without a solve (the initial state).
+    dt : float
+        control period [s], solves taking longer miss their deadline.
+
+    Returns
+    -------
+    metrics : dict
+        rms_lateral_error [m], mean_solve_time [s] and deadline_misses.
+    """
+    e_lat = np.asarray(e_lat, dtype=float)
+    e_lat = e_lat[np.isfinite(e_lat)]
+    solve_time = np.asarray(solve_time, dtype=float)
+    solve_time = solve_time[np.isfinite(solve_time)]
+    return {
+        "rms_lateral_error": float(np.sqrt(np.mean(e_lat ** 2))) if len(e_lat) else np.nan,
+        "mean_solve_time": float(np.mean(solve_time)) if len(solve_time) else np.nan,
+        "deadline_misses": int(np.sum(solve_time > dt)),
+    }
+
+
+class Comparison:
+    """
+    Runs parameter presets on one course in parallel worker processes
+
+    Parameters
+    ----------
+    course : course_registry.Course
+        compiled course every preset drives.
+    presets : list of dict
+        `mpc.set_params` parameters of each run, on top of the mpc defaults.
+    workers : int, optional
+        maximum number of concurrent runs, by default the number of CPUs.
+    """
+
+    def __init__(self, course, presets, workers=None):
+        # spawn, so the workers do not inherit GUI or pyplot state
+        context = multiprocessing.get_context("spawn")
+        self.presets = list(presets)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue = context.Queue()
+        self._cancel = context.Event()
+        self._pending = [
+            (i, context.Process(target=_run_preset,
+                                args=(i, params, course, self.queue, self._cancel),
+                                name=f"mpc-compare-{i}", daemon=True))
+            for i, params in reversed(list(enumerate(self.presets)))]
+        self._running = {}
+
+    def start(self):
+        while self._pending and len(self._running) < self.workers:
+            index, process = self._pending.pop()
+            process.start()
+            self._running[index] = process
+
+    def cancel(self):
+        """Stop the running runs after their current step, skip the others"""
+        self._cancel.set()
+        self._pending = []
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def is_alive(self):
+        return bool(self._pending or self._running)
+
+    def poll(self):
+        """Messages received so far, starts the next runs as others finish"""
+        messages = []
+        try:
+            while True:
+                message = self.queue.get_nowait()
+                messages.append(message)
+                if message[0] in ("done", "error"):
+                    self._running.pop(message[1]).join()
+        except queue.Empty:
+            pass
+
+        for index, process in list(self._running.items()):
+            if not process.is_alive() and process.exitcode != 0:
+                # killed without reporting back, e.g. out of memory
+                del self._running[index]
+                messages.append(("error", index,
+                                 f"worker exited with code {process.exitcode}"))
+        self.start()
+        return messages
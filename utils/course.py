@@ -0,0 +1,60 @@
+"""
+Course helpers shared by the controller and the course registry
+"""
+import math
+
+from utils.angle import angle_mod
+
+
+def calc_speed_profile(cx, cy, cyaw, target_speed, loop=False):
+    """
+    Speed profile of the course, negative where the course goes backward
+
+    The vehicle stops at the last point, unless the course is a closed
+    `loop` that is driven continuously.
+    """
+
+    speed_profile = [target_speed] * len(cx)
+    direction = 1.0  # forward
+
+    # Set stop point
+    for i in range(len(cx) - 1):
+        dx = cx[i + 1] - cx[i]
+        dy = cy[i + 1] - cy[i]
+
+        move_direction = math.atan2(dy, dx)
+
+        if dx != 0.0 and dy != 0.0:
+            dangle = abs(angle_mod(move_direction - cyaw[i]))
+            if dangle >= math.pi / 4.0:
+                direction = -1.0
+            else:
+                direction = 1.0
+
+        if direction != 1.0:
+            speed_profile[i] = - target_speed
+        else:
+            speed_profile[i] = target_speed
+
+    if loop:
+        speed_profile[-1] = speed_profile[-2]
+    else:
+        speed_profile[-1] = 0.0
+
+    return speed_profile
+
+
+def smooth_yaw(yaw):
+
+    for i in range(len(yaw) - 1):
+        dyaw = yaw[i + 1] - yaw[i]
+
+        while dyaw >= math.pi / 2.0:
+            yaw[i + 1] -= math.pi * 2.0
+            dyaw = yaw[i + 1] - yaw[i]
+
+        while dyaw <= -math.pi / 2.0:
+            yaw[i + 1] += math.pi * 2.0
+            dyaw = yaw[i + 1] - yaw[i]
+
+    return yaw
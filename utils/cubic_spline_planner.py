@@ -21,6 +21,9 @@ class CubicSpline1D:
         in ascending order.
     y : list
         y coordinates for data points
+    periodic : bool
+        if True, the spline is periodic: y[-1] must equal y[0] and the
+        first and second derivatives match at both ends.
 
     Examples
     --------
@@ -43,11 +46,13 @@ class CubicSpline1D:
 
     """
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, periodic=False):
 
         h = np.diff(x)
         if np.any(h < 0):
             raise ValueError("x coordinates must be sorted in ascending order")
+        if periodic and len(x) < 4:
+            raise ValueError("a periodic spline needs at least 3 distinct points")
 
         self.a, self.b, self.c, self.d = [], [], [], []
         self.x = x
@@ -58,9 +63,14 @@ class CubicSpline1D:
         self.a = [iy for iy in y]
 
         # calc coefficient c
-        A = self.__calc_A(h)
-        B = self.__calc_B(h, self.a)
-        self.c = np.linalg.solve(A, B)
+        if periodic:
+            self.c = self.__calc_periodic_c(h, self.a)
+        else:
+            # scipy is slow to import and only needed to build a spline
+            from scipy.linalg import solve_banded
+            A = self.__calc_A(h)
+            B = self.__calc_B(h, self.a)
+            self.c = solve_banded((1, 1), A, B)
 
         # calc spline coefficient b and d
         for i in range(self.nx - 1):
@@ -181,23 +191,28 @@ class CubicSpline1D:
         """
         search data segment index
         """
-        return bisect.bisect(self.x, x) - 1
+        # the last data point belongs to the last segment
+        return min(bisect.bisect(self.x, x) - 1, self.nx - 2)
 
     def __calc_A(self, h):
         """
         calc matrix A for spline coefficient c
+
+        A is tridiagonal, so only its three diagonals are stored in the
+        banded form of `scipy.linalg.solve_banded`. This keeps splines
+        through many thousands of waypoints cheap.
         """
-        A = np.zeros((self.nx, self.nx))
-        A[0, 0] = 1.0
+        A = np.zeros((3, self.nx))
+        A[1, 0] = 1.0
         for i in range(self.nx - 1):
             if i != (self.nx - 2):
-                A[i + 1, i + 1] = 2.0 * (h[i] + h[i + 1])
-            A[i + 1, i] = h[i]
-            A[i, i + 1] = h[i]
+                A[1, i + 1] = 2.0 * (h[i] + h[i + 1])
+            A[2, i] = h[i]  # A[i + 1, i]
+            A[0, i + 1] = h[i]  # A[i, i + 1]
 
         A[0, 1] = 0.0
-        A[self.nx - 1, self.nx - 2] = 0.0
-        A[self.nx - 1, self.nx - 1] = 1.0
+        A[2, self.nx - 2] = 0.0
+        A[1, self.nx - 1] = 1.0
         return A
 
     def __calc_B(self, h, a):
@@ -210,6 +225,41 @@ class CubicSpline1D:
                 - 3.0 * (a[i + 1] - a[i]) / h[i]
         return B
 
+    def __calc_periodic_c(self, h, a):
+        """
+        calc spline coefficient c for periodic end conditions
+
+        The system is tridiagonal plus the two corners coupling the first
+        and the last point, it is solved with the Sherman-Morrison formula.
+        """
+        m = self.nx - 1  # c[m] == c[0]
+        hp = np.roll(h, 1)  # h[i - 1]
+        ap = np.roll(np.asarray(a[:m], dtype=float), 1)  # a[i - 1]
+        a = np.asarray(a, dtype=float)
+
+        A = np.zeros((3, m))
+        A[0, 1:] = h[:m - 1]  # A[i, i + 1]
+        A[1, :] = 2.0 * (hp + h)
+        A[2, :-1] = hp[1:]  # A[i + 1, i]
+        B = 3.0 * (a[1:] - a[:m]) / h - 3.0 * (a[:m] - ap) / hp
+
+        corner = h[m - 1]  # A[0, m - 1] and A[m - 1, 0]
+        gamma = -A[1, 0]
+        A[1, 0] -= gamma
+        A[1, m - 1] -= corner * corner / gamma
+        u = np.zeros(m)
+        u[0] = gamma
+        u[m - 1] = corner
+
+        from scipy.linalg import solve_banded
+        y = solve_banded((1, 1), A, B)
+        z = solve_banded((1, 1), A, u)
+        fact = (y[0] + corner * y[m - 1] / gamma) \
+            / (1.0 + z[0] + corner * z[m - 1] / gamma)
+        c = y - fact * z
+
+        return np.append(c, c[0])
+
 
 class CubicSpline2D:
     """
@@ -221,6 +271,9 @@ class CubicSpline2D:
         x coordinates for data points.
     y : list
         y coordinates for data points.
+    closed : bool
+        if True, the path is a closed loop with a smooth seam. The first
+        point is appended at the end if the path is not closed yet.
 
     Examples
     --------
@@ -270,10 +323,17 @@ class CubicSpline2D:
     .. image:: cubic_spline_2d_curvature.png
     """
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, closed=False):
+        x, y = list(x), list(y)
+        if closed and math.hypot(x[-1] - x[0], y[-1] - y[0]) > 1e-9:
+            x.append(x[0])
+            y.append(y[0])
+        elif closed:
+            x[-1], y[-1] = x[0], y[0]
+        self.closed = closed
         self.s = self.__calc_s(x, y)
-        self.sx = CubicSpline1D(self.s, x)
-        self.sy = CubicSpline1D(self.s, y)
+        self.sx = CubicSpline1D(self.s, x, periodic=closed)
+        self.sy = CubicSpline1D(self.s, y, periodic=closed)
 
     def __calc_s(self, x, y):
         dx = np.diff(x)
@@ -375,8 +435,8 @@ class CubicSpline2D:
         return yaw
 
 
-def calc_spline_course(x, y, ds=0.1):
-    sp = CubicSpline2D(x, y)
+def calc_spline_course(x, y, ds=0.1, closed=False):
+    sp = CubicSpline2D(x, y, closed=closed)
     s = list(np.arange(0, sp.s[-1], ds))
 
     rx, ry, ryaw, rk = [], [], [], []
@@ -390,6 +450,126 @@ def calc_spline_course(x, y, ds=0.1):
     return rx, ry, ryaw, rk, s
 
 
+def calc_adaptive_spline_course(x, y, max_error=0.05, ds_min=0.1, ds_max=5.0,
+                                closed=False):
+    """
+    Calc a spline course with curvature adaptive sampling.
+
+    Samples are placed densely where the curvature or the curvature rate is
+    high and sparsely on straight parts. The chord between two consecutive
+    samples deviates from the spline by about k * ds^2 / 8, so every step is
+    sized to keep that deviation below `max_error` for the largest curvature
+    expected over the step.
+
+    Parameters
+    ----------
+    x : list
+        x coordinates for data points.
+    y : list
+        y coordinates for data points.
+    max_error : float
+        maximum lateral error [m] between the sampled polyline and the spline.
+    ds_min : float
+        minimum distance between samples [m].
+    ds_max : float
+        maximum distance between samples [m].
+    closed : bool
+        sample a closed loop, see `CubicSpline2D`.
+
+    Returns
+    -------
+    rx, ry, ryaw, rk, s : list
+        same as `calc_spline_course`, but `s` is not uniformly spaced and
+        the course end point is included (except for closed loops, where it
+        equals the start point).
+    """
+    sp = CubicSpline2D(x, y, closed=closed)
+    s_end = sp.s[-1]
+
+    s = [0.0]
+    while True:
+        k = abs(sp.calc_curvature(s[-1]))
+        dk = abs(sp.calc_curvature_rate(s[-1]))
+
+        ds = ds_max
+        for _ in range(2):  # refine the curvature bound with the new step
+            k_max = k + dk * ds
+            if k_max > 0.0:
+                ds = min(ds_max, math.sqrt(8.0 * max_error / k_max))
+        ds = max(ds, ds_min)
+
+        if s[-1] + ds >= s_end:
+            break
+        s.append(s[-1] + ds)
+    if not closed:
+        s.append(s_end)
+
+    rx, ry, ryaw, rk = [], [], [], []
+    for i_s in s:
+        ix, iy = sp.calc_position(i_s)
+        rx.append(ix)
+        ry.append(iy)
+        ryaw.append(sp.calc_yaw(i_s))
+        rk.append(sp.calc_curvature(i_s))
+
+    return rx, ry, ryaw, rk, s
+
+
+class IncrementalSplineCourse:
+    """
+    Sampled spline through waypoints that are appended one at a time
+
+    Appending a waypoint refits only the last `window` waypoints and
+    resamples the last `refit` segments, the earlier segments are kept.
+    The natural cubic spline is global, but the influence of a new point
+    decays by about a factor of 4 per waypoint, so the kept segments
+    hardly differ from a full fit. Meant for interactive previews, the
+    final course is splined with `calc_spline_course`.
+
+    Parameters
+    ----------
+    ds : float
+        distance of the samples [m].
+    window : int
+        number of waypoints refitted on every append.
+    refit : int
+        number of segments resampled on every append.
+    """
+
+    def __init__(self, ds=1.0, window=10, refit=4):
+        self.ds = ds
+        self.window = window
+        self.refit = refit
+        self.x, self.y = [], []
+        # (n, 2) samples of segment i, from waypoint i up to waypoint i + 1
+        self.segments = []
+
+    def append(self, x, y):
+        """Add a waypoint, returns the index of the first resampled segment"""
+        if self.x and math.hypot(x - self.x[-1], y - self.y[-1]) < 1e-9:
+            return len(self.segments)  # a repeated point adds no segment
+        self.x.append(x)
+        self.y.append(y)
+        n = len(self.x)
+        if n < 2:
+            return 0
+
+        first = max(0, n - 1 - self.refit)
+        start = min(max(0, n - self.window), first)
+        sp = CubicSpline2D(self.x[start:], self.y[start:])
+        del self.segments[first:]
+        for i in range(first - start, n - 1 - start):
+            s = np.arange(sp.s[i], sp.s[i + 1], self.ds)
+            self.segments.append(np.array([sp.calc_position(i_s) for i_s in s]))
+        return first
+
+    def points(self, first=0):
+        """Samples from segment `first` on, up to the last waypoint, as (n, 2)"""
+        if not self.x:
+            return np.empty((0, 2))
+        return np.vstack(self.segments[first:] + [[(self.x[-1], self.y[-1])]])
+
+
 def main_1d():
     print("CubicSpline1D test")
     import matplotlib.pyplot as plt
@@ -0,0 +1,175 @@
+"""
+Live animation of a running simulation
+
+The artists are created once and only their data is updated. Frames are
+drawn with blitting: the static background (course, grid, axes) is saved
+once and restored for every frame, then only the moving artists are
+drawn. Frames are limited to `fps`, independent of the control rate, so
+the simulation runs at full speed in between.
+"""
+from time import perf_counter
+
+import numpy as np
+
+from utils.lod import plot_lod
+from utils.vehicle_draw import draw_vehicles, vehicle_segments
+
+
+class LiveView:
+    """
+    Blitted live view of a simulation
+
+    Parameters
+    ----------
+    cx, cy : array_like
+        course points, drawn once into the background.
+    geometry : dict
+        vehicle dimensions, see `mpc.vehicle_geometry()`.
+    fps : float
+        maximum frame rate [1/s].
+    ax : matplotlib.axes.Axes, optional
+        axes to draw into, by default the current pyplot axes, which are
+        shown in a window. The axes are cleared.
+    """
+
+    def __init__(self, cx, cy, geometry, fps=30.0, ax=None):
+        self.cx = np.asarray(cx, dtype=float)
+        self.cy = np.asarray(cy, dtype=float)
+        self.geometry = geometry
+        self.frame_time = 1.0 / fps if fps > 0 else 0.0
+        self.stopped = False
+        self._last_frame = -np.inf
+        self._background = None
+
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
+        self.ax = ax
+        self.ax.cla()
+        self.fig = self.ax.figure
+        self.canvas = self.fig.canvas
+
+        plot_lod(ax, self.cx, self.cy, "-r", label="course")
+        ax.grid(True)
+        ax.set_aspect("equal", adjustable="box")
+        margin = 2.0 * geometry["LENGTH"]
+        self._set_limits(self.cx.min() - margin, self.cx.max() + margin,
+                         self.cy.min() - margin, self.cy.max() + margin)
+
+        def line(fmt, **kwargs):
+            artist, = ax.plot([], [], fmt, animated=True, **kwargs)
+            return artist
+
+        self.mpc_line = line("xr", label="MPC")
+        self.trajectory_line = line("ob", label="trajectory")
+        self.xref_line = line("xk", label="xref")
+        self.target_line = line("xg", label="target")
+        self.car = draw_vehicles(ax, [], [], [], [], geometry, animated=True)
+        self.car_center = line("*")
+        self.title = ax.text(0.02, 0.98, "", transform=ax.transAxes,
+                             va="top", animated=True)
+        self._artists = [self.trajectory_line, self.mpc_line,
+                         self.xref_line, self.target_line, self.car,
+                         self.car_center, self.title]
+
+        # connected once, until close()
+        self._cids = [self.canvas.mpl_connect("draw_event", self._on_draw),
+                      self.canvas.mpl_connect("key_release_event", self._on_key)]
+
+        # a pyplot window needs its events processed after each frame,
+        # embedded canvases (e.g. in the GUI) are run by their own loop
+        self._own_window = self.canvas.manager is not None
+        if self._own_window:
+            import matplotlib.pyplot as plt
+            plt.pause(0.001)  # show the window and draw the background
+        else:
+            self.canvas.draw()
+
+    def _set_limits(self, x0, x1, y0, y1):
+        self.ax.set_xlim(x0, x1)
+        self.ax.set_ylim(y0, y1)
+
+    def _on_key(self, event):
+        # for stopping simulation with the esc key.
+        if event.key == "escape":
+            self.stopped = True
+
+    def _on_draw(self, event):
+        """Save the new background after full redraws (e.g. a resize)"""
+        if getattr(self.canvas, "supports_blit", False):
+            self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self._artists:
+            self.ax.draw_artist(artist)
+
+    def update(self, result, force=False):
+        """
+        Draw the latest step of a SimulationResult, at most at `fps`
+
+        Returns True once the view was stopped with the escape key.
+        """
+        return self.show(result.latest(), result.x, result.y, force)
+
+    def show(self, step, trajectory_x, trajectory_y, force=False):
+        """Draw a step (see set_step), at most at `fps`"""
+        now = perf_counter()
+        if not force and now - self._last_frame < self.frame_time:
+            return self.stopped
+        self._last_frame = now
+
+        self.set_step(step, trajectory_x, trajectory_y)
+        x, y = float(step["x"]), float(step["y"])
+        if self._background is None or self.include(x, y):
+            self.canvas.draw()  # full redraw, saves a new background
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_artists()
+            self.canvas.blit(self.fig.bbox)
+        if self._own_window:
+            self.canvas.flush_events()
+        return self.stopped
+
+    def close(self):
+        """Disconnect from the canvas, the last frame stays as normal artists"""
+        for cid in self._cids:
+            self.canvas.mpl_disconnect(cid)
+        self._cids = []
+        for artist in self._artists:
+            artist.set_animated(False)
+        self.canvas.draw_idle()
+
+    def set_step(self, step, trajectory_x, trajectory_y):
+        """
+        Update the artists to a step without drawing
+
+        step is a dict like `SimulationResult.latest()`, trajectory_x and
+        trajectory_y are the positions driven so far.
+        """
+        x, y = float(step["x"]), float(step["y"])
+        self.mpc_line.set_data(step["ox"], step["oy"])
+        self.xref_line.set_data(step["xref"][0, :], step["xref"][1, :])
+        self.trajectory_line.set_data(trajectory_x, trajectory_y)
+        target = int(step["target"])
+        if target >= 0:
+            self.target_line.set_data([self.cx[target]], [self.cy[target]])
+        else:
+            self.target_line.set_data([], [])
+        self.car.set_segments(vehicle_segments(
+            x, y, float(step["yaw"]), float(step["d"]), self.geometry))
+        self.car_center.set_data([x], [y])
+        self.title.set_text("Time[s]:" + str(round(float(step["t"]), 2))
+                            + ", speed[km/h]:" + str(round(float(step["v"]) * 3.6, 2)))
+
+    def include(self, x, y):
+        """Grow the limits to include the points, True if they changed"""
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        if x0 <= x.min() and x.max() <= x1 and y0 <= y.min() and y.max() <= y1:
+            return False
+        margin = 2.0 * self.geometry["LENGTH"]
+        self._set_limits(min(x0, x.min() - margin), max(x1, x.max() + margin),
+                         min(y0, y.min() - margin), max(y1, y.max() + margin))
+        return True
@@ -0,0 +1,193 @@
+"""
+Level-of-detail lines for long courses and traces
+
+A LODLine keeps all its points but only draws the ones that are visible
+at the current zoom and figure size, picked again on every draw where the
+view changed (zoom, pan, resize):
+
+- "path" (a polyline like cx, cy): of every run of consecutive points in
+  the same pixel only the first and the last are kept.
+- "series" (x increasing, like a speed or curvature trace): the first,
+  last, minimum and maximum of every pixel column are kept.
+- "spokes" (separate segments, as base, tip, NaN triples): the visible
+  spokes are kept, at least SPOKE_SPACING pixels apart along their bases.
+
+Segments outside the view are dropped, the line is interrupted there.
+The drawn line matches the full one to a pixel, also for markers.
+
+Usage:
+    line = plot_lod(ax, cx, cy, "-r", label="course")
+    line.set_data(new_cx, new_cy)  # all points, decimated when drawn
+"""
+import numpy as np
+from matplotlib.lines import Line2D
+
+LOD_MIN_POINTS = 2000  # shorter lines are drawn as they are
+SPOKE_SPACING = 3  # [px] distance of the drawn spokes along their bases
+
+
+def _visible_segments(px, py, bbox):
+    """Segments (i, i + 1) whose bounding box intersects bbox, in pixels"""
+    x0, y0, x1, y1 = bbox.x0 - 1, bbox.y0 - 1, bbox.x1 + 1, bbox.y1 + 1
+    with np.errstate(invalid="ignore"):
+        return ((np.minimum(px[:-1], px[1:]) <= x1)
+                & (np.maximum(px[:-1], px[1:]) >= x0)
+                & (np.minimum(py[:-1], py[1:]) <= y1)
+                & (np.maximum(py[:-1], py[1:]) >= y0))
+
+
+def _path_keep(px, py):
+    """First and last point of every run of points in the same pixel"""
+    with np.errstate(invalid="ignore"):
+        cx, cy = np.floor(px), np.floor(py)
+    change = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])  # True for NaN too
+    keep = np.ones(len(px), dtype=bool)
+    keep[1:-1] = change[:-1] | change[1:]
+    return keep
+
+
+def _series_keep(px, py):
+    """First, last, minimum and maximum point of every pixel column"""
+    with np.errstate(invalid="ignore"):
+        column = np.floor(px)
+    keep = ~np.isfinite(column) | ~np.isfinite(py)
+    change = column[1:] != column[:-1]
+    keep[0] = keep[-1] = True
+    keep[1:] |= change  # first and last point of every column
+    keep[:-1] |= change
+
+    # the columns are runs as x increases, min and max of y in every run
+    starts = np.concatenate(([0], np.flatnonzero(change) + 1))
+    lengths = np.diff(np.append(starts, len(py)))
+    with np.errstate(invalid="ignore"):
+        keep |= py == np.repeat(np.minimum.reduceat(py, starts), lengths)
+        keep |= py == np.repeat(np.maximum.reduceat(py, starts), lengths)
+    return keep
+
+
+def _spoke_indices(px, py, bbox):
+    """Base and tip of the visible spokes, SPOKE_SPACING pixels apart"""
+    base = np.arange(0, len(px) - 1, 3)
+    visible = _visible_segments(px, py, bbox)[base]  # base to tip
+    bx, by = px[base], py[base]
+    along = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(bx), np.diff(by)))))
+    with np.errstate(invalid="ignore"):
+        slot = np.floor(along / SPOKE_SPACING)
+    first = np.ones(len(base), dtype=bool)
+    first[1:] = slot[1:] != slot[:-1]  # the first spoke of every slot
+    base = base[visible & first]
+    indices = np.column_stack((base, base + 1)).ravel()
+    gaps = np.zeros(len(indices), dtype=bool)
+    gaps[1::2] = True  # after every tip
+    return indices, gaps
+
+
+def lod_indices(x, y, transform, bbox, kind="path"):
+    """
+    Points to draw of a line
+
+    Parameters
+    ----------
+    x, y : ndarray
+        all points in data coordinates.
+    transform : matplotlib.transforms.Transform
+        data to pixel transform, e.g. `ax.transData`.
+    bbox : matplotlib.transforms.Bbox
+        visible area in pixels, e.g. `ax.bbox`.
+    kind : str
+        "path", "series" or "spokes", see the module docstring.
+
+    Returns
+    -------
+    indices : ndarray
+        increasing indices of the points to draw.
+    gaps : ndarray
+        bool, True where the line is interrupted after indices[i].
+    """
+    pixels = transform.transform(np.column_stack((x, y)))
+    px, py = pixels[:, 0], pixels[:, 1]
+    if len(px) < 2:
+        return np.arange(len(px)), np.zeros(len(px), dtype=bool)
+    if kind == "spokes":
+        return _spoke_indices(px, py, bbox)
+
+    visible = _visible_segments(px, py, bbox)
+    near = np.zeros(len(px), dtype=bool)
+    near[:-1] |= visible
+    near[1:] |= visible
+    keep = _series_keep(px, py) if kind == "series" else _path_keep(px, py)
+    indices = np.flatnonzero(keep & near)
+
+    # interrupted where a dropped invisible segment lies in between
+    n_visible = np.concatenate(([0], np.cumsum(visible)))
+    gaps = np.zeros(len(indices), dtype=bool)
+    gaps[:-1] = (n_visible[indices[1:]] - n_visible[indices[:-1]]
+                 < indices[1:] - indices[:-1])
+    return indices, gaps
+
+
+class LODLine(Line2D):
+    """
+    Line2D that draws a view-dependent subset of its points
+
+    `set_data` takes all points, the subset is picked when the line is
+    drawn. Until the first draw the line holds all points, so autoscaling
+    and `relim` after `set_data` see the full extent.
+
+    Parameters
+    ----------
+    x, y : array_like
+        all points.
+    kind : str
+        "path", "series" or "spokes", see the module docstring.
+    *args, **kwargs
+        passed to Line2D.
+    """
+
+    def __init__(self, x, y, *args, kind="path", **kwargs):
+        self.kind = kind
+        self._view = None
+        super().__init__(x, y, *args, **kwargs)  # calls set_data
+
+    def set_data(self, *args):
+        x, y = args[0] if len(args) == 1 else args
+        self._full_x = np.asarray(x, dtype=float)
+        self._full_y = np.asarray(y, dtype=float)
+        self._view = None
+        super().set_data(self._full_x, self._full_y)
+
+    def get_full_data(self):
+        """All points, also while a subset is drawn"""
+        return self._full_x, self._full_y
+
+    def draw(self, renderer):
+        ax = self.axes
+        if ax is not None and len(self._full_x) > LOD_MIN_POINTS:
+            view = (ax.get_xlim(), ax.get_ylim(), tuple(ax.bbox.bounds))
+            if view != self._view:
+                self._view = view
+                indices, gaps = lod_indices(self._full_x, self._full_y,
+                                            self.get_transform(), ax.bbox,
+                                            self.kind)
+                x, y = self._full_x[indices], self._full_y[indices]
+                # a NaN point after each gap interrupts the line
+                at = np.flatnonzero(gaps) + 1
+                Line2D.set_data(self, np.insert(x, at, np.nan),
+                                np.insert(y, at, np.nan))
+        super().draw(renderer)
+
+
+def plot_lod(ax, x, y, fmt="-", kind="path", **kwargs):
+    """
+    Plot a LODLine like `ax.plot(x, y, fmt, **kwargs)`
+
+    Returns the line, its points are changed with `set_data`.
+    """
+    template, = ax.plot([], [], fmt, **kwargs)  # parses fmt, next cycle color
+    line = LODLine(x, y, kind=kind)
+    line.update_from(template)
+    line.set_label(template.get_label())
+    template.remove()
+    ax.add_line(line)
+    ax.autoscale_view()
+    return line
@@ -0,0 +1,208 @@
+"""
+Memory tracing of long simulation runs
+
+A MemoryTracer passed to `mpc.do_simulation(..., memory=tracer)` traces
+the allocations with tracemalloc and snapshots them every `every` steps.
+Every snapshot is grouped by call site and by subsystem, the module the
+allocation was made in:
+
+    mpc         the controller and simulation loop (mpc.py)
+    history     the simulation history (utils/simulation_result.py)
+    course      course compilation and the spline planner
+    view        the live view and the plotting utilities
+    gui         the GUI
+    cvxpy       cvxpy problems, expressions and solver interfaces
+    matplotlib  figures and artists
+    numpy       numpy and scipy internals
+    other       everything else
+
+The report compares the last snapshot to the first one, taken after the
+first `every` steps so the one-time setup (problem construction, figure)
+is not counted as growth. A run with bounded memory shows no steady
+growth per 1000 steps. Tracing slows the run down, use it for memory
+checks only.
+
+Usage:
+    tracer = MemoryTracer(every=100)
+    mpc.do_simulation(cx, cy, cyaw, ck, sp, dl, state, memory=tracer)
+    print(tracer.report())
+"""
+import gc
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# (path fragment, subsystem), the first match wins
+SUBSYSTEMS = (
+    ("/utils/simulation_result.py", "history"),
+    ("/utils/live_view.py", "view"),
+    ("/utils/plot.py", "view"),
+    ("/utils/lod.py", "view"),
+    ("/utils/vehicle_draw.py", "view"),
+    ("/course_registry.py", "course"),
+    ("/utils/cubic_spline_planner.py", "course"),
+    ("/utils/course.py", "course"),
+    ("/gui/", "gui"),
+    ("/cvxpy/", "cvxpy"),
+    ("/matplotlib/", "matplotlib"),
+    ("/numpy/", "numpy"),
+    ("/scipy/", "numpy"),
+    ("/mpc.py", "mpc"),
+)
+
+# allocations of the tracer itself
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def subsystem(filename):
+    """Subsystem of a source file, see SUBSYSTEMS"""
+    filename = "/" + filename.replace("\\", "/")
+    for fragment, name in SUBSYSTEMS:
+        if fragment in filename:
+            return name
+    return "other"
+
+
+def peak_rss():
+    """Peak resident memory of the process [bytes], None if unknown"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024  # KB on Linux
+
+
+def _format_size(size):
+    return f"{size / 2**20:+.2f} MB" if abs(size) >= 2**20 else f"{size / 1024:+.1f} KB"
+
+
+class MemoryTracer:
+    """
+    Allocation snapshots by call site and subsystem every few steps
+
+    Parameters
+    ----------
+    every : int
+        steps between two snapshots.
+    top : int
+        number of call sites in the report.
+    frames : int
+        traceback frames stored per allocation. The innermost one decides
+        the call site and the subsystem.
+    """
+
+    def __init__(self, every=100, top=10, frames=1):
+        self.every = max(int(every), 1)
+        self.top = top
+        self.frames = frames
+        self.steps = 0
+        self.snapshots = []  # (step, tracemalloc.Snapshot), first and last only
+        self.history = []  # (step, traced bytes, {subsystem: bytes})
+        self.peak_traced = 0
+        self.peak_rss = None
+        self._started = False
+
+    def start(self):
+        """Start tracing, unless tracemalloc is already tracing"""
+        self.steps = 0
+        self.snapshots = []
+        self.history = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+        tracemalloc.reset_peak()
+
+    def step(self):
+        """Count a simulation step, snapshot every `every` steps"""
+        self.steps += 1
+        if self.steps % self.every == 0:
+            self.snapshot()
+
+    def snapshot(self):
+        """Snapshot the live allocations of the current step"""
+        gc.collect()  # cvxpy expressions hold cycles, count live memory only
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        by_subsystem = {}
+        for stat in snapshot.statistics("filename"):
+            name = subsystem(stat.traceback[0].filename)
+            by_subsystem[name] = by_subsystem.get(name, 0) + stat.size
+        self.history.append((self.steps, sum(by_subsystem.values()), by_subsystem))
+
+        # the call sites are compared first to last, keep only those two
+        self.snapshots = self.snapshots[:1] + [(self.steps, snapshot)]
+
+    def stop(self):
+        """Final snapshot and peak memory, stops tracing if it started it"""
+        if not tracemalloc.is_tracing():
+            return
+        if not self.history or self.history[-1][0] != self.steps:
+            self.snapshot()
+        self.peak_traced = tracemalloc.get_traced_memory()[1]
+        self.peak_rss = peak_rss()
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def growth(self):
+        """
+        Growth per subsystem from the first to the last snapshot
+
+        Returns
+        -------
+        growth : dict
+            subsystem to (first [bytes], last [bytes], growth per 1000
+            steps [bytes]).
+        """
+        if len(self.history) < 2:
+            return {}
+        first_step, _, first = self.history[0]
+        last_step, _, last = self.history[-1]
+        per = 1000.0 / max(last_step - first_step, 1)
+        return {name: (first.get(name, 0), last.get(name, 0),
+                       (last.get(name, 0) - first.get(name, 0)) * per)
+                for name in sorted(set(first) | set(last))}
+
+    def call_sites(self):
+        """The `top` call sites that grew most from the first to the last snapshot"""
+        if len(self.snapshots) < 2:
+            return []
+        (_, first), (_, last) = self.snapshots[0], self.snapshots[-1]
+        stats = last.compare_to(first, "lineno")
+        stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+        return [stat for stat in stats[:self.top] if stat.size_diff > 0]
+
+    def report(self):
+        """Growth per subsystem and call site, peak traced and resident memory"""
+        if len(self.history) < 2:
+            return f"{len(self.history)} snapshots, run more than {self.every} steps"
+        first_step, first_total, _ = self.history[0]
+        last_step, last_total, _ = self.history[-1]
+        lines = [f"{len(self.history)} snapshots, steps {first_step} to {last_step}",
+                 f"{'subsystem':<11}{'first':>12}{'last':>12}{'per 1000 steps':>16}"]
+        for name, (first, last, rate) in self.growth().items():
+            lines.append(f"{name:<11}{first / 2**20:>9.2f} MB{last / 2**20:>9.2f} MB"
+                         f"{_format_size(rate):>16}")
+        lines.append(f"{'total':<11}{first_total / 2**20:>9.2f} MB"
+                     f"{last_total / 2**20:>9.2f} MB")
+
+        sites = self.call_sites()
+        if sites:
+            lines.append("largest growth by call site:")
+            for stat in sites:
+                frame = stat.traceback[0]
+                lines.append(f"  {_format_size(stat.size_diff):>11} "
+                             f"{stat.count_diff:+7d} blocks  {frame.filename}:{frame.lineno}")
+
+        lines.append(f"peak traced: {self.peak_traced / 2**20:.2f} MB")
+        if self.peak_rss is not None:
+            lines.append(f"peak RSS: {self.peak_rss / 2**20:.1f} MB")
+        return "\n".join(lines)
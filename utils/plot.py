@@ -118,7 +118,7 @@ def plot_arrow(x, y, yaw, arrow_length=1.0,
 
 
 def plot_curvature(x_list, y_list, heading_list, curvature,
-                   k=0.01, c="-c", label="Curvature"):
+                   k=0.01, c="-c", label="Curvature", ax=None):
     """
     Plot curvature on 2D path. This plot is a line from the original path,
     the lateral distance from the original path shows curvature magnitude.
@@ -126,6 +126,10 @@ def plot_curvature(x_list, y_list, heading_list, curvature,
     For straight path, the curvature plot will be on the path, because
     curvature is 0 on the straight path.
 
+    The curvature line and the spokes from the path to it only draw the
+    points visible at the current zoom (see utils.lod), so long paths stay
+    fast to pan and zoom.
+
     Parameters
     ----------
     x_list : array_like
@@ -142,15 +146,26 @@ def plot_curvature(x_list, y_list, heading_list, curvature,
         color of the plot
     label : string
         label of the plot
+    ax : matplotlib.axes.Axes, optional
+        axes to draw into, by default the current axes
     """
-    cx = [x + d * k * np.cos(yaw - np.pi / 2.0) for x, y, yaw, d in
-          zip(x_list, y_list, heading_list, curvature)]
-    cy = [y + d * k * np.sin(yaw - np.pi / 2.0) for x, y, yaw, d in
-          zip(x_list, y_list, heading_list, curvature)]
-
-    plt.plot(cx, cy, c, label=label)
-    for ix, iy, icx, icy in zip(x_list, y_list, cx, cy):
-        plt.plot([ix, icx], [iy, icy], c)
+    from utils.lod import plot_lod
+
+    ax = plt.gca() if ax is None else ax
+    x = np.asarray(x_list, dtype=float)
+    y = np.asarray(y_list, dtype=float)
+    heading = np.asarray(heading_list, dtype=float)
+    offset = np.asarray(curvature, dtype=float) * k
+    cx = x + offset * np.cos(heading - np.pi / 2.0)
+    cy = y + offset * np.sin(heading - np.pi / 2.0)
+
+    line = plot_lod(ax, cx, cy, c, label=label)
+    # base, tip, NaN of every spoke from the path to the curvature line
+    gap = np.full(len(x), np.nan)
+    plot_lod(ax, np.column_stack((x, cx, gap)).ravel(),
+             np.column_stack((y, cy, gap)).ravel(), kind="spokes",
+             color=line.get_color(), linewidth=line.get_linewidth())
+    return line
 
 
 class Arrow3D(FancyArrowPatch):
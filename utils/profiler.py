@@ -0,0 +1,114 @@
+"""
+Per-phase timing of the control loop
+
+A PhaseProfiler passed to `mpc.do_simulation(..., profiler=profiler)`
+times every phase of every tick:
+
+    ref         reference trajectory (calc_ref_trajectory)
+    predict     motion prediction (predict_motion), all iterations
+    linearize   linearized models (get_linear_model_matrix), all iterations
+    build       problem construction and parameter updates
+    solve       cvxpy solve calls, all iterations
+    solver      of which the QP solver itself reported
+    iterations  linearization iterations of the tick
+    qp_iters    iterations of the QP solver, all solves of the tick
+    total       the whole tick from ref to the last solve
+
+Without a profiler the phases cost one None check each.
+
+Usage:
+    profiler = PhaseProfiler()
+    mpc.do_simulation(cx, cy, cyaw, ck, sp, dl, state, profiler=profiler)
+    print(profiler.report())
+"""
+from time import perf_counter
+
+import numpy as np
+
+PHASES = ("ref", "predict", "linearize", "build", "solve", "solver")
+COUNTS = ("iterations", "qp_iters")
+
+
+class _Phase:
+    """Context manager adding its duration to a phase of the current tick"""
+
+    __slots__ = ("current", "name", "start")
+
+    def __init__(self, current, name):
+        self.current = current
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.current[self.name] += perf_counter() - self.start
+
+
+class PhaseProfiler:
+    """
+    Per-tick phase times and their distribution over a run
+
+    The times of the current tick add up until `end_step` appends them
+    as one record.
+    """
+
+    def __init__(self):
+        self._current = dict.fromkeys(PHASES + COUNTS, 0)
+        self._records = {name: [] for name in PHASES + COUNTS + ("total",)}
+        self._phases = {name: _Phase(self._current, name) for name in PHASES}
+
+    def phase(self, name):
+        """Context manager timing a phase, e.g. `with profiler.phase("ref"):`"""
+        return self._phases[name]
+
+    def add(self, name, value):
+        """Add a time [s] or a count to the current tick"""
+        self._current[name] += value
+
+    def end_step(self, total):
+        """Record the current tick, which took `total` seconds"""
+        for name, value in self._current.items():
+            self._records[name].append(value)
+            self._current[name] = 0
+        self._records["total"].append(total)
+
+    def __len__(self):
+        return len(self._records["total"])
+
+    def records(self):
+        """Per-tick records as a dict of arrays, times in seconds"""
+        return {name: np.array(values) for name, values in self._records.items()}
+
+    def latest(self):
+        """Record of the last tick"""
+        return {name: values[-1] for name, values in self._records.items() if values}
+
+    def summary(self):
+        """p50, p95, max and mean of every phase and count over all ticks"""
+        summary = {}
+        for name, values in self.records().items():
+            if len(values):
+                summary[name] = {"p50": float(np.percentile(values, 50)),
+                                 "p95": float(np.percentile(values, 95)),
+                                 "max": float(np.max(values)),
+                                 "mean": float(np.mean(values))}
+        return summary
+
+    def report(self):
+        """Table of the phase times [ms], their share of the total and the counts"""
+        summary = self.summary()
+        if not summary:
+            return "no ticks profiled"
+        total = summary["total"]["mean"]
+        lines = [f"{len(self)} ticks",
+                 f"{'phase':<11}{'p50 [ms]':>10}{'p95 [ms]':>10}{'max [ms]':>10}{'share':>8}"]
+        for name in PHASES + ("total",):
+            s = summary[name]
+            share = s["mean"] / total * 100.0 if total > 0 else 0.0
+            lines.append(f"{name:<11}{s['p50'] * 1e3:>10.2f}{s['p95'] * 1e3:>10.2f}"
+                         f"{s['max'] * 1e3:>10.2f}{share:>7.1f}%")
+        for name in COUNTS:
+            s = summary[name]
+            lines.append(f"{name:<11}{s['p50']:>10.0f}{s['p95']:>10.0f}{s['max']:>10.0f}")
+        return "\n".join(lines)
@@ -0,0 +1,238 @@
+"""
+Offline rendering of recorded simulation runs
+
+A run recorded headlessly (`python mpc.py --headless --record run.npz`) is
+rendered afterwards to an MP4 or GIF video or to PNG frames. The frames
+are split into contiguous chunks that worker processes draw with the Agg
+backend, then the chunks are stitched together. The frames show the same
+course, trajectory, MPC prediction, xref, target and vehicle as the live
+view.
+
+Usage:
+    python -m utils.render run.npz run.mp4 --workers 4
+    python -m utils.render run.npz run.gif --frame-step 2
+    python -m utils.render run.npz frames/
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.simulation_result import SimulationResult
+
+FRAME_NAME = "frame_{:06d}.png"
+
+
+def _output_kind(output):
+    suffix = pathlib.Path(output).suffix.lower()
+    if suffix in (".mp4", ".gif"):
+        return suffix[1:]
+    return "png"  # a directory of frames
+
+
+def _ffmpeg():
+    import matplotlib
+    ffmpeg = shutil.which(matplotlib.rcParams["animation.ffmpeg_path"])
+    if ffmpeg is None:
+        raise RuntimeError("MP4 output needs ffmpeg, render a GIF or PNG frames instead")
+    return ffmpeg
+
+
+def _make_view(result, size, dpi):
+    """LiveView on an off-screen Agg figure, with limits for the whole run"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    from utils.live_view import LiveView
+
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    cx, cy = result.course
+    view = LiveView(cx, cy, result.meta["geometry"], fps=0,
+                    ax=fig.add_subplot())
+    view.include(result.x, result.y)
+    return view
+
+
+def _iter_frames(result, view, steps):
+    """Draw the steps, yields the RGBA pixels of every frame"""
+    x, y = result.x, result.y
+    for i in steps:
+        view.set_step(result.step(i), x[:i + 1], y[:i + 1])
+        view.canvas.draw()  # the view draws its animated artists on top
+        yield np.asarray(view.canvas.buffer_rgba())
+
+
+def _render_chunk(path, kind, start, stop, frame_step, fps, size, dpi, out):
+    """Render frames start..stop, runs in a worker process"""
+    result = SimulationResult.load(path)
+    view = _make_view(result, size, dpi)
+    steps = range(start * frame_step, stop * frame_step, frame_step)
+    frames = _iter_frames(result, view, steps)
+
+    if kind == "mp4":
+        width, height = view.canvas.get_width_height()
+        cmd = [_ffmpeg(), "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgba",
+               "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+               "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+               "-c:v", "libx264", "-pix_fmt", "yuv420p", str(out)]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            for frame in frames:
+                proc.stdin.write(frame.tobytes())
+        finally:
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed with exit code {proc.returncode}")
+    else:
+        import matplotlib.image
+        for k, frame in zip(range(start, stop), frames):
+            matplotlib.image.imsave(pathlib.Path(out) / FRAME_NAME.format(k), frame)
+
+    return stop - start
+
+
+def _stitch(kind, chunks, frame_dir, output, fps):
+    if kind == "mp4":
+        list_file = pathlib.Path(frame_dir) / "chunks.txt"
+        list_file.write_text("".join(f"file '{pathlib.Path(chunk).resolve()}'\n"
+                                     for chunk in chunks))
+        subprocess.run([_ffmpeg(), "-y", "-loglevel", "error", "-f", "concat",
+                        "-safe", "0", "-i", str(list_file), "-c", "copy",
+                        str(output)], check=True)
+    elif kind == "gif":
+        _write_gif(sorted(pathlib.Path(frame_dir).glob("frame_*.png")), output, fps)
+
+
+def _write_gif(paths, output, fps):
+    """
+    Append the PNG frames to a looping GIF one at a time
+
+    Image.save(save_all=True) holds all frames until it writes, so every
+    frame is opened, encoded with its own palette and closed instead.
+    """
+    from PIL import GifImagePlugin, Image  # a matplotlib dependency
+
+    duration = int(round(1000 / fps))
+    with open(output, "wb") as fp:
+        for k, path in enumerate(paths):
+            with Image.open(path) as png:
+                frame = png.convert("RGB").convert("P", palette=Image.Palette.ADAPTIVE)
+            if k == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={"loop": 0})
+                fp.write(b"".join(header))
+            fp.write(b"".join(GifImagePlugin.getdata(frame, duration=duration,
+                                                     include_color_table=True)))
+        fp.write(b";")  # trailer
+
+
+def render(result, output, fps=None, workers=None, frame_step=1,
+           size=(10, 8), dpi=100):
+    """
+    Render a recorded run to a video or to PNG frames
+
+    Parameters
+    ----------
+    result : str, pathlib.Path or SimulationResult
+        npz file written by `SimulationResult.save`, or a result with its
+        course and the vehicle geometry (meta["geometry"]).
+    output : str or pathlib.Path
+        .mp4 (needs ffmpeg) or .gif file, otherwise a directory for PNG
+        frames.
+    fps : float, optional
+        frame rate of the video, by default real time.
+    workers : int, optional
+        number of worker processes, by default the number of CPUs.
+    frame_step : int, optional
+        render every frame_step-th step, by default 1
+    size : tuple, optional
+        figure size [inch], by default (10, 8)
+    dpi : int, optional
+        figure resolution, by default 100
+
+    Returns
+    -------
+    n_frames : int
+        number of rendered frames.
+    """
+    kind = _output_kind(output)
+    if kind == "mp4":
+        _ffmpeg()  # fail before rendering anything
+
+    with tempfile.TemporaryDirectory(prefix="mpc_render_") as tmp:
+        if isinstance(result, SimulationResult):
+            if result.course is None or "geometry" not in result.meta:
+                raise ValueError("the result needs its course and the vehicle geometry")
+            path = pathlib.Path(tmp) / "result.npz"
+            result.save(path, *result.course, **result.meta)
+        else:
+            path = pathlib.Path(result)
+            result = SimulationResult.load(path)
+
+        n_frames = math.ceil(len(result) / frame_step)
+        if fps is None:
+            dt = float(np.median(np.diff(result.t))) if len(result) > 1 else 0.2
+            fps = 1.0 / (dt * frame_step)
+        workers = max(1, min(workers or os.cpu_count() or 1, n_frames))
+
+        if kind == "png":
+            frame_dir = pathlib.Path(output)
+            frame_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            frame_dir = pathlib.Path(tmp)
+
+        bounds = np.linspace(0, n_frames, workers + 1).astype(int)
+        jobs = []
+        for k, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            out = frame_dir / f"chunk_{k:04d}.mp4" if kind == "mp4" else frame_dir
+            jobs.append((str(path), kind, int(start), int(stop), frame_step,
+                         fps, size, dpi, out))
+
+        if workers == 1:
+            for job in jobs:
+                _render_chunk(*job)
+        else:
+            # spawn, so the workers do not inherit GUI or pyplot state
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                for future in [pool.submit(_render_chunk, *job) for job in jobs]:
+                    future.result()
+
+        _stitch(kind, [job[-1] for job in jobs], frame_dir, output, fps)
+
+    return n_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a recorded simulation run')
+    parser.add_argument('result', help='npz file recorded with mpc.py --record')
+    parser.add_argument('output', help='.mp4 or .gif file, or a directory for PNG frames')
+    parser.add_argument('--fps', type=float, default=None,
+                        help='Frame rate (default: real time)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--frame-step', type=int, default=1,
+                        help='Render every n-th step (default: 1)')
+    parser.add_argument('--dpi', type=int, default=100,
+                        help='Resolution of the 10x8 inch frames (default: 100)')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    n_frames = render(args.result, args.output, fps=args.fps,
+                      workers=args.workers, frame_step=args.frame_step,
+                      dpi=args.dpi)
+    print(f"Rendered {n_frames} frames to {args.output} "
+          f"in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == '__main__':
+    main()
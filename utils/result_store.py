@@ -0,0 +1,215 @@
+"""
+Columnar on-disk store for simulation results
+
+Every per-step field is appended to its own raw column file and an index
+records which rows belong to which run, together with the run metadata:
+
+    store/
+        schema.json
+        index.jsonl      one JSON line per finished run
+        t.col, x.col, ..., status.col
+
+The reader memory-maps the columns, so an analysis over thousands of runs
+(e.g. all lateral errors on Eternity) only touches the columns it needs.
+
+Usage:
+    store = ResultStore("results")
+    with store.run(trajectory="Eternity", T=mpc.T) as run:
+        mpc.do_simulation(cx, cy, cyaw, ck, sp, dl, state, on_step=run)
+
+    e_lat = ResultStore("results").select("e_lat", trajectory="Eternity")
+"""
+import json
+import os
+import pathlib
+
+import numpy as np
+
+STORE_VERSION = 1
+
+# column name -> dtype, the reference columns are the first point of xref
+COLUMNS = {
+    "run": "<i4",
+    "step": "<i4",
+    "t": "<f8",
+    "x": "<f8",
+    "y": "<f8",
+    "yaw": "<f8",
+    "v": "<f8",
+    "d": "<f8",
+    "a": "<f8",
+    "x_ref": "<f8",
+    "y_ref": "<f8",
+    "v_ref": "<f8",
+    "yaw_ref": "<f8",
+    "e_lat": "<f8",
+    "solve_time": "<f8",
+    "status": "<i1",
+}
+
+
+class ResultStore:
+    """
+    Append-only columnar result store
+
+    Only one process should write to a store at a time, give parallel
+    workers their own stores.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path
+        store directory, created if needed.
+    """
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        schema_path = self.root / "schema.json"
+        if schema_path.exists():
+            schema = json.loads(schema_path.read_text())
+            if schema.get("version") != STORE_VERSION:
+                raise ValueError(f"{self.root} has store version {schema.get('version')}, "
+                                 f"expected {STORE_VERSION}")
+        else:
+            schema_path.write_text(json.dumps(
+                {"version": STORE_VERSION, "columns": COLUMNS}, indent=1))
+
+    # -------- writing --------
+
+    def run(self, **meta):
+        """Start a run, the returned RunWriter is the on_step callback"""
+        return RunWriter(self, meta)
+
+    def _column_path(self, name):
+        return self.root / f"{name}.col"
+
+    def _index_path(self):
+        return self.root / "index.jsonl"
+
+    def _next_run(self):
+        """Id and first row of the next run
+
+        Rows of a run that did not finish (e.g. a crash) are cut off, so all
+        columns have the same length again.
+        """
+        runs = self.runs()
+        run_id = runs[-1]["run"] + 1 if runs else 0
+        rows = runs[-1]["stop"] if runs else 0
+        for name, dtype in COLUMNS.items():
+            path = self._column_path(name)
+            size = rows * np.dtype(dtype).itemsize
+            if path.exists() and path.stat().st_size != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        return run_id, rows
+
+    # -------- reading --------
+
+    def runs(self, **filters):
+        """Index entries of the finished runs whose metadata match filters"""
+        path = self._index_path()
+        if not path.exists():
+            return []
+        runs = []
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if all(entry["meta"].get(k) == v for k, v in filters.items()):
+                    runs.append(entry)
+        return runs
+
+    def column(self, name):
+        """Whole column as a read-only memory map"""
+        dtype = np.dtype(COLUMNS[name])
+        path = self._column_path(name)
+        if not path.exists() or path.stat().st_size < dtype.itemsize:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def run_column(self, run, name):
+        """Column of one run (an index entry or run id), a memory map view"""
+        if not isinstance(run, dict):
+            run = next(r for r in self.runs() if r["run"] == run)
+        return self.column(name)[run["start"]:run["stop"]]
+
+    def select(self, name, **filters):
+        """Column values of all runs matching filters, concatenated"""
+        col = self.column(name)
+        parts = [col[r["start"]:r["stop"]] for r in self.runs(**filters)]
+        if not parts:
+            return np.empty(0, dtype=col.dtype)
+        return np.concatenate(parts)
+
+
+class RunWriter:
+    """
+    Streams the steps of one run into the columns of a ResultStore
+
+    Call it with the SimulationResult after every step (it is the
+    `on_step` callback of `mpc.do_simulation`) or pass the values to
+    `append`. Rows are buffered and appended every `flush_every` steps.
+    The run is added to the index on `close`, or at the end of a
+    `with` block.
+    """
+
+    def __init__(self, store, meta, flush_every=1024):
+        self.store = store
+        self.meta = meta
+        self.flush_every = flush_every
+        self.run_id, self.start = store._next_run()
+        self.n_rows = 0
+        self._buffer = {name: [] for name in COLUMNS}
+        self._files = {name: open(store._column_path(name), "ab")
+                       for name in COLUMNS}
+
+    def __call__(self, result):
+        step = result.latest()
+        xref = step["xref"][:, 0]
+        self.append(t=step["t"], x=step["x"], y=step["y"], yaw=step["yaw"],
+                    v=step["v"], d=step["d"], a=step["a"],
+                    x_ref=xref[0], y_ref=xref[1], v_ref=xref[2],
+                    yaw_ref=xref[3], e_lat=step["e_lat"],
+                    solve_time=step["solve_time"], status=step["status"])
+        return False  # never stop the simulation
+
+    def append(self, **values):
+        """Append one step, missing float columns are stored as NaN"""
+        buffer = self._buffer
+        buffer["run"].append(self.run_id)
+        buffer["step"].append(self.n_rows)
+        for name in COLUMNS:
+            if name not in ("run", "step"):
+                buffer[name].append(values.get(name, np.nan if name != "status" else 0))
+        self.n_rows += 1
+        if len(buffer["run"]) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        for name, values in self._buffer.items():
+            if values:
+                self._files[name].write(
+                    np.asarray(values, dtype=COLUMNS[name]).tobytes())
+                values.clear()
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        """Write the remaining rows and add the run to the index"""
+        if self._files is None:
+            return
+        self.flush()
+        for f in self._files.values():
+            os.fsync(f.fileno())
+            f.close()
+        self._files = None
+
+        entry = {"run": self.run_id, "start": self.start,
+                 "stop": self.start + self.n_rows, "meta": self.meta}
+        with open(self.store._index_path(), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
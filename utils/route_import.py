@@ -0,0 +1,346 @@
+"""
+Streaming import of large recorded routes
+
+Recorded routes come as CSV logs or GeoJSON files with millions of points.
+They are parsed in chunks and simplified on the fly with the
+Ramer-Douglas-Peucker algorithm, so the raw trace is never held in memory
+as a whole. The simplified waypoints can be registered as a trajectory of
+the running process, see import_route.
+
+Usage (import time and peak memory of a file):
+    python -m utils.route_import route.csv --tolerance 0.5
+"""
+import argparse
+import math
+import re
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+EARTH_RADIUS = 6378137.0  # [m]
+
+# innermost GeoJSON position array: [x, y] or [x, y, z]
+_POSITION = re.compile(r"\[\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)[^\[\]\"]*\]")
+_COORDINATES_KEY = '"coordinates"'
+
+
+def rdp(points, tolerance):
+    """
+    Ramer-Douglas-Peucker polyline simplification
+
+    Parameters
+    ----------
+    points : ndarray
+        (N, 2) array of polyline points.
+    tolerance : float
+        maximum distance [m] of a dropped point to the simplified polyline.
+
+    Returns
+    -------
+    keep : ndarray
+        boolean mask of the points to keep. The end points are always kept.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+
+        p0 = points[i]
+        dx, dy = points[j] - p0
+        seg = points[i + 1:j] - p0
+        norm = math.hypot(dx, dy)
+        if norm == 0.0:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        else:
+            dist = np.abs(dx * seg[:, 1] - dy * seg[:, 0]) / norm
+
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+
+    return keep
+
+
+class StreamingSimplifier:
+    """
+    Chunk-wise Ramer-Douglas-Peucker simplification
+
+    Every chunk is simplified together with the raw points after the last
+    final waypoint, so each output segment stays within `tolerance` of the
+    raw points it replaces. Only the simplified waypoints and at most
+    `max_pending` raw points are kept in memory.
+
+    Parameters
+    ----------
+    tolerance : float
+        maximum distance [m] of a raw point to the simplified route.
+    min_spacing : float
+        waypoints closer than this to the previous one are dropped, so the
+        spline through them is well defined.
+    max_pending : int
+        maximum number of raw points carried over to the next chunk.
+    """
+
+    def __init__(self, tolerance=0.5, min_spacing=0.1, max_pending=200000):
+        self.tolerance = tolerance
+        self.min_spacing = min_spacing
+        self.max_pending = max_pending
+        self.n_points = 0
+        self._waypoints = []
+        self._pending = np.empty((0, 2))
+
+    def push(self, chunk):
+        """Simplify the next (N, 2) chunk of raw points"""
+        chunk = np.asarray(chunk, dtype=float).reshape(-1, 2)
+        self.n_points += len(chunk)
+        points = np.vstack((self._pending, chunk))
+        if len(points) < 2:
+            self._pending = points
+            return
+
+        kept = np.flatnonzero(rdp(points, self.tolerance))
+        if len(points) > self.max_pending:
+            last = kept[-1]
+        else:
+            # the route may continue past the chunk end, so the last
+            # segment is simplified again with the next chunk
+            last = kept[-2]
+
+        for k in kept[kept < last]:
+            self._add(points[k])
+        self._pending = points[last:]
+
+    def finish(self):
+        """Return the simplified waypoints as a list of (x, y) tuples"""
+        if len(self._pending):
+            kept = np.flatnonzero(rdp(self._pending, self.tolerance))
+            for k in kept:
+                self._add(self._pending[k])
+            self._pending = np.empty((0, 2))
+        return list(self._waypoints)
+
+    def _add(self, point):
+        x, y = float(point[0]), float(point[1])
+        if self._waypoints:
+            px, py = self._waypoints[-1]
+            if math.hypot(x - px, y - py) < self.min_spacing:
+                return
+        self._waypoints.append((x, y))
+
+
+def iter_csv_chunks(path, x_col=0, y_col=1, chunk_size=100000, delimiter=","):
+    """
+    Read (x, y) columns of a CSV file in chunks
+
+    `x_col` and `y_col` are column indices or header names. A header line
+    is detected automatically.
+    """
+    with open(path) as f:
+        first = f.readline()
+        fields = [field.strip() for field in first.split(delimiter)]
+        try:
+            [float(field) for field in fields]
+            header = None
+        except ValueError:
+            header = fields
+
+        usecols = []
+        for col in (x_col, y_col):
+            if isinstance(col, str) and not col.isdigit():
+                if header is None:
+                    raise ValueError(f"CSV file has no header for column '{col}'")
+                usecols.append(header.index(col))
+            else:
+                usecols.append(int(col))
+
+        lines = [] if header is not None else [first]
+        while True:
+            lines.extend(islice(f, chunk_size - len(lines)))
+            if not lines:
+                break
+            yield np.loadtxt(lines, delimiter=delimiter, usecols=usecols,
+                             ndmin=2)
+            lines = []
+
+
+def iter_geojson_chunks(path, chunk_size=100000, block_size=1 << 22):
+    """
+    Read the positions of a GeoJSON file in chunks
+
+    The positions of all "coordinates" members are returned in file order,
+    so a LineString (or consecutive LineStrings) forms the route. The file is
+    scanned block by block instead of being parsed as a whole.
+    """
+    buf = ""
+    pos = 0
+    in_coords = False
+    parts, n = [], 0
+
+    with open(path) as f:
+        while True:
+            block = f.read(block_size)
+            buf = buf[pos:] + block
+            pos = 0
+
+            while True:
+                if not in_coords:
+                    k = buf.find(_COORDINATES_KEY, pos)
+                    if k < 0:
+                        # keep a possibly split key for the next block
+                        pos = max(pos, len(buf) - len(_COORDINATES_KEY))
+                        break
+                    in_coords = True
+                    pos = k + len(_COORDINATES_KEY)
+
+                # positions contain no quotes, so they end at the next key
+                end = buf.find('"', pos)
+                if end < 0:
+                    end = buf.rfind("]", pos) + 1
+                    if end <= pos:
+                        break
+                else:
+                    in_coords = False
+
+                found = _POSITION.findall(buf, pos, end)
+                if found:
+                    parts.append(np.array(found, dtype=float))
+                    n += len(found)
+                pos = end
+                if in_coords:
+                    break
+
+            if n >= chunk_size or (not block and n):
+                yield np.vstack(parts)
+                parts, n = [], 0
+
+            if not block:
+                break
+
+
+def to_local_xy(chunk, origin):
+    """Project (lon, lat) [deg] to local (x, y) [m] around origin (lon, lat)"""
+    lon0, lat0 = origin
+    x = np.deg2rad(chunk[:, 0] - lon0) * EARTH_RADIUS * math.cos(math.radians(lat0))
+    y = np.deg2rad(chunk[:, 1] - lat0) * EARTH_RADIUS
+    return np.column_stack((x, y))
+
+
+def import_route(path, name=None, tolerance=0.5, chunk_size=100000,
+                 geographic=None, **reader_kwargs):
+    """
+    Import a recorded route and register it as a trajectory.
+
+    Parameters
+    ----------
+    path : str
+        CSV or GeoJSON (.geojson / .json) file.
+    name : str, optional
+        trajectory name. If given, the route is added to TRAJECTORIES of
+        this process; it is not stored, so import it where the trajectories
+        are set up.
+    tolerance : float, optional
+        maximum lateral error [m] of the simplified route, by default 0.5
+    chunk_size : int, optional
+        number of raw points parsed at once, by default 100000
+    geographic : bool, optional
+        if True, coordinates are (lon, lat) degrees and are projected to
+        local meters around the first point. By default True for GeoJSON
+        and False for CSV.
+    reader_kwargs :
+        passed to `iter_csv_chunks` (x_col, y_col, delimiter).
+
+    Returns
+    -------
+    waypoints : list of tuples
+        simplified (x, y) waypoints.
+    n_points : int
+        number of raw points read.
+    """
+    path = str(path)
+    is_geojson = path.lower().endswith((".geojson", ".json"))
+    if geographic is None:
+        geographic = is_geojson
+
+    if is_geojson:
+        chunks = iter_geojson_chunks(path, chunk_size=chunk_size)
+    else:
+        chunks = iter_csv_chunks(path, chunk_size=chunk_size, **reader_kwargs)
+
+    simplifier = StreamingSimplifier(tolerance=tolerance)
+    origin = None
+    for chunk in chunks:
+        if geographic:
+            if origin is None:
+                origin = tuple(chunk[0])
+            chunk = to_local_xy(chunk, origin)
+        simplifier.push(chunk)
+    waypoints = simplifier.finish()
+
+    if name is not None:
+        from trajectory_config import register_trajectory
+        register_trajectory(name, waypoints)
+
+    return waypoints, simplifier.n_points
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process [MB], None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes on macOS, kilobytes on Linux
+        return peak / 1024 ** 2
+    return peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a recorded route')
+    parser.add_argument('path', help='CSV or GeoJSON route file')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Max lateral error of the simplified route in m (default: 0.5)')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='Points parsed at once (default: 100000)')
+    parser.add_argument('--x-col', default='0', help='CSV x column index or name')
+    parser.add_argument('--y-col', default='1', help='CSV y column index or name')
+    parser.add_argument('--geographic', action=argparse.BooleanOptionalAction, default=None,
+                        help='Coordinates are lon/lat degrees (default for GeoJSON, '
+                             '--no-geographic for projected GeoJSON)')
+    args = parser.parse_args()
+
+    reader_kwargs = {}
+    if not args.path.lower().endswith((".geojson", ".json")):
+        reader_kwargs = dict(x_col=args.x_col, y_col=args.y_col)
+
+    start_time = time.time()
+    waypoints, n_points = import_route(
+        args.path, tolerance=args.tolerance,
+        chunk_size=args.chunk_size, geographic=args.geographic,
+        **reader_kwargs)
+    elapsed_time = time.time() - start_time
+
+    print(f"Read {n_points} points, kept {len(waypoints)} waypoints")
+    print(f"Import time: {elapsed_time:.2f} seconds")
+    peak = peak_memory_mb()
+    if peak is not None:
+        print(f"Peak memory: {peak:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
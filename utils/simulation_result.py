@@ -0,0 +1,289 @@
+"""
+Simulation history stored in preallocated numpy arrays
+"""
+import json
+
+import numpy as np
+
+
+class SimulationResult:
+    """
+    History of a simulation run
+
+    All per-step values are written into arrays preallocated for `capacity`
+    steps, including the MPC predicted horizon (ox, oy) and the reference
+    trajectory (xref) of every step. With `ring=True` the arrays are a ring
+    buffer keeping the last `capacity` steps, which bounds the memory of
+    endless loop runs. Otherwise the arrays grow if the capacity is exceeded.
+
+    Besides the state and the inputs, every step has the signed lateral
+    error to the course (e_lat), the solver time of the step, the solver
+    status (STATUS_OK, STATUS_FAILED) and the course index of the target
+    point (target, -1 if unknown).
+
+    `termination` tells why the run ended: END_GOAL, END_MAX_TIME or
+    END_STOPPED (by the on_step hook or the live view), None while it runs.
+
+    Iterating gives (t, x, y, yaw, v, d, a), so the result unpacks like the
+    tuple `do_simulation` used to return.
+
+    Parameters
+    ----------
+    capacity : int
+        number of steps to preallocate, e.g. int(MAX_TIME / DT) + 2
+    horizon : int
+        MPC horizon length T, horizons are stored with T + 1 points. A
+        longer horizon, e.g. after T changed during the run, widens the
+        arrays, shorter ones are padded with NaN.
+    nx : int
+        number of states of xref
+    ring : bool
+        keep only the last `capacity` steps
+    """
+
+    STATE_FIELDS = ("t", "x", "y", "yaw", "v", "d", "a")
+    STEP_FIELDS = STATE_FIELDS + ("e_lat", "solve_time", "status", "target")
+    HORIZON_FIELDS = ("ox", "oy", "xref")
+    FILE_VERSION = 1
+    FILL = {"target": -1}  # unrecorded steps, other step fields 0, horizons NaN
+
+    STATUS_OK = 0
+    STATUS_FAILED = 1
+
+    END_GOAL = "goal"
+    END_MAX_TIME = "max_time"
+    END_STOPPED = "stopped"
+
+    def __init__(self, capacity, horizon, nx=4, ring=False):
+        self.capacity = max(int(capacity), 1)
+        self.horizon = horizon
+        self.nx = nx
+        self.ring = ring
+        self.n_steps = 0  # steps recorded so far, including overwritten ones
+        self.course = None  # (cx, cy) of a loaded result
+        self.meta = {}
+        self.termination = None
+
+        self._data = {field: np.zeros(self.capacity)
+                      for field in self.STEP_FIELDS}
+        self._data["status"] = np.zeros(self.capacity, dtype=np.int8)
+        self._data["target"] = np.full(self.capacity, self._fill("target"), dtype=np.int32)
+        self._data["ox"] = np.full((self.capacity, horizon + 1), np.nan)
+        self._data["oy"] = np.full((self.capacity, horizon + 1), np.nan)
+        self._data["xref"] = np.full((self.capacity, nx, horizon + 1), np.nan)
+
+    def append(self, t, x, y, yaw, v, d, a, ox=None, oy=None, xref=None,
+               e_lat=np.nan, solve_time=np.nan, status=STATUS_OK, target=-1):
+        """Record one step, horizons which are None are stored as NaN"""
+        if self.n_steps >= self.capacity and not self.ring:
+            self._grow()
+        points = max((np.shape(values)[-1] for values in (ox, oy, xref) if values is not None),
+                     default=0)
+        if points > self.horizon + 1:
+            self._widen(points - 1)
+        i = self.n_steps % self.capacity
+
+        data = self._data
+        data["t"][i] = t
+        data["x"][i] = x
+        data["y"][i] = y
+        data["yaw"][i] = yaw
+        data["v"][i] = v
+        data["d"][i] = d
+        data["a"][i] = a
+        data["e_lat"][i] = e_lat
+        data["solve_time"][i] = solve_time
+        data["status"][i] = status
+        data["target"][i] = target
+        self._set_horizon(data["ox"][i], ox)
+        self._set_horizon(data["oy"][i], oy)
+        self._set_horizon(data["xref"][i], xref)
+
+        self.n_steps += 1
+
+    @staticmethod
+    def _set_horizon(row, values):
+        row[...] = np.nan
+        if values is not None:
+            values = np.asarray(values)
+            row[..., :values.shape[-1]] = values
+
+    def _fill(self, field):
+        return np.nan if field in self.HORIZON_FIELDS else self.FILL.get(field, 0)
+
+    def _grow(self):
+        for field, buf in self._data.items():
+            extra = np.full_like(buf, self._fill(field))
+            self._data[field] = np.concatenate((buf, extra))
+        self.capacity *= 2
+
+    def _widen(self, horizon):
+        for field in self.HORIZON_FIELDS:
+            buf = self._data[field]
+            wide = np.full(buf.shape[:-1] + (horizon + 1,), np.nan)
+            wide[..., :buf.shape[-1]] = buf
+            self._data[field] = wide
+        self.horizon = horizon
+
+    def latest(self):
+        """Values of the last recorded step as a dict"""
+        i = (self.n_steps - 1) % self.capacity
+        return {field: buf[i] for field, buf in self._data.items()}
+
+    def step(self, i):
+        """Values of the i-th kept step in chronological order as a dict"""
+        n = len(self)
+        if not -n <= i < n:
+            raise IndexError(f"step {i} out of range for {n} steps")
+        i = (self.n_steps - n + i % n) % self.capacity
+        return {field: buf[i] for field, buf in self._data.items()}
+
+    def __len__(self):
+        return min(self.n_steps, self.capacity)
+
+    def __iter__(self):
+        return iter([self[field] for field in self.STATE_FIELDS])
+
+    def __getitem__(self, field):
+        """Field in chronological order, a view unless the ring wrapped"""
+        buf = self._data[field]
+        if self.n_steps <= self.capacity:
+            return buf[:self.n_steps]
+        i = self.n_steps % self.capacity
+        return np.concatenate((buf[i:], buf[:i]))
+
+    t = property(lambda self: self["t"])
+    x = property(lambda self: self["x"])
+    y = property(lambda self: self["y"])
+    yaw = property(lambda self: self["yaw"])
+    v = property(lambda self: self["v"])
+    d = property(lambda self: self["d"])
+    a = property(lambda self: self["a"])
+    ox = property(lambda self: self["ox"])
+    oy = property(lambda self: self["oy"])
+    xref = property(lambda self: self["xref"])
+    e_lat = property(lambda self: self["e_lat"])
+    solve_time = property(lambda self: self["solve_time"])
+    status = property(lambda self: self["status"])
+    target = property(lambda self: self["target"])
+
+    def save(self, path, cx=None, cy=None, **meta):
+        """
+        Save the recorded steps to a compressed npz file
+
+        The course (cx, cy) and JSON serializable metadata, e.g. the
+        vehicle geometry for rendering, can be stored along.
+        """
+        arrays = {field: self[field] for field in self._data}
+        if cx is not None and cy is not None:
+            arrays["cx"] = np.asarray(cx, dtype=float)
+            arrays["cy"] = np.asarray(cy, dtype=float)
+        np.savez_compressed(path, version=self.FILE_VERSION,
+                            horizon=self.horizon, nx=self.nx,
+                            termination=str(self.termination or ""),
+                            meta=json.dumps(meta), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a result saved with `save`, course and meta are attributes"""
+        with np.load(path) as data:
+            if int(data["version"]) != cls.FILE_VERSION:
+                raise ValueError(f"{path} has result file version "
+                                 f"{int(data['version'])}, expected {cls.FILE_VERSION}")
+            n = len(data["t"])
+            result = cls(n, int(data["horizon"]), int(data["nx"]))
+            for field in result._data:
+                if field in data:
+                    result._data[field][:n] = data[field]
+            result.n_steps = n
+            if "cx" in data:
+                result.course = (data["cx"], data["cy"])
+            if "termination" in data:
+                result.termination = str(data["termination"]) or None
+            result.meta = json.loads(str(data["meta"]))
+        return result
+
+    def duration(self):
+        """simulated time [s]"""
+        return float(self.t[-1]) if len(self) else 0.0
+
+    def mean_speed(self):
+        """mean speed [m/s]"""
+        return float(np.mean(self.v))
+
+    def max_abs_steer(self):
+        """maximum absolute steering angle [rad]"""
+        return float(np.max(np.abs(self.d)))
+
+    def recorded_lateral_errors(self):
+        """Lateral errors recorded during the run [m], the steps that have one"""
+        e_lat = self.e_lat
+        return e_lat[np.isfinite(e_lat)]
+
+    def lateral_errors(self, cx, cy, max_elements=1 << 20):
+        """
+        Distance of every recorded position to the course polyline [m]
+
+        Computed in chunks of steps against all course segments at once,
+        a chunk has at most max_elements step-segment pairs. The first and
+        last segments are extended, so overshooting the course ends is not
+        counted as lateral error. Costs steps x course points, the errors
+        recorded during the run (recorded_lateral_errors) are free.
+        """
+        px, py = np.asarray(cx, dtype=float), np.asarray(cy, dtype=float)
+        if len(px) < 2:
+            return np.hypot(self.x - px[0], self.y - py[0])
+        x0, y0 = px[:-1], py[:-1]
+        sx, sy = np.diff(px), np.diff(py)
+        seg_len2 = np.maximum(sx ** 2 + sy ** 2, 1e-12)
+        w_min = np.zeros(len(sx))
+        w_max = np.ones(len(sx))
+        w_min[0], w_max[-1] = -np.inf, np.inf
+
+        x, y = self.x, self.y
+        chunk = max(1, max_elements // len(sx))
+        errors = np.empty(len(x))
+        for i in range(0, len(x), chunk):
+            dx = x[i:i + chunk, None] - x0
+            dy = y[i:i + chunk, None] - y0
+            w = np.clip((dx * sx + dy * sy) / seg_len2, w_min, w_max)
+            dist2 = (dx - w * sx) ** 2 + (dy - w * sy) ** 2
+            errors[i:i + chunk] = np.sqrt(dist2.min(axis=1))
+        return errors
+
+    def rms_lateral_error(self, cx, cy):
+        """RMS distance to the course polyline [m]"""
+        return float(np.sqrt(np.mean(self.lateral_errors(cx, cy) ** 2)))
+
+    def summary(self, cx=None, cy=None):
+        """
+        Summary metrics as a dict
+
+        The lateral errors are the recorded ones, a result without them
+        (e.g. appended by hand) needs the course to compute them.
+        """
+        summary = {
+            "steps": self.n_steps,
+            "duration": self.duration(),
+            "mean_speed": self.mean_speed(),
+            "max_speed": float(np.max(np.abs(self.v))),
+            "max_abs_steer": self.max_abs_steer(),
+            "max_abs_accel": float(np.max(np.abs(self.a))),
+            "termination": self.termination,
+        }
+        solve_time = self.solve_time[1:]  # the initial step has no solve
+        solved = solve_time[np.isfinite(solve_time)]  # NaN for reused plans
+        if len(solve_time):
+            summary["solves"] = len(solved)
+            summary["solve_rate"] = len(solved) / len(solve_time)
+            summary["failed_solves"] = int(np.sum(self.status == self.STATUS_FAILED))
+        if len(solved):
+            summary["mean_solve_time"] = float(np.mean(solved))
+            summary["max_solve_time"] = float(np.max(solved))
+        errors = self.recorded_lateral_errors()
+        if not len(errors) and cx is not None and cy is not None:
+            errors = self.lateral_errors(cx, cy)
+        if len(errors):
+            summary["rms_lateral_error"] = float(np.sqrt(np.mean(errors ** 2)))
+            summary["max_lateral_error"] = float(np.max(np.abs(errors)))
+        return summary
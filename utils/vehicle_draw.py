@@ -0,0 +1,128 @@
+"""
+Vehicle outline geometry for drawing
+
+The outlines of the body and the wheels are built once per geometry
+(VehicleTemplate) and transformed for whole arrays of poses at once, so
+any number of vehicles is drawn as one collection in a single draw call.
+Only `draw_vehicles` imports matplotlib.
+
+`geometry` is a dict with the keys of `mpc.vehicle_geometry()`:
+LENGTH, WIDTH, BACKTOWHEEL, WHEEL_LEN, WHEEL_WIDTH, TREAD and WB [m].
+"""
+import functools
+
+import numpy as np
+
+N_PARTS = 5  # body, front right, rear right, front left, rear left wheel
+
+
+class VehicleTemplate:
+    """
+    Closed outlines of the body and the wheels in the vehicle frame
+
+    The origin is the rear axle center, x points forward.
+    """
+
+    def __init__(self, geometry):
+        length = geometry["LENGTH"]
+        width = geometry["WIDTH"]
+        backtowheel = geometry["BACKTOWHEEL"]
+        wheel_len = geometry["WHEEL_LEN"]
+        wheel_width = geometry["WHEEL_WIDTH"]
+        tread = geometry["TREAD"]
+        self.wb = geometry["WB"]
+
+        body = np.array([[-backtowheel, (length - backtowheel), (length - backtowheel), -backtowheel, -backtowheel],
+                         [width / 2, width / 2, - width / 2, -width / 2, width / 2]]).T
+        right_wheel = np.array([[wheel_len, -wheel_len, -wheel_len, wheel_len, wheel_len],
+                                [-wheel_width - tread, -wheel_width - tread, wheel_width - tread, wheel_width - tread, -wheel_width - tread]]).T
+        left_wheel = right_wheel * [1.0, -1.0]
+
+        # (part, point, xy) in the order of N_PARTS
+        self.parts = np.stack((body, right_wheel, right_wheel, left_wheel, left_wheel))
+        # the front wheels are steered around the front axle center
+        self.steered = np.array([False, True, False, True, False])
+
+    def transform(self, x, y, yaw, steer=0.0):
+        """
+        Outlines of vehicles at the given poses
+
+        Parameters
+        ----------
+        x, y, yaw, steer : float or array_like
+            poses [m, m, rad, rad], broadcast to a common shape (N,).
+
+        Returns
+        -------
+        outlines : ndarray
+            (N, N_PARTS, 5, 2) closed polygons in world coordinates.
+        """
+        x, y, yaw, steer = (np.atleast_1d(np.asarray(v, dtype=float))
+                            for v in (x, y, yaw, steer))
+        x, y, yaw, steer = np.broadcast_arrays(x, y, yaw, steer)
+
+        parts = np.broadcast_to(self.parts, (len(x), *self.parts.shape)).copy()
+        front = parts[:, self.steered]
+        c, s = np.cos(steer)[:, None, None], np.sin(steer)[:, None, None]
+        fx, fy = front[..., 0].copy(), front[..., 1].copy()
+        front[..., 0] = fx * c - fy * s + self.wb
+        front[..., 1] = fx * s + fy * c
+        parts[:, self.steered] = front
+
+        c, s = np.cos(yaw)[:, None, None], np.sin(yaw)[:, None, None]
+        px, py = parts[..., 0], parts[..., 1]
+        outlines = np.empty_like(parts)
+        outlines[..., 0] = px * c - py * s + x[:, None, None]
+        outlines[..., 1] = px * s + py * c + y[:, None, None]
+        return outlines
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_template(items):
+    return VehicleTemplate(dict(items))
+
+
+def vehicle_template(geometry):
+    """VehicleTemplate of a geometry, built once per distinct geometry"""
+    return _cached_template(tuple(sorted(geometry.items())))
+
+
+def car_outlines(x, y, yaw, steer, geometry):
+    """
+    Closed outlines of the body and the four wheels of one vehicle
+
+    Returns
+    -------
+    outlines : list of ndarray
+        (2, 5) arrays of x and y coordinates in the order body, front right,
+        rear right, front left and rear left wheel.
+    """
+    outlines = vehicle_template(geometry).transform(x, y, yaw, steer)[0]
+    return [outline.T for outline in outlines]
+
+
+def vehicle_segments(x, y, yaw, steer, geometry):
+    """Outlines of all parts of all vehicles as (N * N_PARTS, 5, 2) polylines"""
+    outlines = vehicle_template(geometry).transform(x, y, yaw, steer)
+    return outlines.reshape(-1, 5, 2)
+
+
+def draw_vehicles(ax, x, y, yaw, steer, geometry, filled=False, **kwargs):
+    """
+    Draw any number of vehicles as one collection
+
+    The outlines are a LineCollection, or a PolyCollection if `filled`.
+    kwargs are passed to the collection, e.g. colors or alpha. Returns the
+    collection, its outlines are updated with
+    `set_segments` / `set_verts` and `vehicle_segments`.
+    """
+    from matplotlib.collections import LineCollection, PolyCollection
+
+    segments = vehicle_segments(x, y, yaw, steer, geometry)
+    if filled:
+        collection = PolyCollection(segments, **kwargs)
+    else:
+        kwargs.setdefault("colors", "k")
+        collection = LineCollection(segments, **kwargs)
+    ax.add_collection(collection)
+    return collection